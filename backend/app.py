@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, make_response
 from flask_cors import CORS
 from flask_socketio import SocketIO
 import paho.mqtt.client as mqtt
@@ -6,10 +6,24 @@ import json
 import time
 import threading
 import re
+import zlib
+from functools import wraps
 from decimal import Decimal
-from datetime import datetime
-from config import MQTT_CONFIG, PORT, DEBUG
-from db import test_connection, get_all_meters, get_meter_info, get_meter_readings, get_daily_readings, update_meter_name, delete_meter, get_unnamed_meters, check_meter_number_exists, update_meter_info
+from datetime import datetime, timedelta, timezone
+from config import MQTT_CONFIG, CACHE_CONFIG, HEALTH_CONFIG, ROLLUP_CONFIG, SNAPSHOT_CONFIG, INGEST_CONFIG, MQTT_QUEUE_CONFIG, FANOUT_CONFIG, POWER_STATE_CONFIG, COMMAND_CONFIG, BULK_CONFIG, PORT, DEBUG
+from compression import init_compression, etag_variants
+from cache import meter_cache, change_versions, meter_tag, invalidate_meter, FLEET_TAG
+from health import HealthMonitor
+from snapshot import FleetSnapshot
+from ingest import ReadingWriter, PowerStates, INSERT_STATUS, parse_reading
+from workqueue import WorkQueue
+from fanout import Coalescer
+from mqtt_router import TopicRouter
+from commands import PowerCommands
+from bulk import BulkPowerJobs, TokenBucket, select_meters
+from rollup import RollupRunner, ROLLUPS, RESOLUTIONS, choose_rollup, ensure_rollups
+from migrations import pending_migrations
+from db import test_connection, get_pool_stats, ensure_meter_latest, get_meter_latest_state, get_all_meters, get_meter_info, get_meters_info, get_meter_readings, get_meter_readings_range, decode_reading_cursor, encode_reading_cursor, count_readings, get_meter_stats, get_daily_readings, update_meter_name, delete_meter, get_unnamed_meters, update_meter_info, load_meter_index, get_meter_index, get_latest_statuses, NumberInUseError, DatabaseReadError
 
 # Tilpasset JSON encoder der kan håndtere Decimal og datetime typer
 class CustomJSONEncoder(json.JSONEncoder):
@@ -23,10 +37,98 @@ class CustomJSONEncoder(json.JSONEncoder):
 # Opret Flask app
 app = Flask(__name__)
 CORS(app)
+init_compression(app)
 # Brug vores tilpassede JSON encoder
 app.json_encoder = CustomJSONEncoder
 socketio = SocketIO(app, cors_allowed_origins="*", ping_timeout=60, ping_interval=25)
 
+def start_thread(target, *args):
+    """Start en baggrundsløkke i en rigtig tråd, som MQTT-tråden.
+    
+    Med eventlet installeret kører Socket.IO i eventlet-tilstand uden monkey patching. En
+    grøn opgave fra socketio.start_background_task der kalder time.sleep, venter på en
+    threading-lås eller taler med databasen, blokerer derfor hele serveren.
+    """
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+def conditional(tag_for):
+    """Besvar GET med ETag/Last-Modified ud fra ændringsversionen for et tag.
+    
+    tag_for(**view_args) giver tagget (en måler eller hele flåden). Matcher klientens
+    If-None-Match eller If-Modified-Since svares 304 uden at røre databasen.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            tag = tag_for(**kwargs)
+            version, changed = change_versions.get(tag)
+            # Forskellige query strings (limit, format, ...) er forskellige repræsentationer
+            variant = zlib.crc32(request.query_string)
+            etag = f"{int(change_versions.started):x}-{tag}-{version}-{variant:08x}"
+            last_modified = datetime.fromtimestamp(int(changed), timezone.utc)
+            
+            # Klienten kan have den rå eller en komprimeret repræsentation (se compression.py)
+            matched = None
+            if request.if_none_match:
+                matched = next((e for e in etag_variants(etag) if request.if_none_match.contains(e)), None)
+            elif request.if_modified_since is not None and request.if_modified_since >= last_modified:
+                matched = etag
+            
+            if matched:
+                response = app.response_class(status=304)
+                response.set_etag(matched)
+            else:
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+                response.set_etag(etag)
+            
+            response.last_modified = last_modified
+            # Browseren må gemme svaret, men skal altid revalidere
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+@app.errorhandler(DatabaseReadError)
+def database_read_error(e):
+    # Et tomt svar ville få et ETag og blive revalideret med 304, også når databasen er tilbage
+    return jsonify({'error': f'Databasefejl: {e}'}), 500
+
+def fleet_tag(**kwargs):
+    return FLEET_TAG
+
+def mac_tag(mac, **kwargs):
+    return meter_tag(mac)
+
+def meters_written(macs):
+    """Nye målinger eller statusskift er skrevet - cachen for målerne og oversigten er forældet"""
+    for mac in macs:
+        invalidate_meter(mac)
+
+# Skriver målinger fra maaler/+/data til energimaaling i batches
+reading_writer = ReadingWriter(
+    batch_size=INGEST_CONFIG['batch_size'],
+    flush_interval=INGEST_CONFIG['flush_interval'],
+    max_pending=INGEST_CONFIG['max_pending'],
+    on_flush=meters_written
+)
+
+# Tændt/slukket fra stat/+/Power - kun skift gemmes i maalerstatus, i batches
+power_states = PowerStates(
+    ReadingWriter(
+        batch_size=POWER_STATE_CONFIG['batch_size'],
+        flush_interval=POWER_STATE_CONFIG['flush_interval'],
+        max_pending=POWER_STATE_CONFIG['max_pending'],
+        on_flush=meters_written,
+        statement=INSERT_STATUS,
+        label="statusskift"
+    ),
+    priority=POWER_STATE_CONFIG['priority']
+)
+
 # MQTT klient
 mqtt_client = None
 connected_to_mqtt = False
@@ -38,12 +140,11 @@ def on_mqtt_connect(client, userdata, flags, rc, properties=None):
     if rc == 0:
         connected_to_mqtt = True
         print("Forbundet til MQTT broker")
-        # Abonner på relevante emner
-        client.subscribe("maaler/+/status")
-        client.subscribe("maaler/+/data")
-        # Abonner på Power-relaterede emner
-        client.subscribe("stat/+/Power")
-        print("Abonneret på MQTT-emner: maaler/+/status, maaler/+/data, stat/+/Power")
+        # Abonner på emnerne routeren har handlere for
+        patterns = mqtt_router.patterns()
+        for pattern in patterns:
+            client.subscribe(pattern)
+        print(f"Abonneret på MQTT-emner: {', '.join(patterns)}")
     else:
         connected_to_mqtt = False
         print(f"Fejl ved forbindelse til MQTT broker. Returkode: {rc}")
@@ -58,57 +159,127 @@ def on_mqtt_connect(client, userdata, flags, rc, properties=None):
             print(f"Fejldetaljer: {error_messages[rc]}")
         print(f"Forbindelsesparametre: Host={MQTT_CONFIG['host']}, Port={MQTT_CONFIG['port']}, User={MQTT_CONFIG['user']}")
 
-# Callback når en besked modtages fra MQTT
+# Callback når en besked modtages fra MQTT - kører på paho's netværkstråd og lægger
+# derfor kun beskeden i kø; behandlingen sker i mqtt_queue's workers
 def on_mqtt_message(client, userdata, message, properties=None):
-    print(f"Modtaget besked på emne: {message.topic}, payload: {message.payload.decode()}")
-    try:
-        topic = message.topic
-        payload_str = message.payload.decode()
-        
-        # Håndter Power-kommandoer særskilt
-        if 'Power' in topic:
-            print(f"Power-kommando modtaget: {topic} - {payload_str}")
-            
-            # Emnet kan være i formatet: stat/obkXXXXXXXXXXXX/Power
-            parts = topic.split('/')
-            if len(parts) >= 2:
-                mac_part = parts[1]
-                if mac_part.startswith('obk'):
-                    mac_no_colon = mac_part.replace('obk', '')
-                    
-                    # Indsæt kolon i MAC-adressen for at matche formatet i vores app
-                    mac = ':'.join([mac_no_colon[i:i+2] for i in range(0, len(mac_no_colon), 2)])
-                    
-                    # Bestem status baseret på payload
-                    status = "Tændt" if payload_str == "ON" else "Slukket"
-                    
-                    # Send status-opdatering til frontend
-                    print(f"Sender power_status_update til frontend: {mac} - {status}")
-                    socketio.emit('power_status_update', {
-                        'mac': mac,
-                        'status': status,
-                        'timestamp': datetime.now().isoformat()
-                    })
-                    
-                    print(f"Status for {mac} opdateret til {status}")
-                    return  # Afslut funktionen her, da vi har håndteret Power-kommandoen
-        
-        # Forsøg at parse payload som JSON
-        try:
-            payload = json.loads(payload_str)
-        except json.JSONDecodeError:
-            # Hvis payload ikke er JSON, brug raw string
-            payload = payload_str
-        
-        # Videreformidl besked til forbundne webklienter via SocketIO
+    topic = message.topic
+    # Samme måler på samme worker, så dens beskeder behandles i rækkefølge. Kasserede
+    # beskeder ved fuld kø tælles og logges samlet af mqtt_queue
+    mqtt_queue.put(mqtt_router.key(topic), topic, message.payload, datetime.utcnow())
+
+def process_mqtt_message(topic, payload_bytes, received):
+    """Behandl en MQTT-besked fra køen (received er modtagelsestidspunktet i UTC)"""
+    if not mqtt_router.dispatch(topic, payload_bytes, received):
+        print(f"Ingen behandling af besked på emne: {topic}")
+
+# Nyeste besked pr. emne sendes til webklienterne som ét 'mqtt_batch'-event pr. vindue
+mqtt_fanout = Coalescer(socketio.emit, event='mqtt_batch', window=FANOUT_CONFIG['window'])
+
+def forward_mqtt(topic, payload):
+    """Videreformidl en besked til forbundne webklienter via SocketIO"""
+    if FANOUT_CONFIG['window'] > 0:
+        mqtt_fanout.publish(topic, payload)
+    else:
         socketio.emit('mqtt_message', {
             'topic': topic,
             'payload': payload
         })
-        
-        print(f"Modtaget MQTT besked: {topic} - {payload}")
-    except Exception as e:
-        print(f"Fejl ved håndtering af MQTT-besked: {e}")
+
+# Målernes enhedsnavn: obk efterfulgt af MAC-adressen (8 hex-tegn)
+METER_DEVICE = re.compile(r'obk[0-9A-Fa-f]{8}')
+
+def emit_power_status(message, on):
+    """Gem og send en måleres tændt/slukket - returnerer False hvis enheden ikke er en af
+    vores målere (brokeren deles med andre Tasmota-enheder, som ikke må blive til målere)"""
+    if not message.device or not METER_DEVICE.fullmatch(message.device):
+        return False
+    status = "Tændt" if on else "Slukket"
+    # Gem skiftet med MAC-adressen i databasens format (8 hex-tegn)
+    if POWER_STATE_CONFIG['enabled']:
+        power_states.update(message.mac, status, message.received)
+    # Svaret kvitterer for en sendt tænd/sluk-kommando
+    power_commands.acknowledge(message.mac, status)
+    
+    # Frontenden kender MAC-adressen med kolon fra Power-beskederne
+    mac = mqtt_router.macs.colon_mac(message.device)
+    socketio.emit('power_status_update', {
+        'mac': mac,
+        'status': status,
+        'timestamp': datetime.now().isoformat()
+    })
+    print(f"Status for {mac} opdateret til {status}")
+    return True
+
+# Emner vi abonnerer på og deres handlere - nye enhedsemner tilføjes her
+mqtt_router = TopicRouter()
+
+@mqtt_router.route('maaler/+/status', 'status')
+def handle_meter_status(message):
+    # Målerens data er ændret - cachen udløber kort efter, når databasen er skrevet
+    invalidate_meter(message.mac, delay=CACHE_CONFIG['mqtt_invalidate_delay'])
+    forward_mqtt(message.topic, message.payload)
+
+@mqtt_router.route('maaler/+/data', 'data')
+def handle_meter_data(message):
+    invalidate_meter(message.mac, delay=CACHE_CONFIG['mqtt_invalidate_delay'])
+    # Gem målinger fra maaler/<mac>/data
+    if INGEST_CONFIG['enabled']:
+        reading = parse_reading(message.mac, message.payload, message.received)
+        if reading:
+            reading_writer.add(reading)
+        else:
+            print(f"Ugyldig måling på {message.topic}: {message.text}")
+    forward_mqtt(message.topic, message.payload)
+
+@mqtt_router.route('stat/+/Power', 'power_state', payload='text')
+def handle_power_state(message):
+    # Emnet er i formatet: stat/obkXXXXXXXX/Power med payload ON eller OFF
+    if not emit_power_status(message, message.text == "ON"):
+        forward_mqtt(message.topic, message.text)
+        return
+    invalidate_meter(message.mac, delay=CACHE_CONFIG['mqtt_invalidate_delay'])
+
+# OpenBeken sender el-værdier i Tasmota-format: {"ENERGY": {"Voltage": ..., "Current": ..., ...}}
+# Effekten hedder active_power, så den ikke forveksles med målerens tændt/slukket (power)
+ENERGY_FIELDS = {'Voltage': 'voltage', 'Current': 'current', 'Power': 'active_power', 'Total': 'total'}
+
+@mqtt_router.route('tele/+/SENSOR', 'sensor')
+def handle_sensor(message):
+    energy = message.payload.get('ENERGY') if isinstance(message.payload, dict) else None
+    if not isinstance(energy, dict):
+        return
+    values = {field: energy[key] for key, field in ENERGY_FIELDS.items() if key in energy}
+    forward_mqtt(message.topic, {'mac': message.mac, **values})
+
+@mqtt_router.route('tele/+/STATE', 'state')
+def handle_state(message):
+    if not isinstance(message.payload, dict):
+        return
+    power = message.payload.get('POWER')
+    # Andre enheders STATE videresendes kun
+    if power in ("ON", "OFF") and emit_power_status(message, power == "ON"):
+        invalidate_meter(message.mac, delay=CACHE_CONFIG['mqtt_invalidate_delay'])
+    forward_mqtt(message.topic, {'mac': message.mac, **message.payload})
+
+# OpenBeken sender også hver værdi for sig på <enhed>/<værdi>/get
+def handle_measurement(message):
+    if message.payload is None:
+        return
+    forward_mqtt(message.topic, {'mac': message.mac, message.kind: message.payload})
+
+for measurement, field in (('voltage', 'voltage'), ('current', 'current'), ('power', 'active_power')):
+    mqtt_router.add(f'+/{measurement}/get', field, handle_measurement, payload='float')
+
+# Kø mellem paho's netværkstråd og behandlingen af beskeder
+mqtt_queue = WorkQueue(
+    process_mqtt_message,
+    workers=MQTT_QUEUE_CONFIG['workers'],
+    maxsize=MQTT_QUEUE_CONFIG['maxsize'],
+    policy=MQTT_QUEUE_CONFIG['overflow_policy'],
+    block_timeout=MQTT_QUEUE_CONFIG['block_timeout'],
+    name="MQTT-køen",
+    log_interval=MQTT_QUEUE_CONFIG['drop_log_interval']
+)
 
 # Callback når forbindelsen til MQTT afbrydes
 def on_mqtt_disconnect(client, userdata, rc, properties=None):
@@ -229,29 +400,214 @@ def ensure_mqtt_connection():
     
     return connected_to_mqtt
 
-# API-endpoint: Sundhedstjek
+def publish_command(topic, payload):
+    """Publicer en kommando uden at vente på brokeren - returnerer MQTT-returkoden"""
+    if not mqtt_client or not connected_to_mqtt:
+        return mqtt.MQTT_ERR_NO_CONN
+    return mqtt_client.publish(topic, payload).rc
+
+def command_completed(command):
+    """Kommandoen er kvitteret, udløbet eller fejlet - fortæl webklienterne det"""
+    socketio.emit('power_command_result', command)
+    power_jobs.command_completed(command)
+
+# Tænd/sluk-kommandoer sendes én ad gangen pr. måler og kvitteres af stat/+/Power
+power_commands = PowerCommands(
+    publish_command,
+    timeout=COMMAND_CONFIG['ack_timeout'],
+    history=COMMAND_CONFIG['history'],
+    on_complete=command_completed
+)
+
+# Samlet tænd/sluk for mange målere - kommandoerne sendes gennem en token bucket
+power_jobs = BulkPowerJobs(
+    power_commands,
+    TokenBucket(BULK_CONFIG['rate'], BULK_CONFIG['burst']),
+    # Jobbet venter på låse i PowerCommands og paho, så det kører i en rigtig tråd
+    start_thread,
+    history=BULK_CONFIG['history'],
+    on_complete=lambda job: socketio.emit('power_job_completed', job)
+)
+
+def power_candidates():
+    """Alle kendte målere til filtrene: oversigten (målere med målinger eller status) plus
+    målere der kun har en række i maalerinfo. Navn og nummer tages fra maalerinfo."""
+    meters = {
+        meter['mac']: {'mac': meter['mac'], 'name': meter.get('name'), 'nummer': meter.get('number')}
+        for meter in cached_all_meters()
+    }
+    for meter in get_meter_index().all():
+        meters[meter['mac']] = meter
+    return list(meters.values())
+
+# Højst ét genforbindelsesforsøg ad gangen, uanset hvor mange kommandoer der fejler
+mqtt_reconnect_lock = threading.Lock()
+
+def reconnect_mqtt_in_background():
+    """Genforbind til MQTT i en baggrundstråd - ensure_mqtt_connection venter med time.sleep"""
+    if not mqtt_reconnect_lock.acquire(blocking=False):
+        return
+    def reconnect():
+        try:
+            ensure_mqtt_connection()
+        finally:
+            mqtt_reconnect_lock.release()
+    start_thread(reconnect)
+
+# Sundhedstjek kører i baggrunden, så endpoints aldrig venter på databasen
+health_monitor = HealthMonitor(
+    {'db': test_connection, 'mqtt': lambda: connected_to_mqtt},
+    interval=HEALTH_CONFIG['interval'],
+    timeout=HEALTH_CONFIG['timeout']
+)
+
+# Oversigt og målerinfo gemt på disk - serveres ved opstart indtil databasen har svaret
+fleet_snapshot = FleetSnapshot(
+    SNAPSHOT_CONFIG['path'] if SNAPSHOT_CONFIG['enabled'] else None,
+    interval=SNAPSHOT_CONFIG['interval']
+)
+
+def mark_stale(response, key, value):
+    """Marker et svar fra opstarts-snapshottet som forældet (Age angiver snapshottets alder)"""
+    if fleet_snapshot.is_stale(key, value):
+        response.headers['X-Stale'] = 'true'
+        age = fleet_snapshot.age()
+        if age is not None:
+            response.headers['Age'] = str(max(int(age), 0))
+    return response
+
+def rollups_changed(macs):
+    """Nye daglige tal - hent dem frisk næste gang de efterspørges"""
+    for mac in macs:
+        invalidate_meter(mac)
+
+# Holder energimaaling_daglig opdateret ud fra nye målinger
+rollup_runner = RollupRunner(
+    ROLLUPS,
+    interval=ROLLUP_CONFIG['interval'],
+    chunk_size=ROLLUP_CONFIG['chunk_size'],
+    max_chunks=ROLLUP_CONFIG['max_chunks'],
+    on_change=rollups_changed
+)
+
+# API-endpoint: Sundhedstjek (seneste resultat fra baggrundstjekket)
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    db_connected = test_connection()
+    checks = health_monitor.snapshot()
+    queue_stats = mqtt_queue.stats()
     return jsonify({
         'status': 'ok',
-        'db_connected': db_connected,
-        'mqtt_connected': connected_to_mqtt
+        'db_connected': checks['db']['ok'],
+        'mqtt_connected': checks['mqtt']['ok'],
+        'meter_latest': get_meter_latest_state(),
+        'mqtt_queue': {key: queue_stats[key] for key in ('depth', 'capacity', 'dropped', 'seconds_since_drop')},
+        'checks': checks
     })
 
+# API-endpoint: Processen kører (liveness)
+@app.route('/api/health/live', methods=['GET'])
+def health_live():
+    return jsonify({'status': 'ok'})
+
+# API-endpoint: Klar til trafik (readiness) - kræver at databasen svarer og cachen er varm
+@app.route('/api/health/ready', methods=['GET'])
+def health_ready():
+    checks = health_monitor.snapshot()
+    ready = checks['db']['ok'] and fleet_snapshot.warm
+    return jsonify({
+        'status': 'ready' if ready else 'not_ready',
+        'cache_warm': fleet_snapshot.warm,
+        'checks': checks
+    }), 200 if ready else 503
+
+# API-endpoint: Statistik for database connection pool
+@app.route('/api/db/pool', methods=['GET'])
+def db_pool_stats():
+    return jsonify(get_pool_stats())
+
 # API-endpoint: Hent alle målere
 @app.route('/api/meters', methods=['GET'])
+@conditional(fleet_tag)
 def get_meters():
-    meters = get_all_meters()
-    return jsonify(meters)
+    meters = cached_all_meters()
+    return mark_stale(jsonify(meters), ('meters',), meters)
+
+def cached_all_meters():
+    """Måleroversigten via cachen - tomme resultater (ingen målere eller fejl) gemmes ikke"""
+    return meter_cache.get_or_load(('meters',), get_all_meters, tags=(FLEET_TAG,), cacheable=bool)
+
+# API-endpoint: Cache-statistik
+@app.route('/api/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(meter_cache.stats())
+
+# API-endpoint: Statistik for MQTT-køen (dybde, behandlede og kasserede beskeder)
+@app.route('/api/mqtt/queue', methods=['GET'])
+def mqtt_queue_stats():
+    return jsonify(mqtt_queue.stats())
+
+# API-endpoint: Antal MQTT-beskeder pr. emnetype og emner uden handler
+@app.route('/api/mqtt/routes', methods=['GET'])
+def mqtt_route_stats():
+    stats = mqtt_router.stats()
+    stats['patterns'] = mqtt_router.patterns()
+    return jsonify(stats)
+
+# API-endpoint: Statistik for videresendelsen af MQTT-beskeder til webklienterne
+@app.route('/api/mqtt/fanout', methods=['GET'])
+def mqtt_fanout_stats():
+    return jsonify(mqtt_fanout.stats())
+
+# API-endpoint: Statistik for lagring af målinger fra MQTT
+@app.route('/api/ingest', methods=['GET'])
+def ingest_stats():
+    return jsonify({'enabled': INGEST_CONFIG['enabled'], **reading_writer.stats()})
+
+# API-endpoint: Seneste tændt/slukket i hukommelsen og lagring af statusskift
+@app.route('/api/power/states', methods=['GET'])
+def power_state_stats():
+    return jsonify({'enabled': POWER_STATE_CONFIG['enabled'], **power_states.stats()})
+
+# Maksimalt antal målere i ét batch-kald
+MAX_BATCH_METERS = 500
+
+# API-endpoint: Hent målerinfo for flere målere i ét kald
+@app.route('/api/meters/batch', methods=['GET', 'POST'])
+def get_meters_batch():
+    # MAC-adresser som liste i body ({"macs": [...]}) eller kommasepareret i query string (?macs=a,b)
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        macs = data.get('macs')
+        if not isinstance(macs, list):
+            return jsonify({'error': 'macs skal være en liste af MAC-adresser'}), 400
+    else:
+        macs = request.args.get('macs', default='').split(',')
+    
+    # Fjern tomme værdier og dubletter men bevar rækkefølgen
+    macs = list(dict.fromkeys(str(mac).strip() for mac in macs if str(mac).strip()))
+    if not macs:
+        return jsonify({'error': 'Ingen MAC-adresser angivet'}), 400
+    if len(macs) > MAX_BATCH_METERS:
+        return jsonify({'error': f'Højst {MAX_BATCH_METERS} målere pr. kald'}), 400
+    
+    result = get_meters_info(macs)
+    if 'error' in result:
+        return jsonify(result), 500
+    return jsonify(result)
 
 # API-endpoint: Hent målerinfo
 @app.route('/api/meters/<mac>')
+@conditional(mac_tag)
 def get_meter(mac):
     try:
-        meter = get_meter_info(mac)
+        meter = meter_cache.get_or_load(
+            ('meter', mac),
+            lambda: get_meter_info(mac),
+            tags=(meter_tag(mac),),
+            cacheable=lambda m: 'error' not in m
+        )
         if meter and 'error' not in meter:
-            return jsonify(meter)
+            return mark_stale(jsonify(meter), ('meter', mac), meter)
         elif meter and 'error' in meter:
             return jsonify(meter), 500
         return jsonify({'error': 'Måler ikke fundet', 'mac': mac}), 404
@@ -261,21 +617,121 @@ def get_meter(mac):
 
 # API-endpoint: Hent måleraflæsninger
 @app.route('/api/meters/<mac>/readings', methods=['GET'])
+@conditional(mac_tag)
 def get_readings(mac):
     limit = request.args.get('limit', default=200, type=int)
-    readings = get_meter_readings(mac, limit)
-    return jsonify(readings)
+    columnar = request.args.get('format') == 'columns'
+    
+    # Tidsrum med from/to (og evt. points) giver et nedsamplet udsnit i stedet for de seneste N
+    if request.args.get('from') or request.args.get('to'):
+        return get_readings_range(mac, columnar)
+    
+    before = request.args.get('before')
+    after = request.args.get('after')
+    if before and after:
+        return jsonify({'error': 'Angiv enten before eller after, ikke begge'}), 400
+    
+    try:
+        before_cursor = decode_reading_cursor(before) if before else None
+        after_cursor = decode_reading_cursor(after) if after else None
+    except (ValueError, OverflowError, OSError):
+        # Epoch-sekunder uden for datetime's område giver OverflowError/OSError
+        return jsonify({'error': 'Ugyldig cursor'}), 400
+    
+    readings = get_meter_readings(mac, limit, before=before_cursor, after=after_cursor, columnar=columnar)
+    
+    # Cursor til næste side i samme retning - None når der ikke er flere målinger
+    next_cursor = None
+    count = count_readings(readings)
+    if count and count == limit:
+        next_cursor = encode_reading_cursor(readings, 0 if after_cursor else -1)
+    
+    # Uden cursor svares med den simple liste som før; cursoren sendes i en header
+    if before_cursor is None and after_cursor is None:
+        response = jsonify(readings)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
+    
+    if columnar:
+        return jsonify({**readings, 'next_cursor': next_cursor})
+    return jsonify({
+        'readings': readings,
+        'next_cursor': next_cursor
+    })
+
+# Standard og maksimalt antal punkter ved nedsampling af et tidsrum
+DEFAULT_CHART_POINTS = 1000
+MAX_CHART_POINTS = 10000
+
+def parse_time_arg(value):
+    """Fortolk et tidspunkt fra query string - ISO 8601 eller epoch-sekunder (UTC).
+    Rejser ValueError, eller OverflowError/OSError for epoch-sekunder uden for datetime's område"""
+    if value.isdigit():
+        return datetime.utcfromtimestamp(int(value))
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def get_readings_range(mac, columnar):
+    try:
+        end = parse_time_arg(request.args['to']) if request.args.get('to') else datetime.utcnow()
+        start = parse_time_arg(request.args['from']) if request.args.get('from') else end - timedelta(days=1)
+    except (ValueError, OverflowError, OSError):
+        return jsonify({'error': 'Ugyldigt tidspunkt i from/to'}), 400
+    if start > end:
+        return jsonify({'error': 'from skal ligge før to'}), 400
+    
+    points = request.args.get('points', default=DEFAULT_CHART_POINTS, type=int)
+    if points < 3 or points > MAX_CHART_POINTS:
+        return jsonify({'error': f'points skal være mellem 3 og {MAX_CHART_POINTS}'}), 400
+    
+    # Groveste aggregerede tabel der stadig har nok intervaller til points - eller rå målinger
+    resolution = request.args.get('resolution', default='auto')
+    if resolution == 'auto':
+        rollup = choose_rollup(start, end, points) if ROLLUP_CONFIG['enabled'] else None
+    elif resolution == 'raw':
+        rollup = None
+    elif resolution in RESOLUTIONS:
+        rollup = RESOLUTIONS[resolution]
+    else:
+        return jsonify({'error': f"resolution skal være auto, raw eller en af {', '.join(RESOLUTIONS)}"}), 400
+    
+    readings, raw_count = get_meter_readings_range(mac, start, end, points, columnar=columnar, rollup=rollup)
+    response = jsonify(readings)
+    response.headers['X-Raw-Count'] = str(raw_count)
+    response.headers['X-Resolution'] = next((name for name, r in RESOLUTIONS.items() if r is rollup), 'raw')
+    return response
+
+# API-endpoint: Hent statistik for en måler uden at scanne historikken
+@app.route('/api/meters/<mac>/stats', methods=['GET'])
+@conditional(mac_tag)
+def get_stats(mac):
+    stats = get_meter_stats(mac)
+    if stats is None:
+        return jsonify({'error': 'Måler ikke fundet', 'mac': mac}), 404
+    if 'error' in stats:
+        return jsonify(stats), 500
+    return jsonify(stats)
 
 # API-endpoint: Hent daglige måleraflæsninger
 @app.route('/api/meters/<mac>/daily', methods=['GET'])
+@conditional(mac_tag)
 def get_daily(mac):
     days = request.args.get('days', default=30, type=int)
-    readings = get_daily_readings(mac, days)
+    columnar = request.args.get('format') == 'columns'
+    readings = meter_cache.get_or_load(
+        ('daily', mac, days, columnar),
+        lambda: get_daily_readings(mac, days, columnar=columnar),
+        tags=(meter_tag(mac),),
+        cacheable=lambda r: count_readings(r) > 0
+    )
     return jsonify(readings)
 
 # API-endpoint: Opdater måler-navn
 @app.route('/api/meter/update', methods=['POST'])
-def update_meter_name():
+def update_meter_endpoint():
     try:
         # Hent data fra request
         data = request.json
@@ -292,21 +748,18 @@ def update_meter_name():
                 'message': 'Nummer skal være 3 cifre (000-999)'
             }), 400
             
-        # Konverter nummer til integer for at sikre korrekt format
-        number_int = int(data['number'])
-        
-        # Tjek om nummeret allerede er i brug af en anden måler
-        existing_meter = check_meter_number_exists(number_int)
-        if existing_meter and existing_meter['mac'] != data['mac']:
+        # Databasens unikke indeks på nummer afgør atomisk om nummeret er ledigt
+        try:
+            success = update_meter_info(data['mac'], data['name'], data['number'])
+        except NumberInUseError as e:
             return jsonify({
                 'status': 'error',
-                'message': f'Måler-nummer {data["number"]} er allerede i brug af {existing_meter["name"]}'
+                'message': f'Måler-nummer {data["number"]} er allerede i brug af {e.holder["name"]}'
             }), 409
         
-        # Opdater eller opret måler i databasen
-        success = update_meter_info(data['mac'], data['name'], number_int)
-        
         if success:
+            invalidate_meter(data['mac'])
+            
             # Log til konsollen
             print(f"Måler opdateret: MAC={data['mac']}, Navn={data['name']}, Nummer={data['number']}")
             
@@ -341,6 +794,27 @@ def update_meter_name():
             'error': error_msg
         }), 500
 
+# API-endpoint: Ledige målernumre (besvares fra indekset i hukommelsen)
+@app.route('/api/meters/numbers', methods=['GET'])
+def meter_numbers():
+    index = get_meter_index()
+    result = {
+        'next_free': index.next_free(),
+        'free_count': index.free_count()
+    }
+    number = request.args.get('number')
+    if number is not None:
+        if not re.match(r'^\d{3}$', number):
+            return jsonify({'error': 'Nummer skal være 3 cifre (000-999)'}), 400
+        holder = index.holder(number)
+        result.update({
+            'number': number,
+            'free': holder is None,
+            'mac': holder['mac'] if holder else None,
+            'name': holder['name'] if holder else None
+        })
+    return jsonify(result)
+
 # API-endpoint: Opdater målernavn
 @app.route('/api/meters/<mac>/name', methods=['POST'])
 def update_name(mac):
@@ -348,8 +822,14 @@ def update_name(mac):
     if not data or 'name' not in data or 'number' not in data:
         return jsonify({'error': 'Manglende navn eller nummer'}), 400
     
-    success = update_meter_name(mac, data['name'], data['number'])
+    try:
+        success = update_meter_name(mac, data['name'], data['number'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except NumberInUseError as e:
+        return jsonify({'error': str(e), 'mac': e.holder['mac']}), 409
     if success:
+        invalidate_meter(mac)
         return jsonify({'status': 'ok'})
     return jsonify({'error': 'Kunne ikke opdatere målerinfo'}), 500
 
@@ -362,68 +842,97 @@ def delete_meter_endpoint(mac):
     
     success = delete_meter(mac)
     if success:
+        invalidate_meter(mac)
+        power_states.forget(meter_tag(mac))
         return jsonify({'status': 'ok'})
     return jsonify({'error': 'Kunne ikke slette måler'}), 500
 
+def submit_power_command(mac, action):
+    """Læg en tænd/sluk-kommando i kø og svar med det samme med kommandoens id"""
+    if not connected_to_mqtt:
+        # Genforbind i baggrunden i stedet for at holde HTTP-kaldet hen
+        reconnect_mqtt_in_background()
+        return jsonify({'error': 'Ikke forbundet til MQTT - forsøger at genforbinde'}), 503
+    
+    command = power_commands.submit(mac, action, source='api')
+    if command['state'] == 'failed':
+        return jsonify({'error': command['error'], 'command': command}), 500
+    
+    message = 'Kommando sendt til måleren' if command['state'] == 'sent' else 'Kommando sat i kø efter tidligere kommando til måleren'
+    return jsonify({
+        'status': 'ok',
+        'message': message,
+        'topic': command['topic'],
+        'payload': command['payload'],
+        'command_id': command['id'],
+        'command': command
+    }), 202
+
 # API-endpoint: Tænd måler
 @app.route('/api/meters/<mac>/on', methods=['POST'])
 def turn_on_meter(mac):
-    # Sikrer MQTT-forbindelse
-    if not ensure_mqtt_connection():
-        return jsonify({'error': 'Ikke forbundet til MQTT efter genforbindelsesforsøg'}), 503
-    
-    # Fjern kolon fra MAC-adressen for at matche MQTT-emneformatet
-    mac_no_colon = mac.replace(':', '')
-    
-    # Send MQTT-besked for at tænde måleren med korrekt format
-    topic = f"cmnd/obk{mac_no_colon}/Power"
-    payload = "ON"
-    
-    print(f"Sender MQTT-kommando: {topic} med payload: {payload}")
-    
-    try:
-        result = mqtt_client.publish(topic, payload)
-        
-        # Tjek om beskeden blev sendt korrekt
-        if result.rc == 0:
-            print(f"MQTT-kommando sendt: {topic} = {payload}")
-            return jsonify({'status': 'ok', 'message': 'Kommando sendt til måleren', 'topic': topic, 'payload': payload})
-        else:
-            print(f"Fejl ved afsendelse af MQTT-kommando. Fejlkode: {result.rc}")
-            return jsonify({'error': f'Kunne ikke sende kommando. Fejlkode: {result.rc}'}), 500
-    except Exception as e:
-        print(f"Exception ved afsendelse af MQTT-kommando: {e}")
-        return jsonify({'error': f'Fejl ved afsendelse af kommando: {str(e)}'}), 500
+    return submit_power_command(mac, 'on')
 
 # API-endpoint: Sluk måler
 @app.route('/api/meters/<mac>/off', methods=['POST'])
 def turn_off_meter(mac):
-    # Sikrer MQTT-forbindelse
-    if not ensure_mqtt_connection():
-        return jsonify({'error': 'Ikke forbundet til MQTT efter genforbindelsesforsøg'}), 503
-    
-    # Fjern kolon fra MAC-adressen for at matche MQTT-emneformatet
-    mac_no_colon = mac.replace(':', '')
+    return submit_power_command(mac, 'off')
+
+# API-endpoint: Tænd eller sluk mange målere på én gang.
+# Body: {"action": "on"|"off", "macs": [...]} eller {"action": ..., "filter": "all"|"all_named"|
+# "name_prefix"|"number_range", "prefix": ..., "from": ..., "to": ...}. Svarer med et job.
+@app.route('/api/meters/power', methods=['POST'])
+def bulk_power():
+    data = request.json or {}
+    action = data.get('action')
+    if action not in ('on', 'off'):
+        return jsonify({'error': 'Ugyldig handling. Brug "on" eller "off"'}), 400
     
-    # Send MQTT-besked for at slukke måleren med korrekt format
-    topic = f"cmnd/obk{mac_no_colon}/Power"
-    payload = "OFF"
+    if 'macs' in data:
+        macs = data['macs']
+        if not isinstance(macs, list) or not all(isinstance(mac, str) and mac.strip() for mac in macs):
+            return jsonify({'error': 'macs skal være en liste af MAC-adresser'}), 400
+        selection = {'macs': len(macs)}
+    elif 'filter' in data:
+        selection = {key: data[key] for key in ('filter', 'prefix', 'from', 'to') if key in data}
+        try:
+            macs = select_meters(power_candidates(), data['filter'], data.get('prefix'), data.get('from'), data.get('to'))
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+    else:
+        return jsonify({'error': 'Angiv macs eller filter'}), 400
     
-    print(f"Sender MQTT-kommando: {topic} med payload: {payload}")
+    if not macs:
+        return jsonify({'error': 'Ingen målere valgt'}), 400
+    if len(macs) > BULK_CONFIG['max_meters']:
+        return jsonify({'error': f"Højst {BULK_CONFIG['max_meters']} målere pr. job"}), 400
+    if not connected_to_mqtt:
+        reconnect_mqtt_in_background()
+        return jsonify({'error': 'Ikke forbundet til MQTT - forsøger at genforbinde'}), 503
     
-    try:
-        result = mqtt_client.publish(topic, payload)
-        
-        # Tjek om beskeden blev sendt korrekt
-        if result.rc == 0:
-            print(f"MQTT-kommando sendt: {topic} = {payload}")
-            return jsonify({'status': 'ok', 'message': 'Kommando sendt til måleren', 'topic': topic, 'payload': payload})
-        else:
-            print(f"Fejl ved afsendelse af MQTT-kommando. Fejlkode: {result.rc}")
-            return jsonify({'error': f'Kunne ikke sende kommando. Fejlkode: {result.rc}'}), 500
-    except Exception as e:
-        print(f"Exception ved afsendelse af MQTT-kommando: {e}")
-        return jsonify({'error': f'Fejl ved afsendelse af kommando: {str(e)}'}), 500
+    job = power_jobs.submit(macs, action, selection)
+    return jsonify({'status': 'ok', 'job_id': job['id'], 'total': job['total'], 'job': job}), 202
+
+# API-endpoint: Status for et tænd/sluk-job med resultat pr. måler
+@app.route('/api/meters/power/<job_id>', methods=['GET'])
+def bulk_power_job(job_id):
+    job = power_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Ukendt job'}), 404
+    return jsonify(job)
+
+# API-endpoint: Status for en tænd/sluk-kommando (queued, sent, acknowledged, timeout eller failed)
+@app.route('/api/commands/<command_id>', methods=['GET'])
+def get_command(command_id):
+    command = power_commands.get(command_id)
+    if command is None:
+        return jsonify({'error': 'Ukendt kommando'}), 404
+    return jsonify(command)
+
+# API-endpoint: Ventende kommandoer og latens fra kommando til kvittering
+@app.route('/api/commands', methods=['GET'])
+def command_stats():
+    return jsonify(power_commands.stats())
 
 # API-endpoint: Søg efter nye målere
 @app.route('/api/scan', methods=['POST'])
@@ -441,11 +950,15 @@ def scan_for_meters():
                 meter['sidst_set'] = meter['sidst_set'].isoformat() if hasattr(meter['sidst_set'], 'isoformat') else str(meter['sidst_set'])
         
         # Hent også alle målere markeret som "Unavngivet" fra get_all_meters
-        all_meters = get_all_meters()
+        # Sæt af kendte MAC-adresser giver opslag i konstant tid ved fletningen
+        known_macs = {m['mac'] for m in unnamed_meters}
+        # Oversigten deles via cachen - kopier før felterne tilpasses
+        all_meters = [dict(meter) for meter in cached_all_meters()]
         for meter in all_meters:
             if meter.get('name') == 'Unavngivet':
                 # Tjek om denne måler allerede er i unnamed_meters
-                if not any(m['mac'] == meter['mac'] for m in unnamed_meters):
+                if meter['mac'] not in known_macs:
+                    known_macs.add(meter['mac'])
                     # Tilføj manglende felter hvis nødvendigt
                     if 'antal_dage_med_data' not in meter:
                         meter['antal_dage_med_data'] = 0
@@ -563,7 +1076,6 @@ def test_mqtt():
         test_message = f"Test besked fra web interface: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
         
         result = mqtt_client.publish(test_topic, test_message)
-        result.wait_for_publish()
         
         return jsonify({
             'status': 'success',
@@ -606,25 +1118,29 @@ def test_meter_control(mac, action):
                 'message': 'Ugyldig MAC-adresse format. Brug format: xx:xx:xx:xx:xx:xx'
             }), 400
         
-        # Fjern kolon fra MAC-adressen for at matche MQTT-emneformatet
-        mac_no_colon = mac.replace(':', '')
-        
-        # Opret MQTT-emne og payload
-        topic = f"cmnd/obk{mac_no_colon}/Power"
-        payload = "ON" if action == 'on' else "OFF"
-        
-        # Send kommando
-        result = mqtt_client.publish(topic, payload)
-        result.wait_for_publish()
+        # Send kommando - svaret kommer på /api/commands/<id> og som power_command_result
+        command = power_commands.submit(mac, action, source='test')
+        if command['state'] == 'failed':
+            return jsonify({
+                'status': 'error',
+                'message': command['error'],
+                'topic': command['topic'],
+                'payload': command['payload'],
+                'mac': mac,
+                'connected': connected_to_mqtt,
+                'command_id': command['id'],
+                'command': command
+            }), 502
         
         return jsonify({
             'status': 'success',
             'message': f'MQTT-kommando sendt: {action}',
-            'topic': topic,
-            'payload': payload,
+            'topic': command['topic'],
+            'payload': command['payload'],
             'mac': mac,
             'connected': connected_to_mqtt,
-            'publish_result': result.rc
+            'command_id': command['id'],
+            'command': command
         })
     except Exception as e:
         return jsonify({
@@ -644,14 +1160,58 @@ def handle_disconnect():
     print(f"Webclient afbrudt: {request.sid}")
 
 if __name__ == '__main__':
+    # Læg sidste snapshot af flåden i cachen, så oversigten kan vises med det samme
+    fleet_snapshot.load()
+    
     # Test database forbindelse
     if test_connection():
         print("Forbindelse til database oprettet")
     else:
         print("ADVARSEL: Kunne ikke forbinde til database")
     
+    # Advar hvis indeks-migreringer mangler (kør: python migrations.py migrate)
+    try:
+        pending = pending_migrations()
+        if pending:
+            print(f"ADVARSEL: {len(pending)} databasemigreringer mangler: {[m[1] for m in pending]}")
+    except Exception as e:
+        print(f"Kunne ikke kontrollere databasemigreringer: {e}")
+    
+    # Sørg for at meter_latest og dens triggers findes
+    ensure_meter_latest()
+    
+    # Navne og numre i hukommelsen til nummerkontrol
+    load_meter_index()
+    
+    # Aggregerede tabeller bygges løbende fra nye målinger
+    if ROLLUP_CONFIG['enabled'] and ensure_rollups():
+        rollup_runner.start(start_thread)
+    
+    # Skriv målinger fra MQTT i batches
+    if INGEST_CONFIG['enabled']:
+        reading_writer.start(start_thread)
+    
+    # Gem skift i tændt/slukket - den kendte status indlæses først, så gentagelser ikke gemmes
+    if POWER_STATE_CONFIG['enabled']:
+        power_states.load(get_latest_statuses())
+        power_states.writer.start(start_thread)
+    
+    # Start behandlingen af MQTT-beskeder før klienten begynder at modtage
+    mqtt_queue.start(start_thread)
+    if FANOUT_CONFIG['window'] > 0:
+        mqtt_fanout.start(start_thread)
+    
     # Start MQTT-klienten
     start_mqtt_thread()
     
+    # Udløb af tænd/sluk-kommandoer uden kvittering
+    power_commands.start(start_thread)
+    
+    # Start sundhedstjek i baggrunden
+    health_monitor.start(start_thread)
+    
+    # Hent aktuelle data til cachen i baggrunden og skriv snapshot løbende
+    fleet_snapshot.start(start_thread)
+    
     # Start Flask-SocketIO serveren
     socketio.run(app, host='0.0.0.0', port=PORT, debug=DEBUG)
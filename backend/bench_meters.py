@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import random
+import statistics
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, event, text
+import db
+from config import DB_CONFIG
+
+# Benchmark af get_all_meters ved voksende antal målere.
+# Kører mod en separat benchmark-database (BENCH_DB_NAME), så produktionsdata ikke røres.
+# Brug: python bench_meters.py [antal_målere,...] [målinger_pr_måler]
+
+BENCH_DB_NAME = os.getenv('BENCH_DB_NAME', f"{DB_CONFIG['database']}_bench")
+GENTAGELSER = 10
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS energimaaling (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        mac VARCHAR(32) NOT NULL,
+        tidspunkt DATETIME NOT NULL,
+        totalKwh DECIMAL(12, 3),
+        oprettet DATETIME DEFAULT CURRENT_TIMESTAMP,
+        KEY idx_energimaaling_mac_tid (mac, tidspunkt)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS maalerstatus (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        mac VARCHAR(32) NOT NULL,
+        tidspunkt DATETIME NOT NULL,
+        status VARCHAR(32),
+        prioritet INT,
+        oprettet DATETIME DEFAULT CURRENT_TIMESTAMP,
+        KEY idx_maalerstatus_mac_tid (mac, tidspunkt)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS maalerinfo (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        mac VARCHAR(32) NOT NULL,
+        name VARCHAR(255),
+        nummer VARCHAR(3),
+        oprettet DATETIME DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE KEY uq_maalerinfo_mac (mac)
+    )
+    """,
+]
+
+def get_bench_engine():
+    server_url = f"mysql+pymysql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}"
+    with create_engine(server_url).connect() as connection:
+        connection.execute(text(f"CREATE DATABASE IF NOT EXISTS `{BENCH_DB_NAME}`"))
+    return create_engine(f"{server_url}/{BENCH_DB_NAME}")
+
+def fill_database(engine, antal_maalere, maalinger_pr_maaler):
+    """Opret skema og fyld benchmark-databasen med syntetiske målere"""
+    with engine.begin() as connection:
+        for statement in SCHEMA:
+            connection.execute(text(statement))
+    # meter_latest og dens triggers holdes opdateret af indsættelserne nedenfor
+    db.ensure_meter_latest()
+
+    with engine.begin() as connection:
+        for table in ('energimaaling', 'maalerstatus', 'maalerinfo', 'meter_latest'):
+            connection.execute(text(f"TRUNCATE TABLE {table}"))
+
+        nu = datetime.now().replace(microsecond=0)
+        macs = [f"{0x08840000 + i:08X}" for i in range(antal_maalere)]
+        readings = []
+        statuses = []
+        infos = []
+        for i, mac in enumerate(macs):
+            kwh = random.uniform(0, 1000)
+            for n in range(maalinger_pr_maaler):
+                kwh += random.uniform(0, 0.05)
+                readings.append({"mac": mac, "tidspunkt": nu - timedelta(minutes=maalinger_pr_maaler - n), "kwh": round(kwh, 3)})
+            statuses.append({"mac": mac, "tidspunkt": nu, "status": random.choice(["Tændt", "Slukket"])})
+            if i % 2 == 0:
+                infos.append({"mac": mac, "name": f"Plads {i}", "nummer": f"{i % 1000:03d}"})
+
+        connection.execute(text("INSERT INTO energimaaling (mac, tidspunkt, totalKwh) VALUES (:mac, :tidspunkt, :kwh)"), readings)
+        connection.execute(text("INSERT INTO maalerstatus (mac, tidspunkt, status, prioritet) VALUES (:mac, :tidspunkt, :status, 10)"), statuses)
+        if infos:
+            connection.execute(text("INSERT INTO maalerinfo (mac, name, nummer) VALUES (:mac, :name, :nummer)"), infos)
+
+def measure(engine):
+    """Mål latenstid og antal SQL-sætninger for get_all_meters"""
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count_statement)
+    try:
+        db.get_all_meters()  # Opvarmning
+        timings = []
+        for _ in range(GENTAGELSER):
+            statements.clear()
+            start = time.perf_counter()
+            meters = db.get_all_meters()
+            timings.append((time.perf_counter() - start) * 1000)
+        return len(meters), len(statements), statistics.median(timings), max(timings)
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statement)
+
+if __name__ == "__main__":
+    sizes = [int(n) for n in sys.argv[1].split(',')] if len(sys.argv) > 1 else [50, 200, 800]
+    maalinger_pr_maaler = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    engine = get_bench_engine()
+    db.engine = engine
+
+    print(f"\n{'='*80}")
+    print(f"BENCHMARK get_all_meters - database: {BENCH_DB_NAME}, {maalinger_pr_maaler} målinger pr. måler")
+    print(f"{'='*80}")
+    print(f"{'MÅLERE':>8} | {'SQL-SÆTNINGER':>14} | {'MEDIAN (ms)':>12} | {'MAKS (ms)':>10}")
+    print(f"{'-'*8}-+-{'-'*14}-+-{'-'*12}-+-{'-'*10}")
+
+    for antal in sizes:
+        fill_database(engine, antal, maalinger_pr_maaler)
+        fundet, antal_statements, median_ms, max_ms = measure(engine)
+        print(f"{fundet:>8} | {antal_statements:>14} | {median_ms:>12.1f} | {max_ms:>10.1f}")
+
+    print(f"{'='*80}")
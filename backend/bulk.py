@@ -0,0 +1,187 @@
+import collections
+import threading
+import time
+import uuid
+from datetime import datetime
+from cache import meter_tag
+
+# Udvalg af målere til samlet tænd/sluk - der er ingen grupper i databasen, så en gruppe
+# er målere hvis navn starter med et præfiks eller hvis nummer ligger i et interval
+METER_FILTERS = ("all", "all_named", "name_prefix", "number_range")
+
+# Navne der betyder at måleren ikke er navngivet (som i get_unnamed_meters)
+UNNAMED = (None, "", "Unavngivet")
+
+def select_meters(meters, filter_name, prefix=None, number_from=None, number_to=None):
+    """MAC-adresser for målerne (dicts med mac, name, nummer) der matcher filteret"""
+    if filter_name not in METER_FILTERS:
+        raise ValueError(f"Ukendt filter: {filter_name}. Brug en af {', '.join(METER_FILTERS)}")
+    if filter_name == "all":
+        selected = meters
+    elif filter_name == "all_named":
+        selected = [meter for meter in meters if meter["name"] not in UNNAMED]
+    elif filter_name == "name_prefix":
+        if not prefix:
+            raise ValueError("name_prefix kræver et prefix")
+        prefix = prefix.lower()
+        selected = [
+            meter for meter in meters
+            if meter["name"] not in UNNAMED and meter["name"].lower().startswith(prefix)
+        ]
+    else:
+        if number_from is None or number_to is None:
+            raise ValueError("number_range kræver from og to")
+        low, high = int(number_from), int(number_to)
+        selected = [
+            meter for meter in meters
+            if meter["nummer"] and str(meter["nummer"]).isdigit() and low <= int(meter["nummer"]) <= high
+        ]
+    return sorted(meter["mac"] for meter in selected)
+
+class TokenBucket:
+    """Token bucket: højst rate handlinger pr. sekund i gennemsnit og burst på én gang"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, sleep=time.sleep):
+        """Vent til der er et token og brug det"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+class BulkPowerJobs:
+    """Tænd/sluk for mange målere som ét job.
+
+    submit() opretter jobbet og returnerer med det samme; en baggrundsopgave lægger
+    kommandoerne i PowerCommands i det tempo limiter tillader, så hverken brokeren eller
+    målerne på Wi-Fi oversvømmes. Kommandoerne til forskellige målere venter ikke på
+    hinanden, så et helt sæson-sluk tager sekunder. Jobbet følger hver målers kommando til
+    den er kvitteret, udløbet eller fejlet (command_completed) og kalder on_complete til sidst.
+    """
+
+    def __init__(self, commands, limiter, start_background_task, history=100, on_complete=None, sleep=time.sleep):
+        self.commands = commands
+        self.limiter = limiter
+        self.start_background_task = start_background_task
+        self.sleep = sleep  # skal passe til start_background_task (socketio.sleep til grønne opgaver)
+        self.history = history
+        self.on_complete = on_complete
+        self.lock = threading.Lock()
+        self.jobs = collections.OrderedDict()  # id -> job
+        self.command_jobs = {}  # kommando-id -> (job-id, mac)
+
+    def submit(self, macs, action, selection=None):
+        """Opret et job for MAC-adresserne - returnerer jobbet"""
+        # Samme måler kun én gang, selv om den er angivet i flere formater
+        unique = list({meter_tag(mac): mac for mac in macs}.values())
+        job = {
+            "id": uuid.uuid4().hex,
+            "action": action,
+            "selection": selection,
+            "state": "running",
+            "created": datetime.now().isoformat(),
+            "published": None,
+            "completed": None,
+            "total": len(unique),
+            "results": {mac: {"command_id": None, "state": "pending", "latency_ms": None, "error": None} for mac in unique}
+        }
+        with self.lock:
+            self.jobs[job["id"]] = job
+            self._trim()
+        self.start_background_task(self.run, job["id"], unique, action)
+        return self.get(job["id"])
+
+    def run(self, job_id, macs, action):
+        for mac in macs:
+            self.limiter.acquire(self.sleep)
+            try:
+                command = self.commands.submit(mac, action, source=f"job:{job_id}")
+            except Exception as e:
+                self._record(job_id, mac, {"state": "failed", "error": str(e)})
+                continue
+            with self.lock:
+                self.command_jobs[command["id"]] = (job_id, mac)
+                job = self.jobs.get(job_id)
+                if job is not None:
+                    job["results"][mac].update({
+                        "command_id": command["id"],
+                        "state": command["state"],
+                        "latency_ms": command["latency_ms"],
+                        "error": command["error"]
+                    })
+            # Kommandoen kan være afsluttet før den blev registreret ovenfor
+            latest = self.commands.get(command["id"])
+            if latest is not None and latest["completed"] is not None:
+                self.command_completed(latest)
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job["published"] = datetime.now().isoformat()
+        self._check_done(job_id)
+
+    def command_completed(self, command):
+        """Kaldes med hver afsluttet kommando fra PowerCommands"""
+        with self.lock:
+            owner = self.command_jobs.pop(command["id"], None)
+        if owner is None:
+            return
+        job_id, mac = owner
+        self._record(job_id, mac, {
+            "state": command["state"],
+            "latency_ms": command["latency_ms"],
+            "error": command["error"]
+        })
+        self._check_done(job_id)
+
+    def _record(self, job_id, mac, result):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job["results"][mac].update(result)
+
+    def _check_done(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["state"] != "running" or job["published"] is None:
+                return
+            if any(result["state"] in ("pending", "queued", "sent") for result in job["results"].values()):
+                return
+            job["state"] = "completed"
+            job["completed"] = datetime.now().isoformat()
+        if self.on_complete:
+            try:
+                self.on_complete(self.get(job_id))
+            except Exception as e:
+                print(f"Fejl ved besked om afsluttet job: {e}")
+
+    def _trim(self):
+        # Glem de ældste afsluttede jobs ud over history
+        excess = len(self.jobs) - self.history
+        for job_id in list(self.jobs):
+            if excess <= 0:
+                break
+            if self.jobs[job_id]["state"] != "running":
+                del self.jobs[job_id]
+                excess -= 1
+
+    def get(self, job_id):
+        """Jobbet med resultat pr. måler og optælling pr. tilstand"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job, results={mac: dict(result) for mac, result in job["results"].items()})
+        job["counts"] = dict(collections.Counter(result["state"] for result in job["results"].values()))
+        return job
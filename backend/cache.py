@@ -0,0 +1,226 @@
+import threading
+import time
+from collections import OrderedDict
+from config import CACHE_CONFIG
+
+class TTLCache:
+    """Størrelsesbegrænset cache med udløbstid (TTL) og LRU-udsmidning.
+
+    Hver post kan have tags (f.eks. en MAC-adresse), så alle poster for en måler kan
+    invalideres på én gang. get_or_load sørger for at kun én tråd henter en manglende
+    post - samtidige forespørgsler på samme nøgle venter på resultatet i stedet for at
+    ramme databasen hver for sig.
+
+    En indlæsning der var i gang da dens tags blev invalideret, må ikke gemme sine
+    (nu forældede) data med fuld TTL. Derfor nummereres invalideringerne: mark() før
+    indlæsningen og set(since=...) bagefter gemmer kun værdien så længe en invalidering
+    siden da ville have ladet en eksisterende post leve.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # nøgle -> (værdi, udløbstid, tags)
+        self.tags = {}  # tag -> sæt af nøgler
+        self.load_locks = {}
+        self.sequence = 0  # tæller for invalideringer
+        self.invalidations = {}  # tag -> (sequence ved seneste invalidering, udløbstid den gav)
+        self.cleared = 0  # sequence ved seneste clear
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_loads = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def mark(self):
+        """Invalideringstæller - tages før en indlæsning og gives til set(since=...)"""
+        with self.lock:
+            return self.sequence
+
+    def set(self, key, value, tags=(), since=None):
+        """Gem value under key. Med since (fra mark()) gemmes value ikke, eller kun til den
+        udløbstid en invalidering har givet, hvis tags er invalideret efter mark().
+        Returnerer False hvis value ikke blev gemt."""
+        with self.lock:
+            now = time.monotonic()
+            expires = now + self.ttl
+            if since is not None:
+                expires = min(expires, self._expires_after(tags, since))
+                if expires <= now:
+                    self.stale_loads += 1
+                    return False
+            self._remove(key)
+            self.entries[key] = (value, expires, tuple(tags))
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.maxsize:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+            return True
+
+    def _expires_after(self, tags, since):
+        # Seneste udløbstid for en værdi hentet før invalideringen med nummer since
+        if self.cleared > since:
+            return 0
+        expires = float("inf")
+        for tag in tags:
+            sequence, tag_expires = self.invalidations.get(tag, (0, 0))
+            if sequence > since:
+                expires = min(expires, tag_expires)
+        return expires
+
+    def get_or_load(self, key, loader, tags=(), cacheable=None):
+        """Returner værdien for key - hent den med loader() hvis den mangler eller er udløbet.
+
+        cacheable(værdi) kan afvise at gemme et resultat, f.eks. et fejlsvar.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self.lock:
+            load_lock = self.load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # En anden tråd kan have hentet værdien mens vi ventede
+            value = self.get(key)
+            if value is not None:
+                return value
+
+            with self.lock:
+                self.misses += 1
+                since = self.sequence
+            try:
+                value = loader()
+                if cacheable is None or cacheable(value):
+                    self.set(key, value, tags, since=since)
+                return value
+            finally:
+                with self.lock:
+                    self.load_locks.pop(key, None)
+
+    def invalidate(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def invalidate_tag(self, tag, delay=0):
+        """Invalider alle poster med tag.
+
+        Med delay > 0 udløber posterne først efter delay sekunder. En strøm af
+        invalideringer (f.eks. MQTT-beskeder) giver derved højst én genindlæsning pr.
+        delay, og databasen når at få de nye rækker skrevet inden de hentes igen.
+        """
+        with self.lock:
+            now = time.monotonic()
+            expires = now + max(delay, 0)
+            # Indlæsninger der er i gang, må højst gemme til samme tid som de eksisterende poster
+            self.sequence += 1
+            _, pending = self.invalidations.get(tag, (0, 0))
+            self.invalidations[tag] = (self.sequence, min(expires, pending) if pending > now else expires)
+            keys = list(self.tags.get(tag, ()))
+            if delay <= 0:
+                for key in keys:
+                    self._remove(key)
+                return
+            for key in keys:
+                value, current_expires, tags = self.entries[key]
+                if expires < current_expires:
+                    self.entries[key] = (value, expires, tags)
+
+    def clear(self):
+        with self.lock:
+            self.sequence += 1
+            self.cleared = self.sequence
+            self.entries.clear()
+            self.tags.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "stale_loads": self.stale_loads
+            }
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+class ChangeVersions:
+    """Versionsnummer og ændringstidspunkt pr. tag (måler eller hele flåden).
+
+    Bruges til ETag/Last-Modified. En forsinket ændring (delay > 0) træder først i kraft
+    samtidig med at cachen udløber, så en klient aldrig får 304 på data der endnu ikke
+    er genindlæst.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.versions = {}  # tag -> (version, tidspunkt)
+        self.pending = {}  # tag -> monotonic tidspunkt hvor ændringen træder i kraft
+
+    def bump(self, tag, delay=0):
+        with self.lock:
+            if delay <= 0:
+                self.pending.pop(tag, None)
+                self._increment(tag, time.time())
+            else:
+                due = time.monotonic() + delay
+                self.pending[tag] = min(self.pending.get(tag, due), due)
+
+    def get(self, tag):
+        """Returner (version, ændringstidspunkt som epoch-sekunder) for tag"""
+        with self.lock:
+            due = self.pending.get(tag)
+            if due is not None and due <= time.monotonic():
+                del self.pending[tag]
+                # Ændringen trådte i kraft ved due - omregn til væguret
+                self._increment(tag, time.time() - (time.monotonic() - due))
+            return self.versions.get(tag, (0, self.started))
+
+    def _increment(self, tag, changed):
+        version, _ = self.versions.get(tag, (0, self.started))
+        self.versions[tag] = (version + 1, changed)
+
+# Tag for poster der afhænger af hele flåden (måleroversigten)
+FLEET_TAG = "fleet"
+
+def meter_tag(mac):
+    """Tag for alle cacheposter om én måler - MAC normaliseret til databasens format"""
+    mac = mac.strip()
+    if mac.lower().startswith('obk'):
+        mac = mac[3:]
+    return mac.replace(':', '').upper()
+
+meter_cache = TTLCache(CACHE_CONFIG['maxsize'], CACHE_CONFIG['ttl'])
+change_versions = ChangeVersions()
+
+def invalidate_meter(mac, delay=0):
+    """Invalider alt om en måler samt oversigten og tæl deres versioner op"""
+    tag = meter_tag(mac)
+    meter_cache.invalidate_tag(tag, delay)
+    meter_cache.invalidate_tag(FLEET_TAG, delay)
+    change_versions.bump(tag, delay)
+    change_versions.bump(FLEET_TAG, delay)
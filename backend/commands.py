@@ -0,0 +1,224 @@
+import bisect
+import collections
+import threading
+import time
+import uuid
+from datetime import datetime
+from cache import meter_tag
+
+# Grænser (ms) for spandene i latenshistogrammerne - sidste spand er alt derover
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Hvad måleren svarer på stat/+/Power når kommandoen er udført
+EXPECTED_STATUS = {"on": "Tændt", "off": "Slukket"}
+
+def power_topic(mac):
+    """Emnet for tænd/sluk-kommandoer til en måler (MAC uden kolon, som i OpenBeken)"""
+    return f"cmnd/obk{mac.replace(':', '')}/Power"
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, ms):
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, fraction):
+        """Øvre grænse for spanden med percentilen (None for den åbne spand over den sidste)"""
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return None
+
+    def snapshot(self):
+        labels = [f"<={bound}" for bound in self.buckets] + [f">{self.buckets[-1]}"]
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 1) if self.count else None,
+            "max_ms": round(self.max_ms, 1),
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "buckets": dict(zip(labels, self.counts))
+        }
+
+class PowerCommands:
+    """Tænd/sluk-kommandoer med id, kvittering og latens.
+
+    submit() giver kommandoen et id og returnerer med det samme - HTTP-kaldet venter
+    aldrig på brokeren. Kommandoer til samme måler sendes én ad gangen: den næste
+    publiceres først når den forrige er kvitteret af målerens stat/+/Power-svar eller
+    er udløbet efter timeout sekunder. Tiden fra publicering til kvittering gemmes i et
+    histogram pr. handling. Afsluttede kommandoer huskes (de seneste history) til opslag,
+    og on_complete kaldes med kommandoen når den er kvitteret, udløbet eller fejlet.
+    """
+
+    def __init__(self, publish, timeout=10.0, history=1000, on_complete=None):
+        self.publish = publish  # (emne, payload) -> returkode fra MQTT (0 = sendt)
+        self.timeout = timeout
+        self.history = history
+        self.on_complete = on_complete
+        self.lock = threading.Lock()
+        self.commands = collections.OrderedDict()  # id -> kommando
+        self.waiting = {}  # mac -> deque af id'er der venter på at blive sendt
+        self.inflight = {}  # mac -> id på den sendte kommando der venter på kvittering
+        self.histograms = {action: LatencyHistogram() for action in EXPECTED_STATUS}
+        self.results = collections.Counter()
+        self.running = False
+
+    def submit(self, mac, action, source=None):
+        """Læg en kommando i kø til måleren - returnerer kommandoen"""
+        if action not in EXPECTED_STATUS:
+            raise ValueError(f"Ugyldig handling: {action}. Brug on eller off")
+        command = {
+            "id": uuid.uuid4().hex,
+            "mac": meter_tag(mac),
+            "action": action,
+            "topic": power_topic(mac),
+            "payload": action.upper(),
+            "state": "queued",
+            "source": source,
+            "created": datetime.now().isoformat(),
+            "sent": None,
+            "completed": None,
+            "latency_ms": None,
+            "error": None
+        }
+        with self.lock:
+            self.commands[command["id"]] = command
+            self.waiting.setdefault(command["mac"], collections.deque()).append(command["id"])
+            snapshot = dict(command)
+        self._send_next(command["mac"])
+        return self.get(command["id"]) or snapshot
+
+    def get(self, command_id):
+        with self.lock:
+            command = self.commands.get(command_id)
+            if command is None:
+                return None
+            command = dict(command)
+        command.pop("sent_at", None)
+        return command
+
+    def _send_next(self, mac):
+        """Publicer den næste ventende kommando til måleren, hvis ingen venter på kvittering"""
+        while True:
+            with self.lock:
+                if mac in self.inflight or not self.waiting.get(mac):
+                    return
+                command = self.commands[self.waiting[mac].popleft()]
+                if not self.waiting[mac]:
+                    del self.waiting[mac]
+                self.inflight[mac] = command["id"]
+                command["state"] = "sent"
+                command["sent"] = datetime.now().isoformat()
+                command["sent_at"] = time.monotonic()
+
+            try:
+                rc = self.publish(command["topic"], command["payload"])
+                error = None if rc == 0 else f"Kunne ikke sende kommando. Fejlkode: {rc}"
+            except Exception as e:
+                error = f"Fejl ved afsendelse af kommando: {e}"
+            if error is None:
+                print(f"MQTT-kommando sendt: {command['topic']} = {command['payload']} ({command['id']})")
+                return
+            print(error)
+            # Måleren er fri igen - prøv den næste i køen
+            self._complete(mac, command["id"], "failed", error=error)
+
+    def acknowledge(self, mac, status):
+        """Målerens status fra stat/+/Power - kvitterer den sendte kommando hvis den passer"""
+        with self.lock:
+            command_id = self.inflight.get(mac)
+            if command_id is None:
+                return None
+            command = self.commands[command_id]
+            # Et ekko af den tidligere status kvitterer ikke for kommandoen
+            if EXPECTED_STATUS[command["action"]] != status:
+                return None
+            latency_ms = (time.monotonic() - command["sent_at"]) * 1000
+            self.histograms[command["action"]].record(latency_ms)
+        self._complete(mac, command_id, "acknowledged", latency_ms=round(latency_ms, 1))
+        return command_id
+
+    def _complete(self, mac, command_id, state, latency_ms=None, error=None):
+        with self.lock:
+            command = self.commands.get(command_id)
+            if command is None or self.inflight.get(mac) != command_id:
+                return
+            del self.inflight[mac]
+            command.update({
+                "state": state,
+                "completed": datetime.now().isoformat(),
+                "latency_ms": latency_ms,
+                "error": error
+            })
+            self.results[state] += 1
+            self._trim()
+        if self.on_complete:
+            try:
+                self.on_complete(self.get(command_id))
+            except Exception as e:
+                print(f"Fejl ved besked om afsluttet kommando: {e}")
+        self._send_next(mac)
+
+    def _trim(self):
+        # Glem de ældste afsluttede kommandoer ud over history
+        excess = len(self.commands) - self.history
+        for command_id in list(self.commands):
+            if excess <= 0:
+                break
+            if self.commands[command_id]["completed"] is not None:
+                del self.commands[command_id]
+                excess -= 1
+
+    def expire(self):
+        """Marker sendte kommandoer uden kvittering efter timeout som udløbet"""
+        now = time.monotonic()
+        with self.lock:
+            expired = [
+                (mac, command_id) for mac, command_id in self.inflight.items()
+                if now - self.commands[command_id]["sent_at"] > self.timeout
+            ]
+        for mac, command_id in expired:
+            print(f"Ingen kvittering fra {mac} inden for {self.timeout} sekunder ({command_id})")
+            self._complete(mac, command_id, "timeout", error="Ingen kvittering fra måleren")
+        return len(expired)
+
+    def run_forever(self, sleep=time.sleep):
+        while self.running:
+            sleep(min(1.0, self.timeout / 4))
+            try:
+                self.expire()
+            except Exception as e:
+                print(f"Fejl ved udløb af kommandoer: {e}")
+
+    def start(self, start_background_task):
+        if self.running:
+            return
+        self.running = True
+        start_background_task(self.run_forever)
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        with self.lock:
+            return {
+                "timeout_secs": self.timeout,
+                "inflight": len(self.inflight),
+                "queued": sum(len(ids) for ids in self.waiting.values()),
+                "results": dict(self.results),
+                "latency": {action: histogram.snapshot() for action, histogram in self.histograms.items()}
+            }
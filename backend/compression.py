@@ -0,0 +1,73 @@
+import gzip
+import hashlib
+from flask import request
+from cache import TTLCache
+from config import COMPRESSION_CONFIG
+
+# Brotli er valgfri - uden pakken bruges kun gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/plain', 'text/html'}
+
+# Komprimerede bytes for svar med ETag, nøglet på en hash af indholdet, så et
+# populært svar komprimeres én gang i stedet for ved hver forespørgsel
+compressed_cache = TTLCache(COMPRESSION_CONFIG['cache_entries'], COMPRESSION_CONFIG['cache_ttl'])
+
+# ETag-suffiks pr. kodning; et komprimeret svar er en anden repræsentation end det rå
+ETAG_SUFFIXES = {'br': '-br', 'gzip': '-gzip'}
+
+def etag_variants(etag):
+    """Alle ETags en klient kan have fået for samme indhold (rå og komprimeret)"""
+    return [etag] + [etag + suffix for suffix in ETAG_SUFFIXES.values()]
+
+def choose_encoding():
+    """Vælg kodning ud fra Accept-Encoding - brotli foretrækkes når den er tilgængelig"""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted.quality('br') > 0:
+        return 'br'
+    if accepted.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=COMPRESSION_CONFIG['brotli_quality'])
+    # mtime=0 giver samme bytes for samme indhold
+    return gzip.compress(data, compresslevel=COMPRESSION_CONFIG['gzip_level'], mtime=0)
+
+def compress_response(response):
+    """after_request: komprimer store svar hvis klienten accepterer det"""
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESSION_CONFIG['min_size']:
+        return response
+
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        key = (encoding, hashlib.blake2b(data, digest_size=16).digest())
+        compressed = compressed_cache.get_or_load(key, lambda: compress(data, encoding))
+        response.set_etag(etag + ETAG_SUFFIXES[encoding])
+    else:
+        compressed = compress(data, encoding)
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def init_compression(app):
+    """Aktiver komprimering på Flask-appen (virker ens under dev-server, eventlet og gevent)"""
+    if COMPRESSION_CONFIG['enabled']:
+        app.after_request(compress_response)
@@ -13,6 +13,116 @@ DB_CONFIG = {
     'database': os.getenv('DB_NAME', 'el_data'),
 }
 
+# Database connection pool. Størrelsen bør dække det antal samtidige forespørgsler
+# serveren håndterer (tråde/greenlets pr. worker); pool_recycle skal være lavere end
+# MySQL's wait_timeout, så lukkede forbindelser ikke genbruges.
+DB_POOL_CONFIG = {
+    'pool_size': int(os.getenv('DB_POOL_SIZE', 10)),
+    'max_overflow': int(os.getenv('DB_POOL_MAX_OVERFLOW', 20)),
+    'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 10)),
+    'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+    'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'True').lower() in ('true', '1', 't'),
+    'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 5)),
+}
+
+# Cache foran oversigt, målerinfo og daglige målinger
+CACHE_CONFIG = {
+    'maxsize': int(os.getenv('CACHE_MAXSIZE', 2000)),
+    'ttl': float(os.getenv('CACHE_TTL_SECS', 60)),
+    # Forsinkelse før en MQTT-besked invaliderer cachen, så databasen når at blive skrevet
+    'mqtt_invalidate_delay': float(os.getenv('CACHE_MQTT_INVALIDATE_DELAY_SECS', 2)),
+}
+
+# Komprimering af svar (gzip, og brotli hvis pakken er installeret)
+COMPRESSION_CONFIG = {
+    'enabled': os.getenv('COMPRESSION_ENABLED', 'True').lower() in ('true', '1', 't'),
+    'min_size': int(os.getenv('COMPRESSION_MIN_SIZE', 1024)),
+    'gzip_level': int(os.getenv('COMPRESSION_GZIP_LEVEL', 6)),
+    'brotli_quality': int(os.getenv('COMPRESSION_BROTLI_QUALITY', 5)),
+    'cache_entries': int(os.getenv('COMPRESSION_CACHE_ENTRIES', 256)),
+    'cache_ttl': float(os.getenv('COMPRESSION_CACHE_TTL_SECS', 300)),
+}
+
+# Sundhedstjek i baggrunden - /api/health svarer med seneste resultat
+HEALTH_CONFIG = {
+    'interval': float(os.getenv('HEALTH_INTERVAL_SECS', 10)),
+    # Et tjek der ikke har svaret efter timeout regnes som fejlet
+    'timeout': float(os.getenv('HEALTH_TIMEOUT_SECS', 5)),
+}
+
+# Opbygning af aggregerede tabeller (energimaaling_daglig) fra energimaaling
+ROLLUP_CONFIG = {
+    'enabled': os.getenv('ROLLUP_ENABLED', 'True').lower() in ('true', '1', 't'),
+    'interval': float(os.getenv('ROLLUP_INTERVAL_SECS', 60)),
+    # Antal målings-id'er der lægges sammen pr. transaktion
+    'chunk_size': int(os.getenv('ROLLUP_CHUNK_SIZE', 200000)),
+    # Højst så mange stykker pr. tabel pr. kørsel i backenden - større efterslæb tages over flere kørsler
+    'max_chunks': int(os.getenv('ROLLUP_MAX_CHUNKS', 5)),
+}
+
+# Snapshot af flåden til varm start (relativ sti regnes fra backend-mappen)
+SNAPSHOT_CONFIG = {
+    'enabled': os.getenv('SNAPSHOT_ENABLED', 'True').lower() in ('true', '1', 't'),
+    'path': os.path.join(os.path.dirname(os.path.abspath(__file__)), os.getenv('SNAPSHOT_PATH', 'fleet_snapshot.json')),
+    'interval': float(os.getenv('SNAPSHOT_INTERVAL_SECS', 60)),
+}
+
+# Lagring af målinger fra maaler/+/data i energimaaling. Slået fra som standard, så
+# målinger ikke skrives dobbelt mens en ekstern komponent stadig gemmer dem.
+INGEST_CONFIG = {
+    'enabled': os.getenv('INGEST_ENABLED', 'False').lower() in ('true', '1', 't'),
+    # En batch skrives når batch_size målinger venter og ellers hvert flush_interval sekund
+    'batch_size': int(os.getenv('INGEST_BATCH_SIZE', 500)),
+    'flush_interval': float(os.getenv('INGEST_FLUSH_INTERVAL_SECS', 1.0)),
+    # Maksimalt antal ventende målinger hvis databasen ikke svarer
+    'max_pending': int(os.getenv('INGEST_MAX_PENDING', 50000)),
+}
+
+# Lagring af tændt/slukket fra stat/+/Power i maalerstatus (kun ved skift)
+POWER_STATE_CONFIG = {
+    'enabled': os.getenv('POWER_STATE_ENABLED', 'True').lower() in ('true', '1', 't'),
+    'batch_size': int(os.getenv('POWER_STATE_BATCH_SIZE', 100)),
+    'flush_interval': float(os.getenv('POWER_STATE_FLUSH_INTERVAL_SECS', 1.0)),
+    'max_pending': int(os.getenv('POWER_STATE_MAX_PENDING', 10000)),
+    # prioritet for statusrækker skrevet af backenden
+    'priority': int(os.getenv('POWER_STATE_PRIORITY', 10)),
+}
+
+# Tænd/sluk-kommandoer til målerne
+COMMAND_CONFIG = {
+    # Sekunder der ventes på målerens svar på stat/+/Power før kommandoen regnes som udløbet
+    'ack_timeout': float(os.getenv('COMMAND_ACK_TIMEOUT_SECS', 10.0)),
+    # Antal afsluttede kommandoer der kan slås op på /api/commands/<id>
+    'history': int(os.getenv('COMMAND_HISTORY', 1000)),
+}
+
+# Samlet tænd/sluk for mange målere (/api/meters/power)
+BULK_CONFIG = {
+    # Kommandoer pr. sekund og hvor mange der må sendes på én gang
+    'rate': float(os.getenv('BULK_POWER_RATE', 50)),
+    'burst': int(os.getenv('BULK_POWER_BURST', 10)),
+    'max_meters': int(os.getenv('BULK_POWER_MAX_METERS', 1000)),
+    # Antal afsluttede jobs der kan slås op
+    'history': int(os.getenv('BULK_POWER_HISTORY', 100)),
+}
+
+# Kø mellem MQTT-klienten og behandlingen af beskeder
+MQTT_QUEUE_CONFIG = {
+    'workers': int(os.getenv('MQTT_WORKERS', 4)),
+    'maxsize': int(os.getenv('MQTT_QUEUE_SIZE', 10000)),
+    # drop_oldest, drop_newest eller block (block kan forsinke MQTT-forbindelsen)
+    'overflow_policy': os.getenv('MQTT_QUEUE_OVERFLOW', 'drop_oldest'),
+    'block_timeout': float(os.getenv('MQTT_QUEUE_BLOCK_TIMEOUT_SECS', 1.0)),
+    # Kasserede beskeder logges samlet højst én gang pr. interval
+    'drop_log_interval': float(os.getenv('MQTT_QUEUE_DROP_LOG_SECS', 10.0)),
+}
+
+# Videresendelse af MQTT-beskeder til webklienterne via Socket.IO
+FANOUT_CONFIG = {
+    # Nyeste besked pr. emne sendes samlet hvert window sekund (0 sender hver besked med det samme)
+    'window': float(os.getenv('FANOUT_WINDOW_SECS', 0.25)),
+}
+
 # MQTT konfiguration
 MQTT_CONFIG = {
     'host': os.getenv('MQTT_HOST', '192.168.9.61'),
@@ -1,13 +1,107 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text, bindparam
+from sqlalchemy.exc import IntegrityError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+import numpy as np
 import pymysql
-from config import DB_CONFIG
+from config import DB_CONFIG, DB_POOL_CONFIG
+from downsample import lttb
+from meter_index import meter_index, normalize_meter_number
+from cache import meter_tag
+import collections
 import datetime
+from decimal import Decimal
+import threading
+import time
 
 # Opret database engine
 def get_db_connection_string():
     return f"mysql+pymysql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
 
-engine = create_engine(get_db_connection_string())
+class PoolStats:
+    """Løbende statistik over connection poolen: ventetid ved checkout, overflow og timeouts"""
+    
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.waits_ms = collections.deque(maxlen=window)
+        self.checkouts = 0
+        self.overflow_checkouts = 0
+        self.timeouts = 0
+        self.invalidated = 0
+        self.max_wait_ms = 0.0
+    
+    def record_checkout(self, wait_ms, overflow):
+        with self.lock:
+            self.checkouts += 1
+            self.waits_ms.append(wait_ms)
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            if overflow:
+                self.overflow_checkouts += 1
+    
+    def record_timeout(self):
+        with self.lock:
+            self.timeouts += 1
+    
+    def record_invalidated(self):
+        with self.lock:
+            self.invalidated += 1
+    
+    def snapshot(self, pool):
+        with self.lock:
+            waits = sorted(self.waits_ms)
+            return {
+                "pool_size": pool.size(),
+                "in_use": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0),
+                "max_overflow": DB_POOL_CONFIG['max_overflow'],
+                "checkouts": self.checkouts,
+                "overflow_checkouts": self.overflow_checkouts,
+                "timeouts": self.timeouts,
+                "invalidated": self.invalidated,
+                "wait_ms_p50": round(waits[len(waits) // 2], 2) if waits else 0.0,
+                "wait_ms_p95": round(waits[int(len(waits) * 0.95)], 2) if waits else 0.0,
+                "wait_ms_max": round(self.max_wait_ms, 2)
+            }
+
+pool_stats = PoolStats()
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool der måler hvor længe en forespørgsel venter på en forbindelse"""
+    
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.record_timeout()
+            raise
+        pool_stats.record_checkout((time.perf_counter() - start) * 1000, self.overflow() > 0)
+        return connection
+
+def create_db_engine():
+    engine = create_engine(
+        get_db_connection_string(),
+        poolclass=InstrumentedQueuePool,
+        pool_size=DB_POOL_CONFIG['pool_size'],
+        max_overflow=DB_POOL_CONFIG['max_overflow'],
+        pool_timeout=DB_POOL_CONFIG['pool_timeout'],
+        pool_recycle=DB_POOL_CONFIG['pool_recycle'],
+        pool_pre_ping=DB_POOL_CONFIG['pool_pre_ping'],
+        connect_args={"connect_timeout": DB_POOL_CONFIG['connect_timeout']}
+    )
+    
+    # Tæl forbindelser der smides væk (f.eks. fejlet pre-ping eller afbrudt af MySQL)
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        pool_stats.record_invalidated()
+    
+    return engine
+
+engine = create_db_engine()
+
+def get_pool_stats():
+    """Returner aktuel statistik for connection poolen"""
+    return pool_stats.snapshot(engine.pool)
 
 def test_connection():
     """Test forbindelsen til databasen"""
@@ -19,94 +113,366 @@ def test_connection():
         print(f"Fejl ved forbindelse til database: {e}")
         return False
 
+# Kompakt tabel med seneste tilstand pr. måler. Holdes opdateret af triggers på
+# historiktabellerne, så oversigten koster i forhold til antal målere - ikke historikkens størrelse.
+METER_LATEST_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS meter_latest (
+        mac VARCHAR(32) NOT NULL PRIMARY KEY,
+        reading_id BIGINT NULL,
+        totalKwh DECIMAL(12, 3) NULL,
+        tidspunkt DATETIME NULL,
+        status_id BIGINT NULL,
+        status VARCHAR(32) NULL,
+        status_tidspunkt DATETIME NULL,
+        prioritet INT NULL,
+        info_id BIGINT NULL,
+        name VARCHAR(255) NULL,
+        nummer VARCHAR(16) NULL,
+        antal_dage INT NOT NULL DEFAULT 0,
+        antal_maalinger BIGINT NOT NULL DEFAULT 0,
+        foerste_tidspunkt DATETIME NULL,
+        opdateret TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        KEY idx_meter_latest_tidspunkt (tidspunkt)
+    )
+"""
+
+# Kolonner tilføjet efter første version af meter_latest - tilføjes ved opstart hvis de mangler
+METER_LATEST_ADDED_COLUMNS = {
+    "antal_dage": "INT NOT NULL DEFAULT 0",
+    "antal_maalinger": "BIGINT NOT NULL DEFAULT 0",
+    "foerste_tidspunkt": "DATETIME NULL",
+}
+
+METER_LATEST_TRIGGERS = {
+    "trg_energimaaling_meter_latest": """
+        CREATE TRIGGER trg_energimaaling_meter_latest AFTER INSERT ON energimaaling
+        FOR EACH ROW
+        INSERT INTO meter_latest (mac, reading_id, totalKwh, tidspunkt, antal_dage, antal_maalinger, foerste_tidspunkt)
+        VALUES (NEW.mac, NEW.id, NEW.totalKwh, NEW.tidspunkt, 1, 1, NEW.tidspunkt)
+        ON DUPLICATE KEY UPDATE
+            antal_dage = antal_dage + IF(tidspunkt IS NULL OR DATE(NEW.tidspunkt) > DATE(tidspunkt), 1, 0),
+            antal_maalinger = antal_maalinger + 1,
+            foerste_tidspunkt = IF(foerste_tidspunkt IS NULL OR NEW.tidspunkt < foerste_tidspunkt, NEW.tidspunkt, foerste_tidspunkt),
+            reading_id = IF(tidspunkt IS NULL OR NEW.tidspunkt >= tidspunkt, NEW.id, reading_id),
+            totalKwh = IF(tidspunkt IS NULL OR NEW.tidspunkt >= tidspunkt, NEW.totalKwh, totalKwh),
+            tidspunkt = IF(tidspunkt IS NULL OR NEW.tidspunkt >= tidspunkt, NEW.tidspunkt, tidspunkt)
+    """,
+    "trg_maalerstatus_meter_latest": """
+        CREATE TRIGGER trg_maalerstatus_meter_latest AFTER INSERT ON maalerstatus
+        FOR EACH ROW
+        INSERT INTO meter_latest (mac, status_id, status, prioritet, status_tidspunkt)
+        VALUES (NEW.mac, NEW.id, NEW.status, NEW.prioritet, NEW.tidspunkt)
+        ON DUPLICATE KEY UPDATE
+            status_id = IF(status_tidspunkt IS NULL OR NEW.tidspunkt >= status_tidspunkt, NEW.id, status_id),
+            status = IF(status_tidspunkt IS NULL OR NEW.tidspunkt >= status_tidspunkt, NEW.status, status),
+            prioritet = IF(status_tidspunkt IS NULL OR NEW.tidspunkt >= status_tidspunkt, NEW.prioritet, prioritet),
+            status_tidspunkt = IF(status_tidspunkt IS NULL OR NEW.tidspunkt >= status_tidspunkt, NEW.tidspunkt, status_tidspunkt)
+    """,
+    "trg_maalerinfo_insert_meter_latest": """
+        CREATE TRIGGER trg_maalerinfo_insert_meter_latest AFTER INSERT ON maalerinfo
+        FOR EACH ROW
+        INSERT INTO meter_latest (mac, info_id, name, nummer)
+        VALUES (NEW.mac, NEW.id, NEW.name, NEW.nummer)
+        ON DUPLICATE KEY UPDATE info_id = NEW.id, name = NEW.name, nummer = NEW.nummer
+    """,
+    "trg_maalerinfo_update_meter_latest": """
+        CREATE TRIGGER trg_maalerinfo_update_meter_latest AFTER UPDATE ON maalerinfo
+        FOR EACH ROW
+        INSERT INTO meter_latest (mac, info_id, name, nummer)
+        VALUES (NEW.mac, NEW.id, NEW.name, NEW.nummer)
+        ON DUPLICATE KEY UPDATE info_id = NEW.id, name = NEW.name, nummer = NEW.nummer
+    """,
+    "trg_maalerinfo_delete_meter_latest": """
+        CREATE TRIGGER trg_maalerinfo_delete_meter_latest AFTER DELETE ON maalerinfo
+        FOR EACH ROW
+        UPDATE meter_latest SET info_id = NULL, name = NULL, nummer = NULL
+        WHERE mac = OLD.mac
+    """,
+}
+
+# Om meter_latest kan bruges: tabellen og alle triggers findes og indholdet er bygget.
+# Ellers læser oversigten og målerinfo historiktabellerne direkte (se *_from_history).
+meter_latest_state = {"ready": False, "checked": None, "error": None}
+meter_latest_lock = threading.Lock()  # beskytter meter_latest_state
+meter_latest_build_lock = threading.Lock()  # én kontrol og genopbygning ad gangen
+
+# Sekunder før en mislykket kontrol af meter_latest prøves igen
+METER_LATEST_RETRY_SECONDS = 60
+
+def ensure_meter_latest():
+    """Opret meter_latest og dens triggers hvis de mangler, og fyld tabellen første gang.
+    
+    Mangler en trigger, er ændringer gået forbi tabellen, så den genopbygges. Returnerer
+    True når meter_latest er klar; ellers skrives en tydelig advarsel, og læsningerne
+    bruger historiktabellerne indtil en senere kontrol lykkes.
+    """
+    with meter_latest_build_lock:
+        ready, error = _ensure_meter_latest()
+    with meter_latest_lock:
+        meter_latest_state.update({"ready": ready, "checked": time.monotonic(), "error": error})
+    if not ready:
+        print(f"ADVARSEL: meter_latest kan ikke bruges ({error}) - oversigt og målerinfo læses "
+              f"direkte fra historiktabellerne, hvilket er langsomt")
+    return ready
+
+def meter_latest_ready():
+    """True hvis meter_latest kan bruges.
+    
+    Er den ikke klar (eller endnu ikke kontrolleret, fordi appen ikke er startet via
+    app.py), startes ensure_meter_latest i en baggrundstråd - med mellemrum så længe den
+    fejler - og forespørgslen læser historiktabellerne imens i stedet for at vente på en
+    genopbygning.
+    """
+    with meter_latest_lock:
+        checked = meter_latest_state["checked"]
+        due = not meter_latest_state["ready"] and (checked is None or time.monotonic() - checked >= METER_LATEST_RETRY_SECONDS)
+        if due:
+            meter_latest_state["checked"] = time.monotonic()
+    if due:
+        threading.Thread(target=ensure_meter_latest, daemon=True).start()
+    return meter_latest_state["ready"]
+
+def get_meter_latest_state():
+    """Tilstanden for meter_latest til sundhedstjekket"""
+    return {"ready": meter_latest_state["ready"], "error": meter_latest_state["error"]}
+
+def _ensure_meter_latest():
+    try:
+        with engine.begin() as connection:
+            connection.execute(text(METER_LATEST_SCHEMA))
+            
+            columns = {
+                row[0] for row in connection.execute(text("""
+                    SELECT COLUMN_NAME FROM information_schema.COLUMNS
+                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'meter_latest'
+                """))
+            }
+            missing = [name for name in METER_LATEST_ADDED_COLUMNS if name not in columns]
+            for name in missing:
+                connection.execute(text(f"ALTER TABLE meter_latest ADD COLUMN {name} {METER_LATEST_ADDED_COLUMNS[name]}"))
+                print(f"Tilføjet kolonne meter_latest.{name}")
+            
+            # Nye kolonner kræver nye trigger-definitioner og en genopbygning
+            if missing:
+                for name in METER_LATEST_TRIGGERS:
+                    connection.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+            
+            existing = {
+                row[0] for row in connection.execute(text("""
+                    SELECT TRIGGER_NAME FROM information_schema.TRIGGERS
+                    WHERE TRIGGER_SCHEMA = DATABASE()
+                """))
+            }
+            created = []
+            for name, statement in METER_LATEST_TRIGGERS.items():
+                if name not in existing:
+                    # Kræver TRIGGER-rettighed (og med binlog SUPER eller log_bin_trust_function_creators)
+                    connection.execute(text(statement))
+                    created.append(name)
+                    print(f"Oprettet trigger {name}")
+            
+            empty = connection.execute(text("SELECT 1 FROM meter_latest LIMIT 1")).fetchone() is None
+        
+        if (empty or missing or created) and not rebuild_meter_latest():
+            return False, "genopbygning fejlede"
+        return True, None
+    except Exception as e:
+        print(f"Fejl ved oprettelse af meter_latest: {e}")
+        return False, str(e)
+
+def rebuild_meter_latest():
+    """Genopbyg meter_latest fra historiktabellerne med mængdebaserede forespørgsler"""
+    try:
+        with engine.begin() as connection:
+            connection.execute(text("DELETE FROM meter_latest"))
+            
+            # Alle kendte MAC-adresser, så målere kun med status eller kun med navn også kommer med
+            connection.execute(text("""
+                INSERT INTO meter_latest (mac)
+                SELECT mac FROM energimaaling
+                UNION
+                SELECT mac FROM maalerstatus
+                UNION
+                SELECT mac FROM maalerinfo
+            """))
+            
+            # Seneste måling - MAX(id) vælger én række hvis flere har samme tidspunkt
+            connection.execute(text("""
+                UPDATE meter_latest l
+                JOIN (
+                    SELECT e.mac, MAX(e.id) AS reading_id
+                    FROM energimaaling e
+                    JOIN (
+                        SELECT mac, MAX(tidspunkt) AS seneste_tidspunkt
+                        FROM energimaaling
+                        GROUP BY mac
+                    ) em ON e.mac = em.mac AND e.tidspunkt = em.seneste_tidspunkt
+                    GROUP BY e.mac
+                ) seneste ON seneste.mac = l.mac
+                JOIN energimaaling e ON e.id = seneste.reading_id
+                SET l.reading_id = e.id, l.totalKwh = e.totalKwh, l.tidspunkt = e.tidspunkt
+            """))
+            
+            # Tællere tælles én gang her og vedligeholdes derefter af triggeren
+            connection.execute(text("""
+                UPDATE meter_latest l
+                JOIN (
+                    SELECT
+                        mac,
+                        COUNT(*) AS antal_maalinger,
+                        MIN(tidspunkt) AS foerste_tidspunkt,
+                        COUNT(DISTINCT DATE(tidspunkt)) AS antal_dage
+                    FROM energimaaling
+                    GROUP BY mac
+                ) d ON d.mac = l.mac
+                SET l.antal_dage = d.antal_dage,
+                    l.antal_maalinger = d.antal_maalinger,
+                    l.foerste_tidspunkt = d.foerste_tidspunkt
+            """))
+            
+            # Seneste status
+            connection.execute(text("""
+                UPDATE meter_latest l
+                JOIN (
+                    SELECT s.mac, MAX(s.id) AS status_id
+                    FROM maalerstatus s
+                    JOIN (
+                        SELECT mac, MAX(tidspunkt) AS seneste_tidspunkt
+                        FROM maalerstatus
+                        GROUP BY mac
+                    ) sm ON s.mac = sm.mac AND s.tidspunkt = sm.seneste_tidspunkt
+                    GROUP BY s.mac
+                ) seneste ON seneste.mac = l.mac
+                JOIN maalerstatus s ON s.id = seneste.status_id
+                SET l.status_id = s.id, l.status = s.status, l.prioritet = s.prioritet,
+                    l.status_tidspunkt = s.tidspunkt
+            """))
+            
+            # Navngivning
+            connection.execute(text("""
+                UPDATE meter_latest l
+                JOIN maalerinfo i ON i.mac = l.mac
+                SET l.info_id = i.id, l.name = i.name, l.nummer = i.nummer
+            """))
+        
+        print("meter_latest genopbygget fra historiktabellerne")
+        return True
+    except Exception as e:
+        print(f"Fejl ved genopbygning af meter_latest: {e}")
+        return False
+
+class DatabaseReadError(Exception):
+    """En læsning fejlede - adskiller en fejl fra et ægte tomt resultat, så fejlen ikke
+    caches eller får et ETag som om den var data"""
+
+def _row_to_dict(row):
+    """Konverter en SQLAlchemy række til dict"""
+    return {key: row._mapping[key] for key in row._mapping.keys()}
+
 def get_all_meters():
     """Hent alle målere fra systemet, inklusive dem uden målinger"""
     try:
         with engine.connect() as connection:
-            # Hent alle MAC-adresser fra både energimaaling og maalerstatus
+            # Seneste måling, status og navngivning for alle målere ligger samlet i meter_latest.
+            # Målere der kun findes i maalerinfo har ingen historik og vises ikke i oversigten.
+            if not meter_latest_ready():
+                return _overview_from_history(connection)
             query = text("""
-                SELECT DISTINCT mac FROM (
-                    SELECT mac FROM energimaaling
-                    UNION
-                    SELECT mac FROM maalerstatus
-                ) AS all_meters
+                SELECT
+                    mac,
+                    totalKwh,
+                    tidspunkt,
+                    status,
+                    status_tidspunkt,
+                    info_id,
+                    name,
+                    nummer,
+                    CURRENT_TIMESTAMP() AS db_tidspunkt
+                FROM meter_latest
+                WHERE tidspunkt IS NOT NULL OR status_tidspunkt IS NOT NULL
             """)
             result = connection.execute(query)
-            all_macs = [row[0] for row in result]
+            meters = [_build_overview_meter(row) for row in result]
             
-            if not all_macs:
+            if not meters:
                 print("Ingen målere fundet i systemet!")
                 return []
             
-            # Hent seneste måling for hver måler (hvis der er nogen)
-            meters = []
-            for mac in all_macs:
-                meter = {"mac": mac, "status": "offline", "error": "Ingen data"}
-                
-                # Hent seneste måling
-                try:
-                    reading_query = text("""
-                        SELECT 
-                            mac, 
-                            totalKwh, 
-                            CURRENT_TIMESTAMP() as db_tidspunkt
-                        FROM energimaaling 
-                        WHERE mac = :mac
-                        ORDER BY tidspunkt DESC 
-                        LIMIT 1
-                    """)
-                    reading_result = connection.execute(reading_query, {"mac": mac})
-                    reading = reading_result.fetchone()
-                    
-                    if reading:
-                        meter.update({
-                            "lastSeen": reading.db_tidspunkt.strftime('%Y-%m-%d %H:%M:%S') if reading.db_tidspunkt else None,
-                            "lastReading": float(reading.totalKwh) if hasattr(reading, 'totalKwh') else 0.0,
-                            "error": None
-                        })
-                except Exception as e:
-                    meter['error'] = f"Fejl ved hentning af målinger: {str(e)}"
-                
-                # Hent seneste status
-                try:
-                    status_query = text("""
-                        SELECT * FROM maalerstatus 
-                        WHERE mac = :mac
-                        ORDER BY tidspunkt DESC 
-                        LIMIT 1
-                    """)
-                    status_result = connection.execute(status_query, {"mac": mac})
-                    status = status_result.fetchone()
-                    
-                    if status:
-                        meter.update({
-                            "status": "online" if status.status == "Tændt" else "offline",
-                            "power": "tændt" if status.status == "Tændt" else "slukket",
-                            "sidste_status_tid": status.tidspunkt.strftime('%Y-%m-%d %H:%M:%S') if status.tidspunkt else None
-                        })
-                except Exception as e:
-                    meter['error'] = f"Fejl ved hentning af status: {str(e)}"
-                
-                # Hent navngivning
-                try:
-                    name_query = text("SELECT name, nummer FROM maalerinfo WHERE mac = :mac")
-                    name_result = connection.execute(name_query, {"mac": mac})
-                    info_row = name_result.fetchone()
-                    if info_row:
-                        meter["name"] = info_row.name if info_row.name else "Unavngivet"
-                        meter["number"] = info_row.nummer if info_row.nummer else None
-                    else:
-                        meter["name"] = "Unavngivet"
-                        meter["number"] = None
-                except Exception as e:
-                    meter['error'] = f"Fejl ved hentning af navn: {str(e)}"
-                
-                meters.append(meter)
-            
             return meters
     except Exception as e:
         print(f"Fejl ved hentning af målere: {e}")
-        return []
+        raise DatabaseReadError(str(e)) from e
+
+def _overview_from_history(connection):
+    """Oversigten direkte fra historiktabellerne - bruges når meter_latest ikke er klar"""
+    query = text("""
+        SELECT
+            alle.mac,
+            e.totalKwh,
+            e.tidspunkt,
+            s.status,
+            s.tidspunkt AS status_tidspunkt,
+            i.id AS info_id,
+            i.name,
+            i.nummer,
+            CURRENT_TIMESTAMP() AS db_tidspunkt
+        FROM (
+            SELECT mac FROM energimaaling
+            UNION
+            SELECT mac FROM maalerstatus
+        ) AS alle
+        LEFT JOIN (
+            SELECT mac, MAX(tidspunkt) AS seneste_tidspunkt
+            FROM energimaaling
+            GROUP BY mac
+        ) em ON em.mac = alle.mac
+        LEFT JOIN energimaaling e
+            ON e.mac = em.mac AND e.tidspunkt = em.seneste_tidspunkt
+        LEFT JOIN (
+            SELECT mac, MAX(tidspunkt) AS seneste_tidspunkt
+            FROM maalerstatus
+            GROUP BY mac
+        ) sm ON sm.mac = alle.mac
+        LEFT JOIN maalerstatus s
+            ON s.mac = sm.mac AND s.tidspunkt = sm.seneste_tidspunkt
+        LEFT JOIN maalerinfo i ON i.mac = alle.mac
+    """)
+    # Flere rækker med samme tidspunkt giver dubletter - første række vinder
+    meters = {}
+    for row in connection.execute(query):
+        if row.mac not in meters:
+            meters[row.mac] = _build_overview_meter(row)
+    return list(meters.values())
+
+def _build_overview_meter(row):
+    """Byg oversigtsobjektet for én måler ud fra en række fra meter_latest"""
+    meter = {"mac": row.mac, "status": "offline", "error": "Ingen data"}
+    
+    # Seneste måling
+    if row.tidspunkt is not None:
+        meter.update({
+            "lastSeen": row.db_tidspunkt.strftime('%Y-%m-%d %H:%M:%S') if row.db_tidspunkt else None,
+            "lastReading": float(row.totalKwh) if row.totalKwh is not None else 0.0,
+            "error": None
+        })
+    
+    # Seneste status
+    if row.status_tidspunkt is not None:
+        meter.update({
+            "status": "online" if row.status == "Tændt" else "offline",
+            "power": "tændt" if row.status == "Tændt" else "slukket",
+            "sidste_status_tid": row.status_tidspunkt.strftime('%Y-%m-%d %H:%M:%S')
+        })
+    
+    # Navngivning
+    if row.info_id is not None:
+        meter["name"] = row.name if row.name else "Unavngivet"
+        meter["number"] = row.nummer if row.nummer else None
+    else:
+        meter["name"] = "Unavngivet"
+        meter["number"] = None
+    
+    return meter
 
 def get_meter_info(mac):
     """Hent information om en specifik måler"""
@@ -120,103 +486,351 @@ def get_meter_info(mac):
                 "status": {}
             }
             
-            # Tjek om der er et navngivet navn for måleren
-            name_query = text("SELECT * FROM maalerinfo WHERE mac = :mac")
-            name_result = connection.execute(name_query, {"mac": mac})
-            name_row = name_result.fetchone()
-            
-            if name_row:
-                # Konverter row til dict på en sikker måde
-                info_dict = {}
-                for key in name_row._mapping.keys():
-                    info_dict[key] = name_row._mapping[key]
-                meter_data["info"] = info_dict
+            if not meter_latest_ready():
+                meter_data.update(_meter_info_from_history(connection, mac))
+                return meter_data
             
-            # Hent seneste måling
-            last_reading_query = text("""
-                SELECT m1.* FROM energimaaling m1
-                INNER JOIN (
-                    SELECT mac, MAX(tidspunkt) as seneste_tidspunkt
-                    FROM energimaaling
-                    WHERE mac = :mac
-                    GROUP BY mac
-                ) m2 ON m1.mac = m2.mac AND m1.tidspunkt = m2.seneste_tidspunkt
-            """)
-            last_reading_result = connection.execute(last_reading_query, {"mac": mac})
-            last_reading_row = last_reading_result.fetchone()
+            # meter_latest peger på de seneste rækker, som derefter hentes via primærnøgle
+            latest_query = text("SELECT reading_id, status_id, info_id FROM meter_latest WHERE mac = :mac")
+            latest = connection.execute(latest_query, {"mac": mac}).fetchone()
+            if not latest:
+                return meter_data
             
-            if last_reading_row:
-                # Konverter row til dict på en sikker måde
-                reading_dict = {}
-                for key in last_reading_row._mapping.keys():
-                    reading_dict[key] = last_reading_row._mapping[key]
-                meter_data["last_reading"] = reading_dict
+            if latest.info_id is not None:
+                name_row = connection.execute(text("SELECT * FROM maalerinfo WHERE id = :id"), {"id": latest.info_id}).fetchone()
+                if name_row:
+                    meter_data["info"] = _row_to_dict(name_row)
             
-            # Hent seneste status
-            status_query = text("""
-                SELECT s1.* FROM maalerstatus s1
-                INNER JOIN (
-                    SELECT mac, MAX(tidspunkt) as seneste_tidspunkt
-                    FROM maalerstatus
-                    WHERE mac = :mac
-                    GROUP BY mac
-                ) s2 ON s1.mac = s2.mac AND s1.tidspunkt = s2.seneste_tidspunkt
-            """)
-            status_result = connection.execute(status_query, {"mac": mac})
-            status_row = status_result.fetchone()
+            if latest.reading_id is not None:
+                reading_row = connection.execute(text("SELECT * FROM energimaaling WHERE id = :id"), {"id": latest.reading_id}).fetchone()
+                if reading_row:
+                    meter_data["last_reading"] = _row_to_dict(reading_row)
             
-            if status_row:
-                # Konverter row til dict på en sikker måde
-                status_dict = {}
-                for key in status_row._mapping.keys():
-                    status_dict[key] = status_row._mapping[key]
-                meter_data["status"] = status_dict
+            if latest.status_id is not None:
+                status_row = connection.execute(text("SELECT * FROM maalerstatus WHERE id = :id"), {"id": latest.status_id}).fetchone()
+                if status_row:
+                    meter_data["status"] = _row_to_dict(status_row)
             
             return meter_data
     except Exception as e:
         print(f"Fejl ved hentning af målerinfo: {e}")
         return {"error": str(e), "mac": mac}
 
-def get_meter_readings(mac, limit=200):
-    """Hent de seneste målinger for en specifik måler"""
+def _meter_info_from_history(connection, mac):
+    """Navngivning, seneste måling og seneste status for én måler direkte fra
+    historiktabellerne - bruges når meter_latest ikke er klar"""
+    info = {}
+    queries = {
+        "info": text("SELECT * FROM maalerinfo WHERE mac = :mac"),
+        "last_reading": text("""
+            SELECT * FROM energimaaling
+            WHERE mac = :mac
+            ORDER BY tidspunkt DESC, id DESC
+            LIMIT 1
+        """),
+        "status": text("""
+            SELECT * FROM maalerstatus
+            WHERE mac = :mac
+            ORDER BY tidspunkt DESC, id DESC
+            LIMIT 1
+        """),
+    }
+    for key, query in queries.items():
+        row = connection.execute(query, {"mac": mac}).fetchone()
+        if row:
+            info[key] = _row_to_dict(row)
+    return info
+
+def get_meters_info(macs):
+    """Hent information om flere målere på én gang med et fast antal forespørgsler.
+    
+    Returnerer {"meters": [...]} i samme rækkefølge som macs, hvor hvert element har samme
+    form som get_meter_info.
+    """
+    try:
+        meters = {
+            mac: {"mac": mac, "info": {}, "last_reading": {}, "status": {}}
+            for mac in macs
+        }
+        if not meters:
+            return {"meters": []}
+        
+        with engine.connect() as connection:
+            if not meter_latest_ready():
+                for mac, meter in meters.items():
+                    meter.update(_meter_info_from_history(connection, mac))
+                return {"meters": list(meters.values())}
+            
+            latest_query = text("""
+                SELECT mac, reading_id, status_id, info_id FROM meter_latest
+                WHERE mac IN :macs
+            """).bindparams(bindparam("macs", expanding=True))
+            latest_rows = connection.execute(latest_query, {"macs": list(meters)}).fetchall()
+            
+            # Hent de rækker meter_latest peger på - én IN-forespørgsel pr. tabel
+            for table, id_column, key in (
+                ("maalerinfo", "info_id", "info"),
+                ("energimaaling", "reading_id", "last_reading"),
+                ("maalerstatus", "status_id", "status"),
+            ):
+                owners = {getattr(row, id_column): row.mac for row in latest_rows if getattr(row, id_column) is not None}
+                if not owners:
+                    continue
+                query = text(f"SELECT * FROM {table} WHERE id IN :ids").bindparams(bindparam("ids", expanding=True))
+                for row in connection.execute(query, {"ids": list(owners)}):
+                    meters[owners[row.id]][key] = _row_to_dict(row)
+        
+        return {"meters": list(meters.values())}
+    except Exception as e:
+        print(f"Fejl ved hentning af flere målere: {e}")
+        return {"error": str(e)}
+
+def _rows_to_dicts(keys, rows):
+    """Konverter rækker til en liste af dictionaries med ISO-formaterede datoer"""
+    readings = []
+    for row in rows:
+        row_dict = {}
+        for column, value in zip(keys, row):
+            # Konverter dato-objekter til strenge
+            if isinstance(value, (datetime.date, datetime.datetime)):
+                row_dict[column] = value.isoformat()
+            else:
+                row_dict[column] = value
+        readings.append(row_dict)
+    return readings
+
+def _convert_column(values):
+    """Konverter en hel kolonne på én gang ud fra dens type.
+    
+    Datoer bliver epoch-sekunder (tidspunkterne i databasen er UTC), Decimal bliver float,
+    og NULL bevares som None.
+    """
+    sample = next((value for value in values if value is not None), None)
+    if isinstance(sample, (datetime.date, datetime.datetime)):
+        array = np.array(values, dtype='datetime64[s]')
+        missing = np.isnat(array)
+        converted = array.astype(np.int64).astype(object)
+    elif isinstance(sample, (Decimal, float)):
+        array = np.array(values, dtype=np.float64)
+        missing = np.isnan(array)
+        converted = array.astype(object)
+    else:
+        return list(values)
+    converted[missing] = None
+    return converted.tolist()
+
+def _rows_to_columns(keys, rows):
+    """Konverter rækker til kolonneformat: {columns: [...], data: {kolonne: [...]}}"""
+    keys = list(keys)
+    columns = list(zip(*rows)) if rows else [()] * len(keys)
+    return {
+        "columns": keys,
+        "data": {key: _convert_column(values) for key, values in zip(keys, columns)}
+    }
+
+def encode_reading_cursor(readings, index):
+    """Lav en cursor ud fra målingen på plads index (tidspunkt og id som tie-breaker).
+    
+    readings kan være en liste af dictionaries eller kolonneformatet fra _rows_to_columns.
+    """
+    if isinstance(readings, dict):
+        return f"{readings['data']['tidspunkt'][index]},{readings['data']['id'][index]}"
+    return f"{readings[index]['tidspunkt']},{readings[index]['id']}"
+
+def decode_reading_cursor(cursor):
+    """Fortolk en cursor fra encode_reading_cursor - rejser ValueError ved ugyldigt format
+    og OverflowError/OSError ved et tidspunkt uden for datetime's område"""
+    tidspunkt, reading_id = cursor.rsplit(',', 1)
+    if tidspunkt.isdigit():
+        # Cursor fra kolonneformatet med epoch-sekunder (UTC)
+        tid = datetime.datetime.fromtimestamp(int(tidspunkt), datetime.timezone.utc).replace(tzinfo=None)
+    else:
+        tid = datetime.datetime.fromisoformat(tidspunkt)
+    return tid, int(reading_id)
+
+def count_readings(readings):
+    """Antal målinger i en liste eller i kolonneformatet"""
+    if isinstance(readings, dict):
+        return len(next(iter(readings["data"].values()), []))
+    return len(readings)
+
+def get_meter_readings(mac, limit=200, before=None, after=None, columnar=False):
+    """Hent målinger for en specifik måler, nyeste først.
+    
+    Uden cursor hentes de seneste målinger. Med before/after (fra decode_reading_cursor)
+    hentes siden før eller efter cursoren via (tidspunkt, id), så enhver side koster det
+    samme som den første - uanset hvor langt tilbage i historikken den ligger.
+    Med columnar=True returneres kolonneformatet fra _rows_to_columns.
+    """
     try:
         with engine.connect() as connection:
             # Debug: Udskriv MAC-adressen
             print(f"Henter målinger for MAC: '{mac}', type: {type(mac)}")
             
-            # Tjek først om der er data for denne MAC-adresse
-            count_query = text("SELECT COUNT(*) FROM energimaaling WHERE mac = :mac")
-            count_result = connection.execute(count_query, {"mac": mac}).fetchone()
-            print(f"Antal målinger fundet: {count_result[0]}")
-            
-            # Hent målinger
-            query = text("""
-                SELECT * FROM energimaaling 
-                WHERE mac = :mac 
-                ORDER BY tidspunkt DESC 
-                LIMIT :limit
-            """)
-            result = connection.execute(query, {"mac": mac, "limit": limit})
+            # Hent målinger. (mac, tidspunkt)-indekset indeholder primærnøglen id,
+            # så både sortering og cursor-betingelsen kan besvares direkte fra indekset.
+            params = {"mac": mac, "limit": limit}
+            if before is not None:
+                params["tid"], params["id"] = before
+                query = text("""
+                    SELECT * FROM energimaaling 
+                    WHERE mac = :mac 
+                      AND (tidspunkt < :tid OR (tidspunkt = :tid AND id < :id))
+                    ORDER BY tidspunkt DESC, id DESC 
+                    LIMIT :limit
+                """)
+            elif after is not None:
+                params["tid"], params["id"] = after
+                query = text("""
+                    SELECT * FROM energimaaling 
+                    WHERE mac = :mac 
+                      AND (tidspunkt > :tid OR (tidspunkt = :tid AND id > :id))
+                    ORDER BY tidspunkt ASC, id ASC 
+                    LIMIT :limit
+                """)
+            else:
+                query = text("""
+                    SELECT * FROM energimaaling 
+                    WHERE mac = :mac 
+                    ORDER BY tidspunkt DESC, id DESC 
+                    LIMIT :limit
+                """)
+            result = connection.execute(query, params)
+            keys = result.keys()
+            rows = result.fetchall()
             
-            # Korrekt konvertering af rækker til dictionaries
-            readings = []
-            for row in result:
-                row_dict = {}
-                for column, value in zip(row._mapping.keys(), row):
-                    # Konverter dato-objekter til strenge
-                    if isinstance(value, (datetime.date, datetime.datetime)):
-                        row_dict[column] = value.isoformat()
-                    else:
-                        row_dict[column] = value
-                readings.append(row_dict)
+            # Siden efter en cursor hentes stigende - vend den så svaret altid er nyeste først
+            if after is not None:
+                rows.reverse()
             
-            print(f"Returnerer {len(readings)} målinger")
-            return readings
+            print(f"Returnerer {len(rows)} målinger")
+            if columnar:
+                return _rows_to_columns(keys, rows)
+            return _rows_to_dicts(keys, rows)
     except Exception as e:
         print(f"Fejl ved hentning af måleraflæsninger: {e}")
-        return []
+        raise DatabaseReadError(str(e)) from e
+
+def _read_rollup_points(connection, mac, start, end, rollup):
+    """Ét punkt pr. interval i en aggregeret tabel: intervallets sidste måling.
+    
+    Returnerer (rækker som (id, mac, tidspunkt, totalkwh), antal rå målinger bag dem).
+    """
+    # Intervaller der starter før start kan stadig have målinger i tidsrummet, og døgn og
+    # måneder afgrænses i dansk tid, så deres start kan ligge op til to timer efter end (UTC)
+    bucket_start = start - datetime.timedelta(seconds=2 * rollup.bucket_seconds)
+    bucket_end = end + datetime.timedelta(seconds=rollup.bucket_seconds)
+    query = text(f"""
+        SELECT sidste_tidspunkt, totalKwh, antal_maalinger FROM {rollup.table}
+        WHERE mac = :mac AND {rollup.key_column} BETWEEN :bucket_start AND :bucket_end
+          AND sidste_tidspunkt BETWEEN :start AND :end
+        ORDER BY {rollup.key_column} ASC
+    """)
+    result = connection.execute(query, {"mac": mac, "bucket_start": bucket_start, "bucket_end": bucket_end, "start": start, "end": end})
+    rows = []
+    raw_count = 0
+    for tidspunkt, total, antal in result:
+        rows.append((None, mac, tidspunkt, total))
+        raw_count += antal
+    return rows, raw_count
 
-def get_daily_readings(mac, days=30):
+def get_meter_readings_range(mac, start, end, points=1000, columnar=False, rollup=None):
+    """Hent målinger i tidsrummet [start, end] nedsamplet til højst points punkter.
+    
+    Punkterne vælges med LTTB (downsample.lttb), så kurvens form bevares uanset hvor
+    langt tidsrummet er. Returnerer (målinger, antal rå målinger i tidsrummet); målingerne
+    er nyeste først ligesom get_meter_readings.
+    
+    Med rollup (en tabel fra rollup.ROLLUPS) læses ét punkt pr. interval i stedet for de
+    rå målinger. Tabellen opdateres lidt bagefter, så målinger efter dens seneste
+    interval hentes rå og lægges til. Fejler tabellen, bruges de rå målinger.
+    """
+    keys = ["id", "mac", "tidspunkt", "totalkwh"]
+    try:
+        with engine.connect() as connection:
+            rows, raw_count = [], 0
+            if rollup is not None:
+                try:
+                    rows, raw_count = _read_rollup_points(connection, mac, start, end, rollup)
+                except Exception as e:
+                    print(f"Fejl ved læsning af {rollup.table} - bruger rå målinger: {e}")
+            
+            if rows:
+                query = text("""
+                    SELECT id, mac, tidspunkt, totalkwh FROM energimaaling 
+                    WHERE mac = :mac AND tidspunkt > :start AND tidspunkt <= :end
+                    ORDER BY tidspunkt ASC, id ASC
+                """)
+                tail = connection.execute(query, {"mac": mac, "start": rows[-1][2], "end": end}).fetchall()
+            else:
+                query = text("""
+                    SELECT id, mac, tidspunkt, totalkwh FROM energimaaling 
+                    WHERE mac = :mac AND tidspunkt BETWEEN :start AND :end
+                    ORDER BY tidspunkt ASC, id ASC
+                """)
+                tail = connection.execute(query, {"mac": mac, "start": start, "end": end}).fetchall()
+            rows.extend(tail)
+            raw_count += len(tail)
+        
+        if len(rows) > points:
+            ids, macs, tider, values = zip(*rows)
+            x = np.array(tider, dtype='datetime64[s]').astype(np.int64)
+            y = np.array(values, dtype=np.float64)
+            # Manglende værdier tæller som 0 ved udvælgelsen, men returneres uændret
+            y[np.isnan(y)] = 0.0
+            rows = [rows[i] for i in lttb(x, y, points)]
+        
+        rows.reverse()
+        if columnar:
+            return _rows_to_columns(keys, rows), raw_count
+        return _rows_to_dicts(keys, rows), raw_count
+    except Exception as e:
+        print(f"Fejl ved hentning af målinger i tidsrum: {e}")
+        raise DatabaseReadError(str(e)) from e
+
+def get_meter_stats(mac):
+    """Hent vedligeholdte tællere for en måler (antal målinger, første og seneste tidspunkt)"""
+    try:
+        with engine.connect() as connection:
+            if meter_latest_ready():
+                query = text("""
+                    SELECT antal_maalinger, foerste_tidspunkt, tidspunkt, antal_dage, status_tidspunkt
+                    FROM meter_latest
+                    WHERE mac = :mac
+                """)
+                row = connection.execute(query, {"mac": mac}).fetchone()
+            else:
+                row = _meter_stats_from_history(connection, mac)
+            if not row:
+                return None
+            
+            return {
+                "mac": mac,
+                "antal_maalinger": row.antal_maalinger,
+                "foerste_maaling": row.foerste_tidspunkt.isoformat() if row.foerste_tidspunkt else None,
+                "seneste_maaling": row.tidspunkt.isoformat() if row.tidspunkt else None,
+                "antal_dage_med_data": row.antal_dage,
+                "seneste_status": row.status_tidspunkt.isoformat() if row.status_tidspunkt else None
+            }
+    except Exception as e:
+        print(f"Fejl ved hentning af målerstatistik: {e}")
+        return {"error": str(e), "mac": mac}
+
+def _meter_stats_from_history(connection, mac):
+    """Tællerne for én måler talt op i historiktabellerne - bruges når meter_latest ikke er klar"""
+    return connection.execute(text("""
+        SELECT
+            COUNT(*) AS antal_maalinger,
+            MIN(tidspunkt) AS foerste_tidspunkt,
+            MAX(tidspunkt) AS tidspunkt,
+            COUNT(DISTINCT DATE(tidspunkt)) AS antal_dage,
+            (SELECT MAX(tidspunkt) FROM maalerstatus WHERE mac = :mac) AS status_tidspunkt
+        FROM energimaaling
+        WHERE mac = :mac
+        HAVING COUNT(*) > 0 OR status_tidspunkt IS NOT NULL
+    """), {"mac": mac}).fetchone()
+
+def get_daily_readings(mac, days=30, columnar=False):
     """Hent de seneste daglige målinger for en specifik måler"""
     try:
         with engine.connect() as connection:
@@ -228,126 +842,50 @@ def get_daily_readings(mac, days=30):
             """)
             result = connection.execute(query, {"mac": mac, "days": days})
             
-            # Korrekt konvertering af rækker til dictionaries
-            readings = []
-            for row in result:
-                row_dict = {}
-                for column, value in zip(row._mapping.keys(), row):
-                    # Konverter dato-objekter til strenge
-                    if isinstance(value, (datetime.date, datetime.datetime)):
-                        row_dict[column] = value.isoformat()
-                    else:
-                        row_dict[column] = value
-                readings.append(row_dict)
-                
-            return readings
+            if columnar:
+                return _rows_to_columns(result.keys(), result.fetchall())
+            return _rows_to_dicts(result.keys(), result)
     except Exception as e:
         print(f"Fejl ved hentning af daglige aflæsninger: {e}")
-        return []
+        raise DatabaseReadError(str(e)) from e
 
 def get_unnamed_meters():
     """Find målere der har målinger men ikke er navngivet endnu med detaljerede oplysninger"""
     try:
-        meters = []
         with engine.connect() as connection:
-            # Først find tidspunktet for den seneste måling i databasen
-            latest_query = text("SELECT MAX(tidspunkt) as nyeste_tidspunkt FROM energimaaling")
-            latest_result = connection.execute(latest_query).fetchone()
-            seneste_tidspunkt = latest_result[0]
-            
-            if not seneste_tidspunkt:
-                print("Ingen målinger fundet i databasen!")
-                return []
-                
-            print(f"Seneste måling i databasen: {seneste_tidspunkt}")
+            # Én gennemgang af meter_latest finder både målere med målinger og unavngivne
+            # målere fra maalerinfo uden målinger. Online/offline bestemmes ud fra den
+            # seneste måling i systemet (30 min interval), som også slås op i meter_latest.
+            if not meter_latest_ready():
+                result = _unnamed_meters_from_history(connection)
+            else:
+                result = connection.execute(text("""
+                    SELECT 
+                        l.mac, 
+                        l.tidspunkt as sidst_set,
+                        CASE WHEN l.tidspunkt >= DATE_SUB(nyeste.tidspunkt, INTERVAL 30 MINUTE) 
+                             THEN 'online' ELSE 'offline' END as status,
+                        l.totalKwh as seneste_totalKwh,
+                        l.antal_dage as antal_dage_med_data
+                    FROM meter_latest l
+                    CROSS JOIN (SELECT MAX(tidspunkt) as tidspunkt FROM meter_latest) nyeste
+                    WHERE (l.tidspunkt IS NOT NULL OR l.info_id IS NOT NULL)
+                      AND (l.name IS NULL OR l.name = '' OR l.name = 'Unavngivet')
+                    ORDER BY l.tidspunkt IS NULL, l.tidspunkt DESC
+                """))
             
-            # Hent målere der findes i energimaaling men ikke i maalerinfo
-            # eller har NULL/tom værdi i name-feltet i maalerinfo
-            # Bestem online/offline status baseret på seneste måling (30 min interval)
-            query = text("""
-                SELECT 
-                    e.mac, 
-                    MAX(e.tidspunkt) as sidst_set,
-                    CASE WHEN MAX(e.tidspunkt) >= DATE_SUB(:seneste_tid, INTERVAL 30 MINUTE) 
-                         THEN 'online' ELSE 'offline' END as status,
-                    (SELECT totalKwh FROM energimaaling 
-                     WHERE mac = e.mac 
-                     ORDER BY tidspunkt DESC LIMIT 1) as seneste_totalKwh,
-                    COUNT(DISTINCT DATE(e.tidspunkt)) as antal_dage_med_data
-                FROM energimaaling e
-                LEFT JOIN maalerinfo m ON e.mac = m.mac
-                WHERE m.mac IS NULL OR m.name IS NULL OR m.name = '' OR m.name = 'Unavngivet'
-                GROUP BY e.mac
-                ORDER BY sidst_set DESC
-            """)
-            result = connection.execute(query, {"seneste_tid": seneste_tidspunkt})
+            meters = []
             for row in result:
-                # Konverter SQLAlchemy Row til dict manuelt
-                # Konverter Decimal værdier til float
-                seneste_kwh = row[3]
-                if seneste_kwh is not None:
-                    # Sikrer konvertering fra Decimal til float
-                    seneste_kwh = float(seneste_kwh)
-                
-                meter = {
-                    "mac": row[0],
-                    "sidst_set": row[1],
-                    "status": row[2],
-                    "seneste_totalKwh": seneste_kwh,
-                    "antal_dage_med_data": row[4],
+                meters.append({
+                    "mac": row.mac,
+                    "sidst_set": row.sidst_set,
+                    "status": row.status,
+                    # Konverter Decimal til float
+                    "seneste_totalKwh": float(row.seneste_totalKwh) if row.seneste_totalKwh is not None else None,
+                    "antal_dage_med_data": row.antal_dage_med_data if row.sidst_set is not None else 0,
                     "name": None,
                     "number": None
-                }
-                meters.append(meter)
-            
-            # Hent også målere fra maalerinfo som er unavngivne men ikke har målinger
-            query2 = text("""
-                SELECT 
-                    m.mac,
-                    NULL as sidst_set,
-                    'offline' as status,
-                    NULL as seneste_totalKwh,
-                    0 as antal_dage_med_data
-                FROM maalerinfo m
-                LEFT JOIN energimaaling e ON m.mac = e.mac
-                WHERE e.mac IS NULL AND (m.name IS NULL OR m.name = '' OR m.name = 'Unavngivet')
-            """)
-            result2 = connection.execute(query2)
-            for row in result2:
-                # Tjek om denne måler allerede er tilføjet (undgå dubletter)
-                if not any(m['mac'] == row[0] for m in meters):
-                    meter = {
-                        "mac": row[0],
-                        "sidst_set": None,
-                        "status": "offline",
-                        "seneste_totalKwh": None,
-                        "antal_dage_med_data": 0,
-                        "name": None,
-                        "number": None
-                    }
-                    meters.append(meter)
-            
-            # Hent alle målere markeret som "Unavngivet" i maalerinfo tabellen
-            query3 = text("""
-                SELECT 
-                    mac
-                FROM maalerinfo
-                WHERE name = 'Unavngivet'
-            """)
-            result3 = connection.execute(query3)
-            for row in result3:
-                # Tjek om denne måler allerede er tilføjet (undgå dubletter)
-                if not any(m['mac'] == row[0] for m in meters):
-                    meter = {
-                        "mac": row[0],
-                        "sidst_set": None,
-                        "status": "offline",
-                        "seneste_totalKwh": None,
-                        "antal_dage_med_data": 0,
-                        "name": None,
-                        "number": None
-                    }
-                    meters.append(meter)
+                })
             
             # Log antal fundne målere til debugging
             print(f"Fandt {len(meters)} unavngivne målere: {[m['mac'] for m in meters]}")
@@ -357,35 +895,45 @@ def get_unnamed_meters():
         print(f"Fejl ved hentning af ubenævnte målere: {e}")
         return []
 
+def _unnamed_meters_from_history(connection):
+    """Unavngivne målere direkte fra historiktabellerne med samme kolonner som forespørgslen
+    på meter_latest - bruges når meter_latest ikke er klar"""
+    return connection.execute(text("""
+        SELECT
+            alle.mac,
+            d.sidst_set,
+            CASE WHEN d.sidst_set >= DATE_SUB(nyeste.tidspunkt, INTERVAL 30 MINUTE)
+                 THEN 'online' ELSE 'offline' END as status,
+            e.totalKwh as seneste_totalKwh,
+            d.antal_dage_med_data
+        FROM (
+            SELECT mac FROM energimaaling
+            UNION
+            SELECT mac FROM maalerinfo
+        ) alle
+        LEFT JOIN (
+            SELECT mac, MAX(tidspunkt) as sidst_set, COUNT(DISTINCT DATE(tidspunkt)) as antal_dage_med_data
+            FROM energimaaling
+            GROUP BY mac
+        ) d ON d.mac = alle.mac
+        LEFT JOIN energimaaling e ON e.id = (
+            SELECT id FROM energimaaling
+            WHERE mac = alle.mac
+            ORDER BY tidspunkt DESC, id DESC
+            LIMIT 1
+        )
+        LEFT JOIN maalerinfo m ON m.mac = alle.mac
+        CROSS JOIN (SELECT MAX(tidspunkt) as tidspunkt FROM energimaaling) nyeste
+        WHERE m.mac IS NULL OR m.name IS NULL OR m.name = '' OR m.name = 'Unavngivet'
+        ORDER BY d.sidst_set IS NULL, d.sidst_set DESC
+    """))
+
 def update_meter_name(mac, name, number):
     """Opdater eller opret målerinfo med navn og nummer"""
-    try:
-        with engine.connect() as connection:
-            # Tjek om MAC adressen allerede findes
-            check_query = text("SELECT mac FROM maalerinfo WHERE mac = :mac")
-            result = connection.execute(check_query, {"mac": mac})
-            exists = result.fetchone() is not None
-            
-            if exists:
-                # Opdater eksisterende måler
-                update_query = text("""
-                    UPDATE maalerinfo 
-                    SET name = :name, nummer = :number
-                    WHERE mac = :mac
-                """)
-                connection.execute(update_query, {"mac": mac, "name": name, "number": number})
-            else:
-                # Opret ny målerinfo
-                insert_query = text("""
-                    INSERT INTO maalerinfo (mac, name, nummer)
-                    VALUES (:mac, :name, :number)
-                """)
-                connection.execute(insert_query, {"mac": mac, "name": name, "number": number})
-            
-            return True
-    except Exception as e:
-        print(f"Fejl ved opdatering af målernavn: {e}")
-        return False
+    return update_meter_info(mac, name, number)
+
+# Sammenlagte tabeller ud over energimaaling_daglig (se rollup.ROLLUPS)
+ROLLUP_TABLES = ["energimaaling_kvarter", "energimaaling_time", "energimaaling_maanedlig"]
 
 def delete_meter(mac):
     """Slet en måler og alle dens data"""
@@ -403,11 +951,23 @@ def delete_meter(mac):
                 # Slet fra energimaaling_daglig
                 connection.execute(text("DELETE FROM energimaaling_daglig WHERE mac = :mac"), {"mac": mac})
                 
+                # Slet fra de sammenlagte tabeller (findes kun når rollup.py har oprettet dem;
+                # en fejlet sætning annullerer ikke resten af transaktionen i MySQL)
+                for table in ROLLUP_TABLES:
+                    try:
+                        connection.execute(text(f"DELETE FROM {table} WHERE mac = :mac"), {"mac": mac})
+                    except Exception as e:
+                        print(f"Kunne ikke slette fra {table}: {e}")
+                
                 # Slet fra maalerstatus
                 connection.execute(text("DELETE FROM maalerstatus WHERE mac = :mac"), {"mac": mac})
                 
+                # Slet seneste tilstand
+                connection.execute(text("DELETE FROM meter_latest WHERE mac = :mac"), {"mac": mac})
+                
                 # Commit transaktionen
                 trans.commit()
+                meter_index.remove(mac)
                 return True
             except Exception as e:
                 # Hvis der opstår en fejl, rollback transaktionen
@@ -417,62 +977,143 @@ def delete_meter(mac):
         print(f"Fejl ved sletning af måler: {e}")
         return False
 
-def check_meter_number_exists(number):
-    """Tjek om et specifikt målernummer allerede er i brug"""
+class NumberInUseError(Exception):
+    """Målernummeret er allerede tildelt en anden måler (afvist af databasens unikke indeks)"""
+    
+    def __init__(self, number, holder):
+        super().__init__(f"Målernummer {number} er allerede i brug")
+        self.number = number
+        self.holder = holder
+
+# Skrivninger til maalerinfo udføres én ad gangen, så indekset opdateres i commit-rækkefølge
+maalerinfo_write_lock = threading.Lock()
+
+def load_meter_index():
+    """Indlæs maalerinfo i hukommelsen (meter_index)"""
     try:
         with engine.connect() as connection:
-            query = text("""
-                SELECT mac, name, nummer
-                FROM maalerinfo
-                WHERE nummer = :number
-            """)
-            result = connection.execute(query, {"number": number})
-            row = result.fetchone()
-            if row:
-                return dict(row)
-            return None
+            rows = connection.execute(text("SELECT mac, name, nummer FROM maalerinfo")).fetchall()
+        meter_index.load(rows)
+        print(f"Indlæst {len(rows)} målere i navne- og nummerindekset")
+        return True
+    except Exception as e:
+        print(f"Fejl ved indlæsning af målerindeks: {e}")
+        return False
+
+def get_meter_index():
+    """Målerindekset - indlæses første gang det bruges"""
+    if not meter_index.loaded:
+        load_meter_index()
+    return meter_index
+
+def get_latest_statuses():
+    """Seneste status (Tændt/Slukket) for hver måler fra meter_latest som {mac: status}"""
+    try:
+        with engine.connect() as connection:
+            if meter_latest_ready():
+                rows = connection.execute(text("""
+                    SELECT mac, status FROM meter_latest WHERE status IS NOT NULL
+                """)).fetchall()
+            else:
+                rows = _latest_statuses_from_history(connection)
+        return {row.mac: row.status for row in rows}
     except Exception as e:
+        print(f"Fejl ved hentning af seneste status: {e}")
+        return {}
+
+def _latest_statuses_from_history(connection):
+    """Seneste status pr. måler direkte fra maalerstatus - bruges når meter_latest ikke er klar"""
+    return connection.execute(text("""
+        SELECT s.mac, s.status
+        FROM maalerstatus s
+        JOIN (
+            SELECT mac, MAX(id) AS status_id
+            FROM maalerstatus s1
+            WHERE tidspunkt = (SELECT MAX(tidspunkt) FROM maalerstatus s2 WHERE s2.mac = s1.mac)
+            GROUP BY mac
+        ) seneste ON seneste.status_id = s.id
+    """)).fetchall()
+
+def check_meter_number_exists(number):
+    """Tjek om et specifikt målernummer allerede er i brug - besvares fra indekset"""
+    try:
+        return get_meter_index().holder(normalize_meter_number(number))
+    except (TypeError, ValueError) as e:
         print(f"Fejl ved kontrol af målernummer: {e}")
         return None
 
 def update_meter_info(mac, name, number):
-    """Opdater eller opret en måler med navn og nummer i maalerinfo tabellen"""
+    """Opdater eller opret en måler med navn og nummer i maalerinfo tabellen.
+    
+    Nummeret gemmes som tre cifre. Har en anden måler nummeret, kastes NumberInUseError.
+    Nummeret kontrolleres under skrivelåsen - først i indekset og så i transaktionen - så
+    dubletter afvises også før migrering 5 har lagt det unikke indeks på nummer. Med
+    indekset afgør databasen atomisk hvem der får et nummer, også på tværs af processer.
+    """
+    number = normalize_meter_number(number)
     try:
-        with engine.connect() as connection:
-            # Tjek først om MAC adressen allerede eksisterer
-            check_query = text("""
-                SELECT mac FROM maalerinfo
-                WHERE mac = :mac
-            """)
-            result = connection.execute(check_query, {"mac": mac})
-            exists = result.fetchone() is not None
-            
-            if exists:
-                # Opdater eksisterende måler
-                update_query = text("""
-                    UPDATE maalerinfo
-                    SET name = :name, nummer = :number
-                    WHERE mac = :mac
-                """)
-                connection.execute(update_query, {
-                    "mac": mac,
-                    "name": name,
-                    "number": number
-                })
-            else:
-                # Indsæt ny måler
-                insert_query = text("""
-                    INSERT INTO maalerinfo (mac, name, nummer)
-                    VALUES (:mac, :name, :number)
-                """)
-                connection.execute(insert_query, {
-                    "mac": mac,
-                    "name": name,
-                    "number": number
-                })
+        with maalerinfo_write_lock:
+            if number is not None:
+                holder = get_meter_index().holder(number)
+                if holder and holder["mac"] != meter_tag(mac):
+                    raise NumberInUseError(number, holder)
+            try:
+                with engine.begin() as connection:
+                    if number is not None:
+                        taken = connection.execute(text("""
+                            SELECT mac, name, nummer FROM maalerinfo
+                            WHERE nummer = :number AND mac <> :mac
+                            LIMIT 1 FOR UPDATE
+                        """), {"number": number, "mac": mac}).fetchone()
+                        if taken:
+                            # Indekset var bagud - ret det
+                            meter_index.set(taken.mac, taken.name, taken.nummer)
+                            raise NumberInUseError(number, {"mac": taken.mac, "name": taken.name, "nummer": taken.nummer})
+                    
+                    # Lås målerens række, så samtidige opdateringer af samme MAC venter
+                    existing = connection.execute(
+                        text("SELECT id FROM maalerinfo WHERE mac = :mac FOR UPDATE"), {"mac": mac}
+                    ).fetchone()
+                    
+                    if existing:
+                        # Opdater eksisterende måler
+                        update_query = text("""
+                            UPDATE maalerinfo
+                            SET name = :name, nummer = :number
+                            WHERE id = :id
+                        """)
+                        connection.execute(update_query, {"id": existing.id, "name": name, "number": number})
+                    else:
+                        # Indsæt ny måler
+                        insert_query = text("""
+                            INSERT INTO maalerinfo (mac, name, nummer)
+                            VALUES (:mac, :name, :number)
+                        """)
+                        connection.execute(insert_query, {"mac": mac, "name": name, "number": number})
+            except IntegrityError:
+                holder = _number_holder(number)
+                if holder and meter_tag(holder["mac"]) != meter_tag(mac):
+                    raise NumberInUseError(number, holder)
+                raise
             
-            connection.commit()
-            return True
+            meter_index.set(mac, name, number)
+        return True
+    except NumberInUseError:
+        raise
     except Exception as e:
         print(f"Fejl ved opdatering af målerinfo: {e}")
         return False
+
+def _number_holder(number):
+    """Slå nummerets indehaver op i databasen (efter en afvist skrivning)"""
+    if number is None:
+        return None
+    with engine.connect() as connection:
+        row = connection.execute(
+            text("SELECT mac, name, nummer FROM maalerinfo WHERE nummer = :number"), {"number": number}
+        ).fetchone()
+    if row is None:
+        return None
+    # Indekset var bagud - ret det
+    meter_index.set(row.mac, row.name, row.nummer)
+    return {"mac": row.mac, "name": row.name, "nummer": row.nummer}
@@ -0,0 +1,77 @@
+import threading
+import time
+
+class Coalescer:
+    """Samler MQTT-beskeder til webklienterne og sender den nyeste pr. emne i ét event.
+
+    publish() gemmer kun beskeden; kommer der en ny besked på samme emne inden vinduet
+    er gået, erstatter den den gamle. Hvert window sekund sendes alle ventende beskeder
+    som én liste med emit(event, [{"topic", "payload"}, ...]). Prisen for at sende til
+    klienterne afhænger derfor af antallet af emner pr. vindue og ikke af beskedraten.
+    """
+
+    def __init__(self, emit, event="mqtt_batch", window=0.25):
+        self.emit = emit
+        self.event = event
+        self.window = window
+        self.lock = threading.Lock()
+        self.latest = {}  # emne -> nyeste payload i det aktuelle vindue
+        self.running = False
+        self.published = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.sent = 0
+        self.max_batch = 0
+
+    def publish(self, topic, payload):
+        with self.lock:
+            self.published += 1
+            if topic in self.latest:
+                self.coalesced += 1
+            self.latest[topic] = payload
+
+    def flush(self):
+        """Send de ventende beskeder som ét event - returner antal beskeder sendt"""
+        with self.lock:
+            latest, self.latest = self.latest, {}
+        if not latest:
+            return 0
+        batch = [{"topic": topic, "payload": payload} for topic, payload in latest.items()]
+        try:
+            self.emit(self.event, batch)
+        except Exception as e:
+            print(f"Fejl ved afsendelse af {len(batch)} MQTT-beskeder til klienterne: {e}")
+            return 0
+        with self.lock:
+            self.batches += 1
+            self.sent += len(batch)
+            self.max_batch = max(self.max_batch, len(batch))
+        return len(batch)
+
+    def run_forever(self, sleep=time.sleep):
+        while self.running:
+            sleep(self.window)
+            self.flush()
+        self.flush()
+
+    def start(self, start_background_task):
+        if self.running:
+            return
+        self.running = True
+        start_background_task(self.run_forever)
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        with self.lock:
+            return {
+                "window_ms": round(self.window * 1000),
+                "pending": len(self.latest),
+                "published": self.published,
+                "coalesced": self.coalesced,
+                "batches": self.batches,
+                "sent": self.sent,
+                "max_batch": self.max_batch,
+                "avg_batch": round(self.sent / self.batches, 1) if self.batches else None
+            }
@@ -0,0 +1,92 @@
+import threading
+import time
+from datetime import datetime
+
+class HealthMonitor:
+    """Kører sundhedstjek i baggrunden med fast interval og gemmer seneste resultat.
+
+    /api/health læser kun det gemte resultat og blokerer derfor aldrig på databasen.
+    Et tjek der hænger længere end timeout regnes som fejlet, selv om det ikke er
+    færdigt endnu.
+    """
+
+    def __init__(self, checks, interval=10, timeout=5):
+        self.checks = checks  # navn -> funktion der returnerer True/False
+        self.interval = interval
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.results = {
+            name: {
+                "ok": False,
+                "latency_ms": None,
+                "last_check": None,
+                "last_success": None,
+                "consecutive_failures": 0,
+                "error": "Ikke tjekket endnu",
+                "running_since": None
+            }
+            for name in checks
+        }
+        self.running = False
+
+    def run_check(self, name):
+        with self.lock:
+            self.results[name]["running_since"] = time.monotonic()
+
+        start = time.perf_counter()
+        try:
+            ok = bool(self.checks[name]())
+            error = None if ok else "Tjek fejlede"
+        except Exception as e:
+            ok = False
+            error = str(e)
+        latency_ms = round((time.perf_counter() - start) * 1000, 2)
+        now = datetime.now().isoformat()
+
+        with self.lock:
+            result = self.results[name]
+            result.update({
+                "ok": ok,
+                "latency_ms": latency_ms,
+                "last_check": now,
+                "error": error,
+                "running_since": None
+            })
+            if ok:
+                result["last_success"] = now
+                result["consecutive_failures"] = 0
+            else:
+                result["consecutive_failures"] += 1
+
+    def run_forever(self, sleep=time.sleep):
+        while self.running:
+            for name in self.checks:
+                self.run_check(name)
+            sleep(self.interval)
+
+    def start(self, start_background_task):
+        """Start tjekkene i baggrunden - start_background_task skal starte en rigtig tråd (se start_thread i app.py)"""
+        if self.running:
+            return
+        self.running = True
+        start_background_task(self.run_forever)
+
+    def stop(self):
+        self.running = False
+
+    def is_ok(self, name):
+        return self.snapshot()[name]["ok"]
+
+    def snapshot(self):
+        """Kopi af seneste resultater - et tjek der har kørt længere end timeout er fejlet"""
+        now = time.monotonic()
+        with self.lock:
+            snapshot = {}
+            for name, result in self.results.items():
+                result = dict(result)
+                running_since = result.pop("running_since")
+                if running_since is not None and now - running_since > self.timeout:
+                    result["ok"] = False
+                    result["error"] = f"Tjek har ikke svaret i {round(now - running_since, 1)} sekunder"
+                snapshot[name] = result
+            return snapshot
@@ -0,0 +1,282 @@
+import collections
+import datetime
+import json
+import math
+import threading
+import time
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+import db
+from cache import meter_tag
+
+# Én forespørgsel kompileres én gang og genbruges til alle batches. Værdierne bindes som
+# parametre; pymysql samler executemany med en INSERT ... VALUES til én INSERT med mange rækker.
+INSERT_READINGS = text("""
+    INSERT INTO energimaaling (mac, tidspunkt, totalkwh)
+    VALUES (:mac, :tidspunkt, :totalkwh)
+""")
+
+# Statusskift fra stat/+/Power - samme batchskrivning som målingerne
+INSERT_STATUS = text("""
+    INSERT INTO maalerstatus (mac, tidspunkt, status, prioritet)
+    VALUES (:mac, :tidspunkt, :status, :prioritet)
+""")
+
+# Navne målerne bruger for målerstanden og tidspunktet i JSON-payloads
+VALUE_KEYS = ("totalKwh", "totalkwh", "total", "value", "energy")
+TIME_KEYS = ("tidspunkt", "timestamp", "time")
+
+def parse_time(value):
+    """Tidspunkt fra en payload som naiv UTC-datetime (epoch-sekunder eller ISO 8601)"""
+    if isinstance(value, (int, float)):
+        return datetime.datetime.utcfromtimestamp(value)
+    parsed = datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def parse_reading(mac, payload, received=None):
+    """Fortolk en payload fra maaler/<mac>/data som en måling.
+
+    payload er et tal (målerstand i kWh) eller et JSON-objekt med målerstanden under et af
+    navnene i VALUE_KEYS og evt. et tidspunkt. Uden tidspunkt bruges modtagelsestidspunktet.
+    Returnerer {"mac", "tidspunkt", "totalkwh"} eller None hvis payload ikke er en måling.
+    """
+    if isinstance(payload, (bytes, str)):
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            return None
+
+    tidspunkt = None
+    if isinstance(payload, dict):
+        value = next((payload[key] for key in VALUE_KEYS if key in payload), None)
+        raw_time = next((payload[key] for key in TIME_KEYS if payload.get(key) is not None), None)
+        if raw_time is not None:
+            try:
+                tidspunkt = parse_time(raw_time)
+            except (ValueError, OverflowError, OSError):
+                return None
+    else:
+        value = payload
+
+    if isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(value) or value < 0:
+        return None
+
+    return {
+        "mac": meter_tag(mac),
+        "tidspunkt": tidspunkt or received or datetime.datetime.utcnow(),
+        "totalkwh": round(value, 3)
+    }
+
+def is_transient(error):
+    """Fejl hvor de samme rækker kan lykkes ved næste forsøg (forbindelse, timeout, lås)"""
+    if isinstance(error, DBAPIError) and error.connection_invalidated:
+        return True
+    return isinstance(error, (OperationalError, InterfaceError, PoolTimeoutError))
+
+class ReadingWriter:
+    """Samler målinger og skriver dem til energimaaling i batches.
+
+    Med statement=INSERT_STATUS skrives statusskift til maalerstatus på samme måde.
+
+    En batch skrives når batch_size målinger venter, og ellers hvert flush_interval
+    sekund. Fejler skrivningen forbigående (forbindelse, timeout), beholdes målingerne til
+    næste forsøg - dog højst max_pending, hvorefter de ældste kasseres og tælles som tabt.
+    Afviser databasen batchen (f.eks. en ugyldig værdi), skrives rækkerne én ad gangen, og
+    de rækker der afvises, kasseres og tælles som afvist, så én dårlig række ikke
+    blokerer alle senere skrivninger.
+    """
+
+    def __init__(self, batch_size=500, flush_interval=1.0, max_pending=50000, on_flush=None,
+                 statement=INSERT_READINGS, label="målinger"):
+        self.statement = statement
+        self.label = label
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.on_flush = on_flush  # kaldes med de MAC-adresser der er skrevet
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pending = collections.deque()
+        self.running = False
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.last_batch_size = 0
+        self.last_flush_ms = None
+        self.started = time.monotonic()
+        self.recent = collections.deque(maxlen=1000)  # (monotonic tidspunkt, rækker) pr. batch
+
+    def add(self, reading):
+        with self.lock:
+            self.pending.append(reading)
+            while len(self.pending) > self.max_pending:
+                self.pending.popleft()
+                self.dropped += 1
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.wakeup.set()
+
+    def flush(self):
+        """Skriv de ventende målinger i batches af højst batch_size - returner antal skrevet"""
+        written = 0
+        with self.flush_lock:
+            while True:
+                with self.lock:
+                    batch = [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+                if not batch:
+                    return written
+
+                start = time.perf_counter()
+                requeued = False
+                try:
+                    with db.engine.begin() as connection:
+                        connection.execute(self.statement, batch)
+                except Exception as e:
+                    print(f"Fejl ved skrivning af {len(batch)} {self.label}: {e}")
+                    with self.lock:
+                        self.failures += 1
+                    if is_transient(e):
+                        with self.lock:
+                            # Læg dem forrest igen, så rækkefølgen bevares til næste forsøg
+                            self.pending.extendleft(reversed(batch))
+                        return written
+                    batch, requeued = self._write_rows(batch)
+
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                if batch:
+                    with self.lock:
+                        self.written += len(batch)
+                        self.batches += 1
+                        self.last_batch_size = len(batch)
+                        self.last_flush_ms = round(elapsed_ms, 2)
+                        self.recent.append((time.monotonic(), len(batch)))
+                    written += len(batch)
+
+                    if self.on_flush:
+                        self.on_flush({reading["mac"] for reading in batch})
+                if requeued:
+                    return written
+
+    def _write_rows(self, batch):
+        """Skriv rækkerne én ad gangen efter at databasen har afvist batchen.
+
+        Rækker der afvises, kasseres og tælles; ved en forbigående fejl lægges resten
+        tilbage i køen. Returnerer (skrevne rækker, om resten blev lagt tilbage).
+        """
+        written = []
+        for index, row in enumerate(batch):
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(self.statement, row)
+            except Exception as e:
+                if is_transient(e):
+                    with self.lock:
+                        self.pending.extendleft(reversed(batch[index:]))
+                    return written, True
+                print(f"Kasserer række afvist af databasen ({self.label}): {row} - {e}")
+                with self.lock:
+                    self.rejected += 1
+                continue
+            written.append(row)
+        return written, False
+
+    def run_forever(self):
+        while self.running:
+            # Vågn når en batch er fuld eller intervallet er gået
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+        self.flush()
+
+    def start(self, start_background_task):
+        if self.running:
+            return
+        self.running = True
+        start_background_task(self.run_forever)
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+
+    def stats(self, window=60):
+        """Skrevne målinger, batches og gennemløb (målinger pr. sekund det seneste minut)"""
+        now = time.monotonic()
+        with self.lock:
+            recent_rows = sum(rows for at, rows in self.recent if now - at <= window)
+            span = min(window, now - self.started) or 1
+            return {
+                "pending": len(self.pending),
+                "written": self.written,
+                "batches": self.batches,
+                "failures": self.failures,
+                "dropped": self.dropped,
+                "rejected": self.rejected,
+                "last_batch_size": self.last_batch_size,
+                "last_flush_ms": self.last_flush_ms,
+                "rows_per_sec": round(recent_rows / span, 2),
+                "avg_batch_size": round(self.written / self.batches, 1) if self.batches else None
+            }
+
+class PowerStates:
+    """Seneste tændt/slukket pr. måler i hukommelsen.
+
+    OpenBeken gentager sin Power-status (ved genforbindelse, som svar på kommandoer og
+    periodisk), så kun et egentligt skift lægges i writer og gemmes i maalerstatus.
+    Indlæses fra meter_latest ved opstart, så en gentagelse efter genstart ikke gemmes.
+    """
+
+    def __init__(self, writer, priority=10):
+        self.writer = writer
+        self.priority = priority
+        self.lock = threading.Lock()
+        self.states = {}  # mac -> "Tændt"/"Slukket"
+        self.changes = 0
+        self.repeats = 0
+
+    def load(self, states):
+        """Erstat indholdet med {mac: status}"""
+        with self.lock:
+            self.states = dict(states)
+        return len(self.states)
+
+    def get(self, mac):
+        with self.lock:
+            return self.states.get(mac)
+
+    def forget(self, mac):
+        with self.lock:
+            self.states.pop(mac, None)
+
+    def update(self, mac, status, tidspunkt=None):
+        """Registrer en status fra måleren - returnerer True hvis det var et skift"""
+        with self.lock:
+            if self.states.get(mac) == status:
+                self.repeats += 1
+                return False
+            self.states[mac] = status
+            self.changes += 1
+        self.writer.add({
+            "mac": mac,
+            "tidspunkt": tidspunkt or datetime.datetime.utcnow(),
+            "status": status,
+            "prioritet": self.priority
+        })
+        return True
+
+    def stats(self):
+        with self.lock:
+            counts = collections.Counter(self.states.values())
+            stats = {"meters": len(self.states), "states": dict(counts), "changes": self.changes, "repeats": self.repeats}
+        stats.update(self.writer.stats())
+        return stats
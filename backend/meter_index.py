@@ -0,0 +1,118 @@
+import threading
+from cache import meter_tag
+
+# Målernumre er tre cifre (000-999)
+NUMBER_COUNT = 1000
+
+def normalize_meter_number(number):
+    """Målernummer som tre cifre ('007') - None for tomt, ValueError for ugyldigt"""
+    if number is None:
+        return None
+    if isinstance(number, str):
+        number = number.strip()
+        if number == '':
+            return None
+        if not number.isdigit():
+            raise ValueError(f"Ugyldigt målernummer: {number}")
+    value = int(number)
+    if value < 0 or value >= NUMBER_COUNT:
+        raise ValueError(f"Målernummer skal være mellem 000 og {NUMBER_COUNT - 1}: {number}")
+    return f"{value:03d}"
+
+class MeterIndex:
+    """Kopi af maalerinfo i hukommelsen, slået op på MAC og på nummer.
+
+    Optagne numre holdes i en bitmaske (bit n sat = nummer n er i brug), så "er nummeret
+    ledigt?" og "laveste ledige nummer" besvares uden at gennemløbe målerne. Indekset
+    indlæses én gang og opdateres af skrivefunktionerne i db.py efter hver commit -
+    databasens unikke indeks på nummer er stadig det der afgør hvem der får et nummer.
+    MAC-adresser slås op i databasens format (meter_tag), uanset om de er skrevet med
+    kolon, små bogstaver eller obk-præfiks.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_mac = {}  # mac -> {"mac", "name", "nummer"}
+        self.by_number = {}  # nummer som int -> mac
+        self.used = 0  # bitmaske over optagne numre
+        self.loaded = False
+
+    def load(self, rows):
+        """Erstat indholdet med rækker af (mac, name, nummer)"""
+        with self.lock:
+            self.by_mac = {}
+            self.by_number = {}
+            self.used = 0
+            for mac, name, nummer in rows:
+                self._set(mac, name, nummer)
+            self.loaded = True
+
+    def set(self, mac, name, nummer):
+        with self.lock:
+            self._remove(mac)
+            self._set(mac, name, nummer)
+
+    def remove(self, mac):
+        with self.lock:
+            self._remove(mac)
+
+    def get(self, mac):
+        with self.lock:
+            meter = self.by_mac.get(meter_tag(mac))
+            return dict(meter) if meter else None
+
+    def all(self):
+        with self.lock:
+            return [dict(meter) for meter in self.by_mac.values()]
+
+    def holder(self, number):
+        """Måleren der har nummeret, eller None hvis det er ledigt"""
+        value = int(number)
+        with self.lock:
+            mac = self.by_number.get(value)
+            return dict(self.by_mac[mac]) if mac is not None else None
+
+    def is_free(self, number):
+        value = int(number)
+        with self.lock:
+            return not (self.used >> value) & 1
+
+    def next_free(self):
+        """Laveste ledige nummer som tre cifre, eller None hvis alle er i brug"""
+        with self.lock:
+            # (used + 1) & ~used isolerer den laveste bit der ikke er sat
+            lowest = ((self.used + 1) & ~self.used).bit_length() - 1
+        return f"{lowest:03d}" if lowest < NUMBER_COUNT else None
+
+    def free_count(self):
+        with self.lock:
+            return NUMBER_COUNT - bin(self.used).count("1")
+
+    def _set(self, mac, name, nummer):
+        mac = meter_tag(mac)
+        try:
+            normalized = normalize_meter_number(nummer)
+        except ValueError:
+            # Gamle ugyldige numre vises stadig, men optager ikke et nummer
+            normalized = None
+        self.by_mac[mac] = {"mac": mac, "name": name, "nummer": normalized if normalized is not None else nummer}
+        if normalized is not None:
+            value = int(normalized)
+            self.by_number[value] = mac
+            self.used |= 1 << value
+
+    def _remove(self, mac):
+        mac = meter_tag(mac)
+        meter = self.by_mac.pop(mac, None)
+        if meter is None:
+            return
+        try:
+            normalized = normalize_meter_number(meter["nummer"])
+        except ValueError:
+            return
+        if normalized is not None and self.by_number.get(int(normalized)) == mac:
+            value = int(normalized)
+            del self.by_number[value]
+            self.used &= ~(1 << value)
+
+meter_index = MeterIndex()
@@ -0,0 +1,281 @@
+import ast
+import datetime
+import os
+import re
+import sys
+from sqlalchemy import text, bindparam
+import db
+
+# Versionerede skemaændringer for målertabellerne.
+# Brug: python migrations.py [migrate|status|check]
+#   migrate - udfør manglende migreringer
+#   status  - vis hvilke migreringer der er udført
+#   check   - kør EXPLAIN på alle forespørgsler i db.py og fejl ved fuld tabelscanning
+
+MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT NOT NULL PRIMARY KEY,
+        navn VARCHAR(255) NOT NULL,
+        udfoert TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+def ensure_index(connection, table, name, columns, unique=False):
+    """Opret et indeks medmindre et tilsvarende indeks (samme forreste kolonner) allerede findes"""
+    result = connection.execute(text("""
+        SELECT INDEX_NAME, NON_UNIQUE, COLUMN_NAME
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table
+        ORDER BY INDEX_NAME, SEQ_IN_INDEX
+    """), {"table": table})
+
+    indexes = {}
+    for row in result:
+        index = indexes.setdefault(row.INDEX_NAME, {"unique": not row.NON_UNIQUE, "columns": []})
+        index["columns"].append(row.COLUMN_NAME.lower())
+
+    wanted = [column.lower() for column in columns]
+    for index_name, index in indexes.items():
+        if unique:
+            # Et unikt indeks skal dække præcis de ønskede kolonner
+            if index["unique"] and index["columns"] == wanted:
+                print(f"  {table}: unikt indeks {index_name} findes allerede")
+                return
+        elif index["columns"][:len(wanted)] == wanted:
+            print(f"  {table}: indeks {index_name} dækker allerede {', '.join(columns)}")
+            return
+
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    connection.execute(text(f"CREATE {kind} {name} ON {table} ({', '.join(columns)})"))
+    print(f"  {table}: oprettet {kind.lower()} {name} ({', '.join(columns)})")
+
+def unique_meter_numbers(connection):
+    """Gem målernumre som tre cifre og gør dem unikke, så databasen afviser dobbelt tildeling"""
+    connection.execute(text("UPDATE maalerinfo SET nummer = NULL WHERE TRIM(nummer) = ''"))
+    connection.execute(text("""
+        UPDATE maalerinfo SET nummer = LPAD(CAST(nummer AS UNSIGNED), 3, '0')
+        WHERE nummer REGEXP '^[0-9]{1,3}$'
+    """))
+    duplicates = connection.execute(text("""
+        SELECT nummer, GROUP_CONCAT(mac) AS macs FROM maalerinfo
+        WHERE nummer IS NOT NULL
+        GROUP BY nummer
+        HAVING COUNT(*) > 1
+    """)).fetchall()
+    if duplicates:
+        details = "; ".join(f"{row.nummer}: {row.macs}" for row in duplicates)
+        raise RuntimeError(f"Målernumre bruges af flere målere - ret dem og kør igen ({details})")
+    # Det unikke indeks bruges også til opslag på nummer
+    ensure_index(connection, "maalerinfo", "uq_maalerinfo_nummer", ["nummer"], unique=True)
+
+# (version, navn, funktion) - nye migreringer tilføjes altid sidst med næste versionsnummer
+MIGRATIONS = [
+    (1, "Indeks på energimaaling (mac, tidspunkt)",
+     lambda c: ensure_index(c, "energimaaling", "idx_energimaaling_mac_tidspunkt", ["mac", "tidspunkt"])),
+    (2, "Indeks på maalerstatus (mac, tidspunkt)",
+     lambda c: ensure_index(c, "maalerstatus", "idx_maalerstatus_mac_tidspunkt", ["mac", "tidspunkt"])),
+    (3, "Unikt indeks på energimaaling_daglig (mac, dato)",
+     lambda c: ensure_index(c, "energimaaling_daglig", "uq_energimaaling_daglig_mac_dato", ["mac", "dato"], unique=True)),
+    (4, "Unikt indeks på maalerinfo (mac)",
+     lambda c: ensure_index(c, "maalerinfo", "uq_maalerinfo_mac", ["mac"], unique=True)),
+    (5, "Unikke målernumre i maalerinfo (nummer)", unique_meter_numbers),
+]
+
+def get_applied_versions(connection):
+    connection.execute(text(MIGRATIONS_TABLE))
+    return {row[0] for row in connection.execute(text("SELECT version FROM schema_migrations"))}
+
+def pending_migrations():
+    """Returner de migreringer der endnu ikke er udført"""
+    with db.engine.begin() as connection:
+        applied = get_applied_versions(connection)
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+def migrate():
+    """Udfør alle manglende migreringer i versionsrækkefølge"""
+    pending = pending_migrations()
+    if not pending:
+        print("Databasen er opdateret - ingen migreringer mangler")
+        return True
+
+    for version, name, apply in pending:
+        print(f"Udfører migrering {version}: {name}")
+        try:
+            # DDL i MySQL committer implicit, så hver migrering registreres for sig
+            with db.engine.begin() as connection:
+                apply(connection)
+                connection.execute(
+                    text("INSERT INTO schema_migrations (version, navn) VALUES (:version, :navn)"),
+                    {"version": version, "navn": name}
+                )
+        except Exception as e:
+            print(f"Fejl ved migrering {version}: {e}")
+            return False
+    return True
+
+def status():
+    with db.engine.begin() as connection:
+        applied = get_applied_versions(connection)
+    for version, name, _ in MIGRATIONS:
+        mark = "x" if version in applied else " "
+        print(f"[{mark}] {version:3d} {name}")
+
+# Moduler hvis forespørgsler kontrolleres af check
+CHECKED_MODULES = ["db.py"]
+
+# Funktioner der bevidst gennemløber hele tabeller (vedligeholdelse og genopbygning,
+# og læsningerne fra historiktabellerne der kun bruges når meter_latest ikke er klar)
+MAINTENANCE_FUNCTIONS = {
+    "ensure_meter_latest", "_ensure_meter_latest", "rebuild_meter_latest", "load_meter_index",
+    "_overview_from_history", "_meter_info_from_history", "_meter_stats_from_history",
+    "_unnamed_meters_from_history", "_latest_statuses_from_history",
+}
+
+# meter_latest har én række pr. måler - det er meningen at oversigten læser hele tabellen
+FULL_SCAN_ALLOWED_TABLES = {"meter_latest"}
+
+# Eksempelværdier til bind-parametre i EXPLAIN
+SAMPLE_PARAMS = {
+    "mac": "00000000",
+    "limit": 200,
+    "days": 30,
+    "id": 1,
+    "number": "001",
+    "name": "Unavngivet",
+    "macs": ["00000000"],
+    "ids": [1],
+}
+
+# Parametre der bruges med IN og skal udfoldes til en liste
+EXPANDING_PARAMS = {"macs", "ids"}
+
+# Tidspunkt-parametre - udfyldes med det aktuelle tidspunkt
+DATETIME_PARAMS = {"tid", "start", "end", "bucket_start", "bucket_end"}
+
+def fstring_values():
+    """Værdier for udtrykkene i f-string-forespørgsler, pr. funktion.
+
+    Hver funktion får en liste af udfyldninger, og forespørgslen kontrolleres én gang pr.
+    udfyldning, så alle tabeller den kan ramme kommer med.
+    """
+    import rollup  # importeres her, fordi rollup selv importerer migrations
+    return {
+        "get_meters_info": [{"table": table} for table in ("maalerinfo", "energimaaling", "maalerstatus")],
+        "delete_meter": [{"table": table} for table in db.ROLLUP_TABLES],
+        "_read_rollup_points": [
+            {"rollup.table": r.table, "rollup.key_column": r.key_column} for r in rollup.ROLLUPS
+        ],
+    }
+
+def render_fstring(node, values):
+    """Udfyld en f-string med values (udtryk -> tekst) - None hvis et udtryk mangler"""
+    parts = []
+    for part in node.values:
+        if isinstance(part, ast.Constant):
+            parts.append(str(part.value))
+        elif isinstance(part, ast.FormattedValue) and ast.unparse(part.value) in values:
+            parts.append(str(values[ast.unparse(part.value)]))
+        else:
+            return None
+    return "".join(parts)
+
+def collect_queries(path, substitutions=None):
+    """Find alle text(...)-forespørgsler i et modul sammen med den funktion de står i.
+
+    f-strings udfyldes med substitutions (se fstring_values). Returnerer (forespørgsler,
+    sprunget over), hvor sprunget over er de text()-kald der ikke kunne laves til SQL.
+    """
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+
+    substitutions = substitutions or {}
+    queries = []
+    skipped = []
+    for function in ast.walk(tree):
+        if not isinstance(function, ast.FunctionDef) or function.name in MAINTENANCE_FUNCTIONS:
+            continue
+        for node in ast.walk(function):
+            if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "text"
+                    and node.args):
+                continue
+            argument = node.args[0]
+            if isinstance(argument, ast.Constant) and isinstance(argument.value, str):
+                candidates = [argument.value]
+            elif isinstance(argument, ast.JoinedStr):
+                candidates = [render_fstring(argument, values) for values in substitutions.get(function.name, [{}])]
+            else:
+                candidates = [None]
+            if None in candidates:
+                skipped.append((function.name, node.lineno, ast.unparse(argument)))
+                continue
+            for sql in dict.fromkeys(candidate.strip() for candidate in candidates):
+                if re.match(r"^(SELECT|WITH|UPDATE|DELETE)\b", sql, re.IGNORECASE):
+                    queries.append((function.name, node.lineno, sql))
+    return queries, skipped
+
+SQL_KEYWORDS = {"WHERE", "ON", "JOIN", "LEFT", "RIGHT", "INNER", "CROSS", "GROUP", "ORDER", "LIMIT", "SET", "UNION"}
+
+def table_aliases(sql):
+    """Map alias -> tabelnavn for FROM/JOIN i en forespørgsel (EXPLAIN viser aliaset)"""
+    aliases = {}
+    for table, alias in re.findall(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", sql, re.IGNORECASE):
+        aliases[table] = table
+        if alias and alias.upper() not in SQL_KEYWORDS:
+            aliases[alias] = table
+    return aliases
+
+def check():
+    """Kør EXPLAIN på alle forespørgsler og returner False hvis nogen laver fuld tabelscanning"""
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    failures = []
+    checked = 0
+
+    substitutions = fstring_values()
+
+    with db.engine.connect() as connection:
+        for module in CHECKED_MODULES:
+            queries, skipped = collect_queries(os.path.join(backend_dir, module), substitutions)
+            # En forespørgsel der ikke kan udfyldes er ikke kontrolleret - det skal ikke gå stille hen
+            for function, lineno, source in skipped:
+                failures.append(f"{module}:{lineno} {function}: kan ikke udfyldes til EXPLAIN (tilføj til fstring_values): {' '.join(source.split())[:80]}")
+            for function, lineno, sql in queries:
+                params = {name: SAMPLE_PARAMS.get(name) for name in re.findall(r"(?<![:\w]):(\w+)", sql)}
+                for name in DATETIME_PARAMS & params.keys():
+                    params[name] = datetime.datetime.now()
+                try:
+                    statement = text(f"EXPLAIN {sql}")
+                    for name in EXPANDING_PARAMS & params.keys():
+                        statement = statement.bindparams(bindparam(name, expanding=True))
+                    plan = connection.execute(statement, params)
+                except Exception as e:
+                    failures.append(f"{module}:{lineno} {function}: EXPLAIN fejlede: {e}")
+                    continue
+
+                checked += 1
+                aliases = table_aliases(sql)
+                for row in plan:
+                    step = row._mapping
+                    table = step.get("table") or ""
+                    table = aliases.get(table, table)
+                    # Afledte tabeller (<derived2>, <union1,2>) er resultater af andre trin
+                    if step.get("type") == "ALL" and not table.startswith("<") and table not in FULL_SCAN_ALLOWED_TABLES:
+                        failures.append(f"{module}:{lineno} {function}: fuld tabelscanning af {table}")
+
+    print(f"Kontrollerede {checked} forespørgsler")
+    for failure in failures:
+        print(f"FEJL: {failure}")
+    return not failures
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    if command == "migrate":
+        ok = migrate()
+    elif command == "status":
+        status()
+        ok = True
+    elif command == "check":
+        ok = check()
+    else:
+        print(f"Ukendt kommando: {command}. Brug migrate, status eller check")
+        ok = False
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,211 @@
+import collections
+import json
+import threading
+from cache import meter_tag
+
+# En fortolket besked som handlerne får: kind er rutens navn, mac målerens MAC i databasens
+# format (None hvis emnet ikke indeholder en måler), device emnets rå enhedsnavn (fx obkAABBCCDD),
+# captures emnets niveauer for + og #, payload den fortolkede payload og text den rå tekst
+Message = collections.namedtuple("Message", "kind topic mac device captures payload text received")
+
+def parse_json(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+def parse_float(text):
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+PAYLOAD_PARSERS = {
+    "json": parse_json,
+    "text": lambda text: text,
+    "float": parse_float,
+}
+
+class MacTable:
+    """Interning af MAC-adresser fra emner.
+
+    Hver måler sender på de samme få emner, så normaliseringen (meter_tag og formatet med
+    kolon som frontenden kender fra Power-beskeder) laves én gang pr. enhedsnavn og
+    slås derefter op. Den samme streng genbruges for alle beskeder fra måleren.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.table = {}  # enhedsnavn fra emnet -> (mac, mac med kolon)
+
+    def intern(self, device):
+        entry = self.table.get(device)
+        if entry is None:
+            mac = meter_tag(device)
+            entry = (mac, ":".join(mac[i:i + 2] for i in range(0, len(mac), 2)))
+            with self.lock:
+                if len(self.table) >= self.maxsize:
+                    self.table.clear()
+                entry = self.table.setdefault(device, entry)
+        return entry
+
+    def mac(self, device):
+        return self.intern(device)[0]
+
+    def colon_mac(self, device):
+        return self.intern(device)[1]
+
+class Route:
+    def __init__(self, pattern, kind, handler, payload="json", device_level=None):
+        if payload not in PAYLOAD_PARSERS:
+            raise ValueError(f"Ukendt payload-type for {pattern}: {payload}")
+        self.pattern = pattern
+        self.levels = tuple(pattern.split("/"))
+        if "#" in self.levels[:-1]:
+            raise ValueError(f"# må kun stå sidst i et emne: {pattern}")
+        self.kind = kind
+        self.handler = handler
+        self.payload = payload
+        self.parse = PAYLOAD_PARSERS[payload]
+        # Niveauet i emnet med enhedsnavnet - som standard det første +
+        self.device_level = device_level if device_level is not None else (
+            self.levels.index("+") if "+" in self.levels else None)
+        self.wildcard = "+" in self.levels or "#" in self.levels
+        self.multi = self.levels[-1] == "#"
+
+    def match(self, parts):
+        """Niveauerne der matcher + og # som tuple, eller None hvis emnet ikke matcher"""
+        levels = self.levels
+        if self.multi:
+            if len(parts) < len(levels) - 1:
+                return None
+            levels = levels[:-1]
+        elif len(parts) != len(levels):
+            return None
+        captures = []
+        for level, part in zip(levels, parts):
+            if level == "+":
+                captures.append(part)
+            elif level != part:
+                return None
+        if self.multi:
+            captures.append("/".join(parts[len(levels):]))
+        return tuple(captures)
+
+class TopicRouter:
+    """Sender MQTT-beskeder til handlere ud fra en tabel af emnemønstre.
+
+    Mønstre kan være eksakte eller indeholde + (ét niveau) og # (resten af emnet) som i
+    MQTT. Eksakte mønstre slås op direkte; et emne matches kun én gang mod mønstrene med
+    jokertegn, hvorefter resultatet huskes, så de faste emner fra målerne koster ét opslag.
+    Payload dekodes og fortolkes én gang pr. rute-type og gives til handleren som Message.
+    """
+
+    def __init__(self, macs=None, cache_size=20000):
+        self.macs = macs or MacTable()
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.exact = {}  # emne -> liste af ruter
+        self.wildcards = []
+        self.matches = {}  # emne -> (niveauer, ((rute, captures), ...))
+        self.stats_lock = threading.Lock()
+        self.counts = collections.Counter()
+        self.unmatched = 0
+        self.failed = 0
+
+    def add(self, pattern, kind, handler, payload="json", device_level=None):
+        route = Route(pattern, kind, handler, payload, device_level)
+        with self.lock:
+            if route.wildcard:
+                self.wildcards.append(route)
+            else:
+                self.exact.setdefault(pattern, []).append(route)
+            self.matches = {}
+        return route
+
+    def route(self, pattern, kind, payload="json", device_level=None):
+        """Dekoratorudgave af add"""
+        def decorator(handler):
+            self.add(pattern, kind, handler, payload, device_level)
+            return handler
+        return decorator
+
+    def patterns(self):
+        """Alle mønstre - til abonnementer hos MQTT-brokeren"""
+        with self.lock:
+            return list(dict.fromkeys(list(self.exact) + [route.pattern for route in self.wildcards]))
+
+    def resolve(self, topic):
+        """(emnets niveauer, ((rute, captures), ...)) - matches huskes pr. emne"""
+        resolved = self.matches.get(topic)
+        if resolved is not None:
+            return resolved
+        parts = tuple(topic.split("/"))
+        found = [(route, ()) for route in self.exact.get(topic, ())]
+        for route in self.wildcards:
+            captures = route.match(parts)
+            if captures is not None:
+                found.append((route, captures))
+        resolved = (parts, tuple(found))
+        with self.lock:
+            if len(self.matches) >= self.cache_size:
+                self.matches = {}
+            self.matches[topic] = resolved
+        return resolved
+
+    def key(self, topic):
+        """Målerens MAC for emnet (til fordeling på workers) - ellers selve emnet"""
+        parts, matched = self.resolve(topic)
+        for route, _ in matched:
+            if route.device_level is not None:
+                return self.macs.mac(parts[route.device_level])
+        return topic
+
+    def dispatch(self, topic, payload_bytes, received=None):
+        """Send beskeden til de matchende handlere - returner antal handlere kaldt"""
+        parts, matched = self.resolve(topic)
+        if not matched:
+            with self.stats_lock:
+                self.unmatched += 1
+            return 0
+
+        text = payload_bytes.decode() if isinstance(payload_bytes, (bytes, bytearray)) else payload_bytes
+        parsed = {}
+        handled = 0
+        for route, captures in matched:
+            if route.payload not in parsed:
+                parsed[route.payload] = route.parse(text)
+            device = parts[route.device_level] if route.device_level is not None else None
+            message = Message(
+                kind=route.kind,
+                topic=topic,
+                mac=self.macs.mac(device) if device else None,
+                device=device,
+                captures=captures,
+                payload=parsed[route.payload],
+                text=text,
+                received=received
+            )
+            try:
+                route.handler(message)
+                handled += 1
+            except Exception as e:
+                with self.stats_lock:
+                    self.failed += 1
+                print(f"Fejl i handler for {route.pattern} ({topic}): {e}")
+        with self.stats_lock:
+            for route, _ in matched:
+                self.counts[route.kind] += 1
+        return handled
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "routes": len(self.wildcards) + sum(len(routes) for routes in self.exact.values()),
+                "cached_topics": len(self.matches),
+                "interned_macs": len(self.macs.table),
+                "messages": dict(self.counts),
+                "unmatched": self.unmatched,
+                "failed": self.failed
+            }
@@ -0,0 +1,445 @@
+import sys
+import time
+from sqlalchemy import text
+import db
+from config import ROLLUP_CONFIG
+from migrations import ensure_index
+
+# Aggregerede tabeller bygget løbende fra energimaaling.
+# Brug: python rollup.py [run|backfill|status]
+#   run      - læg nye målinger til siden sidste kørsel
+#   backfill - slet og genopbyg tabellerne fra hele historikken
+#   status   - vis høj-vandmærke og efterslæb pr. tabel
+#
+# Hver tabel har et høj-vandmærke (seneste behandlede energimaaling.id) i rollup_state.
+# En kørsel lægger kun målingerne over høj-vandmærket til de eksisterende rækker, og
+# sammenlægning og nyt høj-vandmærke skrives i samme transaktion - en måling tælles
+# derfor præcis én gang, også hvis flere processer kører samtidig.
+
+ROLLUP_STATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS rollup_state (
+        navn VARCHAR(64) NOT NULL PRIMARY KEY,
+        hoejvande BIGINT NOT NULL DEFAULT 0,
+        opdateret TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    )
+"""
+
+class Rollup:
+    """En aggregeret tabel: skema, kolonner tilføjet senere og sammenlægnings-SQL.
+
+    merge_sql lægger målingerne med id i (:fra, :til] til tabellen med én mængdebaseret
+    INSERT ... SELECT ... ON DUPLICATE KEY UPDATE, og consumption_sql regner derefter
+    forbruget om for de berørte intervaller. Samme SQL bruges af den løbende opdatering
+    og af backfill, som blot starter fra høj-vandmærke 0.
+    """
+
+    def __init__(self, name, table, schema, added_columns, unique_index, merge_sql, key_column, bucket_seconds,
+                 consumption_sql=None):
+        self.name = name
+        self.table = table
+        self.schema = schema
+        self.added_columns = added_columns
+        self.unique_index = unique_index  # (navn, kolonner) - kræves af ON DUPLICATE KEY
+        self.merge_sql = merge_sql
+        self.consumption_sql = consumption_sql
+        self.key_column = key_column  # intervallets start (dato eller periode)
+        self.bucket_seconds = bucket_seconds
+
+    def ensure(self, connection):
+        connection.execute(text(self.schema))
+        columns = {
+            row[0] for row in connection.execute(text("""
+                SELECT COLUMN_NAME FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table
+            """), {"table": self.table})
+        }
+        for name, definition in self.added_columns.items():
+            if name not in columns:
+                connection.execute(text(f"ALTER TABLE {self.table} ADD COLUMN {name} {definition}"))
+                print(f"Tilføjet kolonne {self.table}.{name}")
+        index_name, index_columns = self.unique_index
+        ensure_index(connection, self.table, index_name, index_columns, unique=True)
+
+    def lock_state(self, connection):
+        """Lås tabellens række i rollup_state og returner høj-vandmærket"""
+        connection.execute(text("INSERT IGNORE INTO rollup_state (navn) VALUES (:navn)"), {"navn": self.name})
+        return connection.execute(
+            text("SELECT hoejvande FROM rollup_state WHERE navn = :navn FOR UPDATE"), {"navn": self.name}
+        ).scalar()
+
+    def run_chunk(self, upto, chunk_size):
+        """Læg næste stykke målinger (højst chunk_size id'er, ikke over upto) til tabellen.
+
+        Returnerer (nyt høj-vandmærke, MAC-adresser der blev ændret).
+        """
+        with db.engine.begin() as connection:
+            hwm = self.lock_state(connection)
+            if hwm >= upto:
+                return hwm, []
+            til = min(hwm + chunk_size, upto)
+            params = {"fra": hwm, "til": til}
+            macs = [
+                row[0] for row in connection.execute(text("""
+                    SELECT DISTINCT mac FROM energimaaling WHERE id > :fra AND id <= :til
+                """), params)
+            ]
+            if macs:
+                connection.execute(text(self.merge_sql), params)
+                if self.consumption_sql:
+                    connection.execute(text(self.consumption_sql), params)
+            connection.execute(
+                text("UPDATE rollup_state SET hoejvande = :til WHERE navn = :navn"),
+                {"til": til, "navn": self.name}
+            )
+            return til, macs
+
+    def run(self, upto, chunk_size, max_chunks=None):
+        """Læg målinger op til og med id upto til tabellen - returner ændrede MAC-adresser.
+
+        Med max_chunks stopper kørslen efter så mange stykker; resten tages næste gang.
+        """
+        changed = set()
+        hwm = None
+        chunks = 0
+        while (hwm is None or hwm < upto) and (max_chunks is None or chunks < max_chunks):
+            hwm, macs = self.run_chunk(upto, chunk_size)
+            changed.update(macs)
+            chunks += 1
+        return changed
+
+    def high_water_mark(self):
+        with db.engine.connect() as connection:
+            return connection.execute(
+                text("SELECT hoejvande FROM rollup_state WHERE navn = :navn"), {"navn": self.name}
+            ).scalar() or 0
+
+    def reset(self):
+        """Slet tabellens indhold og nulstil høj-vandmærket (før backfill)"""
+        with db.engine.begin() as connection:
+            self.lock_state(connection)
+            connection.execute(text(f"DELETE FROM {self.table}"))
+            connection.execute(text("UPDATE rollup_state SET hoejvande = 0 WHERE navn = :navn"), {"navn": self.name})
+
+def bucket_rollup(name, table, key_column, key_type, bucket, bucket_seconds, added_columns=None):
+    """Sammenlægning pr. måler og tidsinterval.
+
+    bucket er SQL-udtrykket der giver intervallets start ud fra tidspunkt. totalKwh er
+    målerstanden ved intervallets sidste måling. forbrugKwh er forbruget siden det
+    forrige intervals sidste måling - så forbruget mellem to intervaller ikke går tabt -
+    og for målerens første interval forbruget mellem intervallets første og sidste måling.
+    Tildelingerne i ON DUPLICATE KEY UPDATE udføres fra venstre mod højre, så værdierne
+    sammenlignes med de gamle tidspunkter før tidspunkterne opdateres.
+    """
+    schema = f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            mac VARCHAR(32) NOT NULL,
+            {key_column} {key_type} NOT NULL,
+            totalKwh DECIMAL(12, 3) NULL,
+            foerste_totalKwh DECIMAL(12, 3) NULL,
+            forbrugKwh DECIMAL(12, 3) NULL,
+            antal_maalinger INT NOT NULL DEFAULT 0,
+            foerste_tidspunkt DATETIME NULL,
+            sidste_tidspunkt DATETIME NULL,
+            UNIQUE KEY uq_{table}_mac_{key_column} (mac, {key_column})
+        )
+    """
+    merge_sql = f"""
+        INSERT INTO {table}
+            (mac, {key_column}, foerste_totalKwh, totalKwh, forbrugKwh, antal_maalinger, foerste_tidspunkt, sidste_tidspunkt)
+        SELECT v.mac, v.periode, v.start_kwh, v.slut_kwh, v.slut_kwh - v.start_kwh, v.antal, v.min_tid, v.max_tid
+        FROM (
+            SELECT
+                g.mac,
+                g.periode,
+                g.antal,
+                g.min_tid,
+                g.max_tid,
+                (SELECT f.totalkwh FROM energimaaling f
+                 WHERE f.mac = g.mac AND f.tidspunkt = g.min_tid
+                   AND f.id > :fra AND f.id <= :til AND f.totalkwh IS NOT NULL
+                 ORDER BY f.id LIMIT 1) AS start_kwh,
+                (SELECT s.totalkwh FROM energimaaling s
+                 WHERE s.mac = g.mac AND s.tidspunkt = g.max_tid
+                   AND s.id > :fra AND s.id <= :til AND s.totalkwh IS NOT NULL
+                 ORDER BY s.id DESC LIMIT 1) AS slut_kwh
+            FROM (
+                SELECT
+                    mac,
+                    {bucket} AS periode,
+                    COUNT(*) AS antal,
+                    MIN(tidspunkt) AS min_tid,
+                    MAX(tidspunkt) AS max_tid
+                FROM energimaaling
+                WHERE id > :fra AND id <= :til AND totalkwh IS NOT NULL
+                GROUP BY mac, {bucket}
+            ) g
+        ) v
+        ON DUPLICATE KEY UPDATE
+            foerste_totalKwh = IF(foerste_tidspunkt IS NULL OR VALUES(foerste_tidspunkt) < foerste_tidspunkt,
+                                  VALUES(foerste_totalKwh), foerste_totalKwh),
+            foerste_tidspunkt = IF(foerste_tidspunkt IS NULL OR VALUES(foerste_tidspunkt) < foerste_tidspunkt,
+                                   VALUES(foerste_tidspunkt), foerste_tidspunkt),
+            totalKwh = IF(sidste_tidspunkt IS NULL OR VALUES(sidste_tidspunkt) >= sidste_tidspunkt,
+                          VALUES(totalKwh), totalKwh),
+            sidste_tidspunkt = IF(sidste_tidspunkt IS NULL OR VALUES(sidste_tidspunkt) >= sidste_tidspunkt,
+                                  VALUES(sidste_tidspunkt), sidste_tidspunkt),
+            antal_maalinger = antal_maalinger + VALUES(antal_maalinger),
+            forbrugKwh = totalKwh - foerste_totalKwh
+    """
+    # Forbruget regnes om fra det tidligste interval målingerne i stykket ramte pr. måler:
+    # ændres et intervals slutstand, ændres også forbruget i det næste. Den afledte tabel n
+    # har en underforespørgsel i SELECT-listen og materialiseres derfor, så MySQL tillader
+    # at den læser den tabel der opdateres.
+    consumption_sql = f"""
+        UPDATE {table} t
+        JOIN (
+            SELECT
+                c.id,
+                (SELECT p.totalKwh FROM {table} p
+                 WHERE p.mac = c.mac AND p.{key_column} < c.{key_column}
+                 ORDER BY p.{key_column} DESC LIMIT 1) AS forrige_kwh
+            FROM {table} c
+            JOIN (
+                SELECT mac, MIN({bucket}) AS fra_periode
+                FROM energimaaling
+                WHERE id > :fra AND id <= :til AND totalkwh IS NOT NULL
+                GROUP BY mac
+            ) r ON r.mac = c.mac AND c.{key_column} >= r.fra_periode
+        ) n ON n.id = t.id
+        SET t.forbrugKwh = t.totalKwh - COALESCE(n.forrige_kwh, t.foerste_totalKwh)
+    """
+    return Rollup(
+        name=name,
+        table=table,
+        schema=schema,
+        added_columns=added_columns or {},
+        unique_index=(f"uq_{table}_mac_{key_column}", ["mac", key_column]),
+        merge_sql=merge_sql,
+        key_column=key_column,
+        bucket_seconds=bucket_seconds,
+        consumption_sql=consumption_sql
+    )
+
+def danish_time_sql(column):
+    """SQL der omregner et UTC-tidspunkt til dansk tid: CET, og CEST fra sidste søndag i
+    marts til sidste søndag i oktober kl. 01:00 UTC (EU's regler). Regnes i SQL, så MySQL's
+    tidszonetabeller ikke skal være indlæst som CONVERT_TZ med et zonenavn kræver."""
+    def dst_change(month):
+        # Sidste søndag i måneden (marts og oktober har 31 dage) kl. 01:00 UTC
+        last_day = f"CAST(CONCAT(YEAR({column}), '-{month}-31') AS DATE)"
+        return f"TIMESTAMPADD(HOUR, 1, DATE_SUB({last_day}, INTERVAL DAYOFWEEK({last_day}) - 1 DAY))"
+    return (f"TIMESTAMPADD(HOUR, IF({column} >= {dst_change('03')} AND {column} < {dst_change('10')}, 2, 1), "
+            f"{column})")
+
+# Målingernes tidspunkt er UTC; døgn og måneder afgrænses efter dansk tid
+LOCAL_TIME = danish_time_sql("tidspunkt")
+
+QUARTER_ROLLUP = bucket_rollup(
+    "energimaaling_kvarter", "energimaaling_kvarter", "periode", "DATETIME",
+    "TIMESTAMPADD(MINUTE, MINUTE(tidspunkt) DIV 15 * 15, DATE_FORMAT(tidspunkt, '%Y-%m-%d %H:00:00'))",
+    15 * 60
+)
+
+HOURLY_ROLLUP = bucket_rollup(
+    "energimaaling_time", "energimaaling_time", "periode", "DATETIME",
+    "CAST(DATE_FORMAT(tidspunkt, '%Y-%m-%d %H:00:00') AS DATETIME)",
+    60 * 60
+)
+
+# Døgn er danske kalenderdøgn. Tabellen blev tidligere fyldt udefra med kun mac, dato og
+# totalKwh. Navnet i rollup_state er nyt, fordi døgnene før var UTC-døgn: tabellen
+# opdateres først løbende igen når backfill har bygget den om.
+DAILY_ROLLUP = bucket_rollup(
+    "energimaaling_daglig_dk", "energimaaling_daglig", "dato", "DATE",
+    f"DATE({LOCAL_TIME})",
+    24 * 60 * 60,
+    added_columns={
+        "foerste_totalKwh": "DECIMAL(12, 3) NULL",
+        "forbrugKwh": "DECIMAL(12, 3) NULL",
+        "antal_maalinger": "INT NOT NULL DEFAULT 0",
+        "foerste_tidspunkt": "DATETIME NULL",
+        "sidste_tidspunkt": "DATETIME NULL",
+    }
+)
+
+# Danske kalendermåneder (nyt navn i rollup_state af samme grund som døgnene).
+# En måned regnes som gennemsnitlige 30,44 døgn når opløsningen vælges
+MONTHLY_ROLLUP = bucket_rollup(
+    "energimaaling_maanedlig_dk", "energimaaling_maanedlig", "maaned", "DATE",
+    f"CAST(DATE_FORMAT({LOCAL_TIME}, '%Y-%m-01') AS DATE)",
+    int(30.44 * 24 * 60 * 60)
+)
+
+# Alle aggregerede tabeller fra fineste til groveste opløsning
+ROLLUPS = [QUARTER_ROLLUP, HOURLY_ROLLUP, DAILY_ROLLUP, MONTHLY_ROLLUP]
+
+# Opløsninger en klient kan bede om med ?resolution=
+RESOLUTIONS = {
+    "15min": QUARTER_ROLLUP,
+    "hour": HOURLY_ROLLUP,
+    "day": DAILY_ROLLUP,
+    "month": MONTHLY_ROLLUP,
+}
+
+def choose_rollup(start, end, points):
+    """Vælg den groveste tabel der stadig giver mindst points intervaller i [start, end].
+
+    Returnerer None når selv den fineste tabel har for få intervaller - så læses de rå
+    målinger.
+    """
+    span = (end - start).total_seconds()
+    for rollup in reversed(ROLLUPS):
+        if span / rollup.bucket_seconds >= points:
+            return rollup
+    return None
+
+def ensure_rollups():
+    """Opret rollup_state og de aggregerede tabeller med manglende kolonner og indeks"""
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(text(ROLLUP_STATE_TABLE))
+            for rollup in ROLLUPS:
+                rollup.ensure(connection)
+        return True
+    except Exception as e:
+        print(f"Fejl ved oprettelse af aggregerede tabeller: {e}")
+        return False
+
+def max_reading_id():
+    with db.engine.connect() as connection:
+        return connection.execute(text("SELECT COALESCE(MAX(id), 0) FROM energimaaling")).scalar()
+
+class RollupRunner:
+    """Holder de aggregerede tabeller opdateret i baggrunden.
+
+    En kørsel behandler kun målinger op til det højeste id fra den forrige kørsel. En
+    INSERT der har fået sit id men endnu ikke er committet, når derved at blive synlig
+    før høj-vandmærket passerer den.
+
+    Hver kørsel behandler højst max_chunks stykker pr. tabel, så webserveren aldrig
+    bruger lang tid på et stort efterslæb. En tabel der aldrig er bygget (høj-vandmærke 0)
+    springes over: hele historikken lægges sammen med python rollup.py backfill.
+    """
+
+    def __init__(self, rollups, interval, chunk_size, max_chunks=None, on_change=None):
+        self.rollups = rollups
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.built = set()  # navne på tabeller der er bygget første gang
+        self.waiting_for_backfill = set()
+        self.on_change = on_change  # kaldes med de MAC-adresser der er ændret
+        self.seen_max = None
+        self.running = False
+        self.last_run = None
+        self.last_duration_ms = None
+
+    def run_once(self):
+        current = max_reading_id()
+        upto, self.seen_max = self.seen_max, current
+        if upto is None:
+            return set()
+
+        start = time.perf_counter()
+        changed = set()
+        for rollup in self.rollups:
+            if not self.is_built(rollup, upto):
+                continue
+            changed.update(rollup.run(upto, self.chunk_size, self.max_chunks))
+        self.last_duration_ms = round((time.perf_counter() - start) * 1000, 2)
+        self.last_run = time.time()
+
+        if changed:
+            print(f"Aggregerede tabeller opdateret til id {upto} for {len(changed)} målere på {self.last_duration_ms} ms")
+            if self.on_change:
+                self.on_change(changed)
+        return changed
+
+    def is_built(self, rollup, upto):
+        """Er tabellen bygget (backfill er kørt) eller er der ingen målinger endnu?"""
+        if rollup.name in self.built:
+            return True
+        if upto > 0 and rollup.high_water_mark() == 0:
+            if rollup.name not in self.waiting_for_backfill:
+                self.waiting_for_backfill.add(rollup.name)
+                print(f"{rollup.table} er ikke bygget - kør 'python rollup.py backfill' før den opdateres løbende")
+            return False
+        self.built.add(rollup.name)
+        self.waiting_for_backfill.discard(rollup.name)
+        return True
+
+    def run_forever(self, sleep=time.sleep):
+        while self.running:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Fejl ved opdatering af aggregerede tabeller: {e}")
+            sleep(self.interval)
+
+    def start(self, start_background_task):
+        if self.running:
+            return
+        self.running = True
+        start_background_task(self.run_forever)
+
+    def stop(self):
+        self.running = False
+
+def backfill(chunk_size=None):
+    """Genopbyg alle aggregerede tabeller fra hele historikken"""
+    chunk_size = chunk_size or ROLLUP_CONFIG['chunk_size']
+    if not ensure_rollups():
+        return False
+    upto = max_reading_id()
+    for rollup in ROLLUPS:
+        start = time.perf_counter()
+        try:
+            rollup.reset()
+            hwm = 0
+            while hwm < upto:
+                hwm, _ = rollup.run_chunk(upto, chunk_size)
+                print(f"  {rollup.table}: {hwm}/{upto} målinger behandlet")
+        except Exception as e:
+            print(f"Fejl ved genopbygning af {rollup.table}: {e}")
+            return False
+        print(f"{rollup.table} genopbygget på {time.perf_counter() - start:.1f} sekunder")
+    return True
+
+def run():
+    """Læg alle målinger til som findes nu (bruges fra kommandolinjen uden forsinkelse)"""
+    if not ensure_rollups():
+        return False
+    upto = max_reading_id()
+    try:
+        for rollup in ROLLUPS:
+            changed = rollup.run(upto, ROLLUP_CONFIG['chunk_size'])
+            print(f"{rollup.table}: opdateret til id {upto} for {len(changed)} målere")
+    except Exception as e:
+        print(f"Fejl ved opdatering af aggregerede tabeller: {e}")
+        return False
+    return True
+
+def status():
+    if not ensure_rollups():
+        return False
+    upto = max_reading_id()
+    with db.engine.connect() as connection:
+        state = dict(connection.execute(text("SELECT navn, hoejvande FROM rollup_state")).fetchall())
+    for rollup in ROLLUPS:
+        hwm = state.get(rollup.name, 0)
+        print(f"{rollup.table}: høj-vandmærke {hwm}, {upto - hwm} målinger mangler")
+    return True
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "run"
+    if command == "run":
+        ok = run()
+    elif command == "backfill":
+        ok = backfill()
+    elif command == "status":
+        ok = status()
+    else:
+        print(f"Ukendt kommando: {command}. Brug run, backfill eller status")
+        ok = False
+    sys.exit(0 if ok else 1)
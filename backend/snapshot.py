@@ -0,0 +1,156 @@
+import datetime
+import json
+import os
+import threading
+import time
+from decimal import Decimal
+from cache import meter_cache, change_versions, meter_tag, FLEET_TAG
+from db import get_all_meters, get_meters_info, DatabaseReadError
+
+SNAPSHOT_FORMAT = 1
+
+def _json_default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return obj.isoformat()
+    raise TypeError(f"Kan ikke gemme {type(obj).__name__} i snapshot")
+
+class FleetSnapshot:
+    """Varm start: oversigt og målerinfo gemt på disk og lagt i cachen ved opstart.
+
+    Ved opstart lægges snapshottet i meter_cache, så de første kald besvares med det
+    samme - markeret som forældet - mens en baggrundsopgave henter det aktuelle billede
+    fra databasen. Først når det er hentet, er cachen varm (warm) og backenden klar.
+    Derefter skrives snapshottet igen med fast interval, når flåden har ændret sig.
+    """
+
+    def __init__(self, path, interval):
+        self.path = path  # None: ingen fil - kun opvarmning af cachen
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stale_values = {}  # cachenøgle -> værdien fra snapshottet
+        self.snapshot_time = None  # hvornår det indlæste snapshot blev skrevet (epoch)
+        self.written_version = None
+        self.warm = False
+        self.running = False
+
+    def load(self):
+        """Læg snapshottet fra disk i cachen - returner antal målere"""
+        if not self.path:
+            return 0
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            print(f"Intet snapshot i {self.path} - starter med kold cache")
+            return 0
+        except Exception as e:
+            print(f"Kunne ikke læse snapshot {self.path}: {e}")
+            return 0
+        if data.get("format") != SNAPSHOT_FORMAT or not data.get("meters"):
+            print(f"Snapshot {self.path} har ukendt format eller ingen målere - ignoreres")
+            return 0
+
+        with self.lock:
+            self.snapshot_time = data.get("written")
+            self._seed(('meters',), data["meters"], (FLEET_TAG,))
+            for mac, meter in data.get("details", {}).items():
+                self._seed(('meter', mac), meter, (meter_tag(mac),))
+        age = time.time() - (self.snapshot_time or time.time())
+        print(f"Indlæst snapshot med {len(data['meters'])} målere ({age:.0f} sekunder gammelt)")
+        return len(data["meters"])
+
+    def _seed(self, key, value, tags):
+        meter_cache.set(key, value, tags)
+        self.stale_values[key] = value
+
+    def is_stale(self, key, value):
+        """Er value den forældede værdi fra snapshottet (og ikke hentet fra databasen)?"""
+        with self.lock:
+            return self.stale_values.get(key) is value
+
+    def age(self):
+        return time.time() - self.snapshot_time if self.snapshot_time else None
+
+    def fetch(self):
+        """Aktuel oversigt og målerinfo fra databasen - None hvis databasen ikke svarer"""
+        try:
+            meters = get_all_meters()
+        except DatabaseReadError:
+            return None
+        details = get_meters_info([meter["mac"] for meter in meters])
+        if "error" in details:
+            return None
+        return meters, {meter["mac"]: meter for meter in details["meters"]}
+
+    def revalidate(self):
+        """Erstat snapshottets værdier i cachen med data fra databasen og marker cachen varm"""
+        # Målere der ændres mens der hentes, gemmes ikke med de data der nu er forældede
+        since = meter_cache.mark()
+        fetched = self.fetch()
+        if fetched is None:
+            return False
+        meters, details = fetched
+
+        with self.lock:
+            stale_macs = [key[1] for key in self.stale_values if key[0] == 'meter']
+            self.stale_values.clear()
+            meter_cache.set(('meters',), meters, (FLEET_TAG,), since=since)
+            for mac, meter in details.items():
+                meter_cache.set(('meter', mac), meter, (meter_tag(mac),), since=since)
+            self.warm = True
+
+        # Klienter der fik snapshottet skal hente de friske data
+        change_versions.bump(FLEET_TAG)
+        for mac in set(stale_macs) | set(details):
+            change_versions.bump(meter_tag(mac))
+        print(f"Cache varm med {len(meters)} målere fra databasen")
+        self.write(fetched)
+        return True
+
+    def write(self, fetched=None):
+        """Skriv snapshottet hvis flåden har ændret sig siden sidst"""
+        if not self.path:
+            return False
+        version = change_versions.get(FLEET_TAG)[0]
+        if fetched is None and version == self.written_version:
+            return False
+        fetched = fetched or self.fetch()
+        if fetched is None or not fetched[0]:
+            return False
+        meters, details = fetched
+
+        data = {"format": SNAPSHOT_FORMAT, "written": time.time(), "meters": meters, "details": details}
+        # Skriv til en midlertidig fil og erstat, så et afbrudt skriv aldrig efterlader et halvt snapshot
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"), default=_json_default)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"Kunne ikke skrive snapshot {self.path}: {e}")
+            return False
+        self.written_version = version
+        return True
+
+    def run_forever(self, sleep=time.sleep):
+        while self.running:
+            try:
+                if not self.warm:
+                    self.revalidate()
+                else:
+                    self.write()
+            except Exception as e:
+                print(f"Fejl i snapshot-opgaven: {e}")
+            # Indtil cachen er varm prøves der igen hurtigt
+            sleep(self.interval if self.warm else min(self.interval, 5))
+
+    def start(self, start_background_task):
+        if self.running:
+            return
+        self.running = True
+        start_background_task(self.run_forever)
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,151 @@
+import collections
+import threading
+import time
+import zlib
+
+# Hvad der sker når køen er fuld
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+class WorkQueue:
+    """Begrænset kø mellem MQTT-klientens netværkstråd og behandlingen af beskeder.
+
+    put() lægger kun beskeden i kø og returnerer med det samme, så paho's netværkstråd
+    aldrig venter på databasen eller Socket.IO. Beskederne fordeles på workers efter en
+    nøgle (målerens MAC), så beskeder fra samme måler altid behandles i den rækkefølge de kom.
+
+    Ved fuld kø gælder policy:
+      drop_oldest - den ældste ventende besked kasseres (nyeste data er vigtigst)
+      drop_newest - den nye besked kasseres
+      block       - put venter højst block_timeout sekunder og kasserer derefter den nye
+
+    Kasserede beskeder tælles i stats() og logges højst én gang pr. log_interval sekunder,
+    så loggen ikke oversvømmes under netop den overbelastning den melder om.
+    """
+
+    def __init__(self, handler, workers=2, maxsize=10000, policy="drop_oldest", block_timeout=1.0,
+                 name="køen", log_interval=10.0):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Ukendt overflow-politik: {policy}. Brug en af {', '.join(OVERFLOW_POLICIES)}")
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.shard_size = max(1, -(-maxsize // self.workers))  # loft af maxsize / workers
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.name = name
+        self.log_interval = log_interval
+        self.shards = [collections.deque() for _ in range(self.workers)]
+        self.conditions = [threading.Condition() for _ in range(self.workers)]
+        self.stats_lock = threading.Lock()
+        self.running = False
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.dropped_since_log = 0
+        self.last_drop_log = None
+        self.last_drop = None
+        self.max_depth = 0
+        self.busy_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def put(self, key, *item):
+        """Læg en besked i kø - returnerer False hvis en besked blev kasseret"""
+        index = zlib.crc32(key.encode()) % self.workers
+        shard = self.shards[index]
+        condition = self.conditions[index]
+        accepted = True
+        with condition:
+            if len(shard) >= self.shard_size:
+                if self.policy == "drop_oldest":
+                    shard.popleft()
+                    accepted = False
+                elif self.policy == "block":
+                    condition.wait_for(lambda: len(shard) < self.shard_size, self.block_timeout)
+                if len(shard) >= self.shard_size:
+                    self._count(dropped=1)
+                    return False
+            shard.append((time.monotonic(), item))
+            depth = len(shard)
+            condition.notify_all()
+        self._count(enqueued=1, dropped=0 if accepted else 1, depth=depth)
+        return accepted
+
+    def _count(self, enqueued=0, dropped=0, depth=0):
+        report = 0
+        with self.stats_lock:
+            self.enqueued += enqueued
+            self.dropped += dropped
+            self.max_depth = max(self.max_depth, depth)
+            if dropped:
+                now = time.monotonic()
+                self.last_drop = now
+                self.dropped_since_log += dropped
+                if self.last_drop_log is None or now - self.last_drop_log >= self.log_interval:
+                    report, self.dropped_since_log, self.last_drop_log = self.dropped_since_log, 0, now
+        if report:
+            # Med drop_oldest er det de ældste ventende beskeder der kasseres, ellers de nye
+            which = "ældste ventende" if self.policy == "drop_oldest" else "nye"
+            print(f"{self.name} er fuld: {report} {which} beskeder kasseret siden sidste melding "
+                  f"({self.dropped} i alt, politik {self.policy})")
+
+    def worker(self, index):
+        shard = self.shards[index]
+        condition = self.conditions[index]
+        while self.running or shard:
+            with condition:
+                if not condition.wait_for(lambda: shard or not self.running, 1.0):
+                    continue
+                if not shard:
+                    continue
+                queued_at, item = shard.popleft()
+                # Gør plads til en blokeret put
+                condition.notify_all()
+
+            start = time.monotonic()
+            ok = True
+            try:
+                self.handler(*item)
+            except Exception as e:
+                ok = False
+                print(f"Fejl ved behandling af besked fra køen: {e}")
+            done = time.monotonic()
+
+            with self.stats_lock:
+                self.processed += 1
+                self.failed += 0 if ok else 1
+                self.busy_ms += (done - start) * 1000
+                self.max_wait_ms = max(self.max_wait_ms, (start - queued_at) * 1000)
+
+    def start(self, start_background_task):
+        if self.running:
+            return
+        self.running = True
+        for index in range(self.workers):
+            start_background_task(self.worker, index)
+
+    def stop(self):
+        self.running = False
+        for condition in self.conditions:
+            with condition:
+                condition.notify_all()
+
+    def depth(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "workers": self.workers,
+                "policy": self.policy,
+                "capacity": self.shard_size * self.workers,
+                "depth": self.depth(),
+                "shard_depths": [len(shard) for shard in self.shards],
+                "max_shard_depth": self.max_depth,
+                "enqueued": self.enqueued,
+                "processed": self.processed,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "seconds_since_drop": round(time.monotonic() - self.last_drop, 1) if self.last_drop is not None else None,
+                "avg_processing_ms": round(self.busy_ms / self.processed, 3) if self.processed else None,
+                "max_wait_ms": round(self.max_wait_ms, 2)
+            }
@@ -36,14 +36,35 @@ export const meterService = {
     return api.get(`/meters/${mac}`)
   },
   
-  // Hent måleraflæsninger
-  getReadings(mac, limit = 200) {
-    return api.get(`/meters/${mac}/readings`, { params: { limit } })
+  // Hent flere målere i ét kald
+  getMetersBatch(macs) {
+    return api.post('/meters/batch', { macs })
+  },
+  
+  // Hent måleraflæsninger (format: 'columns' giver kolonneformat med epoch-sekunder)
+  getReadings(mac, limit = 200, format) {
+    return api.get(`/meters/${mac}/readings`, { params: { limit, format } })
+  },
+  
+  // Hent måleraflæsninger i et tidsrum, nedsamplet til højst points punkter
+  // (resolution: 'auto' vælger selv kvarter-, time-, dag- eller månedstabellen)
+  getReadingsRange(mac, from, to, points = 1000, resolution) {
+    return api.get(`/meters/${mac}/readings`, { params: { from, to, points, resolution } })
+  },
+  
+  // Hent en side af måleraflæsninger via cursor (before: ældre, after: nyere)
+  getReadingsPage(mac, { before, after, limit = 200 } = {}) {
+    return api.get(`/meters/${mac}/readings`, { params: { limit, before, after } })
+  },
+  
+  // Hent statistik for måler (antal målinger, første og seneste måling)
+  getStats(mac) {
+    return api.get(`/meters/${mac}/stats`)
   },
   
   // Hent daglige aflæsninger
-  getDailyReadings(mac, days = 30) {
-    return api.get(`/meters/${mac}/daily`, { params: { days } })
+  getDailyReadings(mac, days = 30, format) {
+    return api.get(`/meters/${mac}/daily`, { params: { days, format } })
   },
   
   // Opdater målernavn
@@ -71,6 +92,21 @@ export const meterService = {
     return api.post(`/meters/${mac}/off`)
   },
   
+  // Tænd eller sluk mange målere: { action, macs } eller { action, filter, prefix, from, to }
+  setPowerBulk(request) {
+    return api.post('/meters/power', request)
+  },
+  
+  // Status for et samlet tænd/sluk-job
+  getPowerJob(id) {
+    return api.get(`/meters/power/${id}`)
+  },
+  
+  // Status for en tænd/sluk-kommando
+  getCommand(id) {
+    return api.get(`/commands/${id}`)
+  },
+  
   // Scan efter nye målere
   scanForMeters() {
     return api.post('/scan')
@@ -449,10 +449,8 @@ export default createStore({
         console.log('Socket.io forbindelse afbrudt')
       })
       
-      // Lyt efter MQTT-beskeder
-      this.state.socket.on('mqtt_message', ({ topic, payload }) => {
-        console.log(`Modtaget MQTT-besked: ${topic}`, payload)
-        
+      // Håndter én MQTT-besked
+      const handleMqttMessage = ({ topic, payload }) => {
         // Håndter forskellige beskedtyper
         if (topic.includes('/status')) {
           const mac = topic.split('/')[1]
@@ -480,6 +478,36 @@ export default createStore({
               ...this.state.meterReadings.slice(0, 199) // Behold kun de seneste 200
             ])
           }
+        } else if (payload && payload.mac) {
+          // El-værdier fra OpenBeken (SENSOR, STATE og <enhed>/<værdi>/get)
+          const values = {}
+          ;['voltage', 'current', 'active_power', 'total'].forEach(field => {
+            if (payload[field] !== undefined) values[field] = payload[field]
+          })
+          if (Object.keys(values).length > 0) {
+            commit('UPDATE_METER', { mac: payload.mac, ...values, lastSeen: new Date().toISOString() })
+          }
+        }
+      }
+      
+      // Lyt efter MQTT-beskeder (enkeltvis når backenden ikke samler dem)
+      this.state.socket.on('mqtt_message', (message) => {
+        console.log(`Modtaget MQTT-besked: ${message.topic}`, message.payload)
+        handleMqttMessage(message)
+      })
+      
+      // Backenden sender den nyeste besked pr. emne samlet i ét event pr. vindue
+      this.state.socket.on('mqtt_batch', (messages) => {
+        console.log(`Modtaget ${messages.length} MQTT-beskeder`)
+        messages.forEach(handleMqttMessage)
+      })
+      
+      // Resultat af en tænd/sluk-kommando (kvitteret, udløbet eller fejlet)
+      this.state.socket.on('power_command_result', (command) => {
+        if (command.state === 'acknowledged') {
+          console.log(`Kommando ${command.action} til ${command.mac} kvitteret efter ${command.latency_ms} ms`)
+        } else {
+          console.warn(`Kommando ${command.action} til ${command.mac} ${command.state}: ${command.error}`)
         }
       })
       